@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Measure the cost of Upload Service API calls made the way ``hca upload files`` makes them: one
+``file_upload_notification`` per file, from several threads.
+
+A stub Upload Service is started on localhost. The same notifications are sent first with a new connection and a
+freshly loaded upload config per request, as ApiClient used to, and then through ApiClient and its pooled session.
+The stub speaks plain HTTP, so the savings against the real, TLS-terminated service are larger than shown here.
+
+  python benchmarks/upload_api_client.py --requests 2000 --threads 8
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  # noqa
+
+from hca.upload import UploadConfig
+from hca.upload.lib.api_client import ApiClient
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    _lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self._lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def unpooled_notification(base_url, area_uuid, filename):
+    UploadConfig()
+    return requests.post("{}/area/{}/{}".format(base_url, area_uuid, filename)).ok
+
+
+def run(label, server, notify, args):
+    server.connections = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        for ok in executor.map(notify, ("file{}".format(i) for i in range(args.requests))):
+            assert ok
+    elapsed = time.perf_counter() - start
+    print("{:<10} {:8.2f}s {:10.0f} requests/s {:8d} connections".format(
+        label, elapsed, args.requests / elapsed, server.connections))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}/v1".format(server.server_address[1])
+    area_uuid = "deadbeef-dead-dead-dead-beeeeeeeeeef"
+
+    run("unpooled", server, lambda filename: unpooled_notification(base_url, area_uuid, filename), args)
+    client = ApiClient(deployment_stage="test")
+    client._base_url = base_url
+    run("pooled", server, lambda filename: client.file_upload_notification(area_uuid, filename), args)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
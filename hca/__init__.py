@@ -1,9 +1,16 @@
 from .config import HCAConfig, get_config, logger
-from . import dss, upload, auth
+from ._lazy import lazy_import
+
+dss = lazy_import(__name__ + ".dss")
+upload = lazy_import(__name__ + ".upload")
+auth = lazy_import(__name__ + ".auth")
 
 
 def clear_hca_cache(args):
     """Clear the cached HCA API definitions. This can help resolve errors communicating with the API."""
     from hca.util import SwaggerClient
+    # Make sure the SwaggerClient subclasses have been defined
+    from hca.dss import DSSClient  # noqa
+    from hca.auth import AuthClient  # noqa
     for swagger_client in SwaggerClient.__subclasses__():
         swagger_client().clear_cache()
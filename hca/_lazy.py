@@ -0,0 +1,33 @@
+"""
+Deferred imports.
+
+Running a CLI command should only pay for importing the modules behind that command. ``lazy_import`` returns a
+stand-in module object that performs the real import the first time one of its attributes is accessed, so heavy
+dependencies (boto3, docutils, jwt, ...) can be bound at the top of a module without being loaded until they are used.
+"""
+import importlib
+import types
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the stand-in itself. The real module is looked up on every access so
+        # that it is picked up from sys.modules (and honors e.g. mock.patch) once imported.
+        return getattr(importlib.import_module(self.__name__), attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+    def __repr__(self):
+        return "<lazily imported module {!r}>".format(self.__name__)
+
+
+def lazy_import(name):
+    """
+    Return a module object for the module called ``name`` that defers importing it until an attribute is accessed.
+
+    The import is done with ``importlib.import_module``, so it is thread safe and subject to the usual import lock.
+
+    :param str name: the absolute name of the module, e.g. ``"hca.dss"`` or ``"boto3"``
+    """
+    return _LazyModule(name)
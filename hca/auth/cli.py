@@ -5,7 +5,7 @@ import sys
 from . import AuthClient
 
 
-def add_commands(subparsers, help_menu=False):
+def add_commands(subparsers, help_menu=False, subcommand=None):
     auth_parser = subparsers.add_parser('auth', help="Interact with the HCA authorization and authentication system.")
 
     def help(args):
@@ -15,4 +15,4 @@ def add_commands(subparsers, help_menu=False):
         auth_parser.set_defaults(entry_point=help)
     auth_subparsers = auth_parser.add_subparsers()
     auth_cli_client = AuthClient()
-    auth_cli_client.build_argparse_subparsers(auth_subparsers, help_menu=help_menu)
+    auth_cli_client.build_argparse_subparsers(auth_subparsers, help_menu=help_menu, subcommand=subcommand)
@@ -7,22 +7,29 @@ For help with individual commands, run ``{prog} <command> --help``.
 """
 import os
 import sys
+import shlex
 import argparse
 import logging
 import json
 import datetime
 import traceback
 import platform
+import subprocess
+import time
 import argcomplete
+from collections import defaultdict
 from io import open
-from botocore.exceptions import NoRegionError
-import xmlrpc.client as xmlrpclib
 
 from .version import __version__
-from .dss import cli as dss_cli
-from .upload import cli as upload_cli
-from .auth import cli as auth_cli
 from . import logger, get_config, clear_hca_cache
+from ._lazy import lazy_import
+
+# Command groups and their dependencies are only imported when the command being run needs them
+dss_cli = lazy_import("hca.dss.cli")
+upload_cli = lazy_import("hca.upload.cli")
+auth_cli = lazy_import("hca.auth.cli")
+botocore_exceptions = lazy_import("botocore.exceptions")
+xmlrpclib = lazy_import("xmlrpc.client")
 
 
 class HCAArgumentParser(argparse.ArgumentParser):
@@ -74,8 +81,21 @@ def check_if_release_is_current(log):
             pass
 
 
-def get_parser(help_menu=False):
-    parser = HCAArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+# Help text for the top-level command groups. Groups not named on the command line are registered with this text only,
+# so they are listed in the help output without building their (potentially swagger-derived) subcommands.
+command_group_help = {
+    "upload": "Upload data to DCP",
+    "dss": "Interact with the HCA Data Storage System",
+    "auth": "Interact with the HCA authorization and authentication system."
+}
+
+
+class _CommandPathParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+
+def _add_top_level_arguments(parser):
     version_string = "%(prog)s {version} ({python_impl} {python_version} {platform})"
     parser.add_argument("--version", action="version", version=version_string.format(
         version=__version__,
@@ -86,6 +106,51 @@ def get_parser(help_menu=False):
     parser.add_argument("--log-level", default=get_config().get("log_level"),
                         help=str([logging.getLevelName(i) for i in range(10, 60, 10)]),
                         choices={logging.getLevelName(i) for i in range(10, 60, 10)})
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Run the command and print a breakdown of the time spent importing modules")
+
+
+def get_command_path(args):
+    """
+    Return the first two positional words in the given command line arguments, i.e. the command group and the
+    subcommand being invoked, e.g. ``['dss', 'get-file']``.
+
+    The arguments are parsed with the top-level options of the real parser, so that their values and abbreviations
+    aren't taken for commands. If they can't be parsed, no command is returned, and the full parser reports the error.
+    """
+    parser = _CommandPathParser(prog="hca", add_help=False)
+    _add_top_level_arguments(parser)
+    parser.add_argument("command_path", nargs="*")
+    try:
+        parsed_args, _ = parser.parse_known_args(args)
+    except ValueError:
+        return []
+    return parsed_args.command_path[:2]
+
+
+def _get_completion_args():
+    """Return the completed words of the command line that argcomplete is asking us to complete."""
+    comp_line = os.environ.get("COMP_LINE", "")[:int(os.environ.get("COMP_POINT", 0)) or None]
+    try:
+        words = shlex.split(comp_line)
+    except ValueError:
+        words = comp_line.split()
+    if words and not comp_line[-1:].isspace():
+        words = words[:-1]  # the word being completed
+    return words[1:]
+
+
+def get_parser(help_menu=False, command_path=None):
+    """
+    Build the argument parser.
+
+    :param help_menu: group required arguments separately in the help output
+    :param command_path: if given, the command group and subcommand being invoked, as returned by
+                         ``get_command_path``. Only that part of the command tree is fully constructed. If not given,
+                         the whole tree is constructed.
+    """
+    parser = HCAArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    _add_top_level_arguments(parser)
     parser.add_parser_func(clear_hca_cache, help=clear_hca_cache.__doc__)
 
     def help(args):
@@ -94,21 +159,92 @@ def get_parser(help_menu=False):
 
     parser.add_parser_func(help)
 
-    upload_cli.add_commands(parser._subparsers)
-    dss_cli.add_commands(parser._subparsers, help_menu=help_menu)
-    auth_cli.add_commands(parser._subparsers, help_menu=help_menu)
+    if "_ARGCOMPLETE" in os.environ:
+        command_path = get_command_path(_get_completion_args())
+    command, subcommand = (list(command_path or []) + [None, None])[:2]
+    if command_path is not None:
+        # Lazily build the command tree. If no subcommand was named, only the list of subcommands is needed.
+        subcommand = subcommand or ""
+
+    for group_name in command_group_help:
+        if command_path is not None and group_name != command:
+            parser._subparsers.add_parser(group_name, help=command_group_help[group_name])
+        elif group_name == "upload":
+            upload_cli.add_commands(parser._subparsers)
+        elif group_name == "dss":
+            dss_cli.add_commands(parser._subparsers, help_menu=help_menu, subcommand=subcommand)
+        elif group_name == "auth":
+            auth_cli.add_commands(parser._subparsers, help_menu=help_menu, subcommand=subcommand)
 
     argcomplete.autocomplete(parser)
     return parser
 
 
+def _summarize_import_times(importtime_lines):
+    """
+    Aggregate the output of ``python -X importtime`` by top-level package.
+
+    :param importtime_lines: lines of the form ``import time: <self us> | <cumulative us> | <module name>``
+    :return: a list of (package name, self import time in seconds, number of modules) tuples, slowest first
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for line in importtime_lines:
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_time = int(fields[0])
+        except (ValueError, IndexError):
+            continue  # the header line
+        package = fields[2].strip().split(".")[0]
+        totals[package][0] += self_time
+        totals[package][1] += 1
+    summary = [(package, self_time / 1e6, count) for package, (self_time, count) in totals.items()]
+    return sorted(summary, key=lambda entry: entry[1], reverse=True)
+
+
+def profile_startup(args, max_packages=25):
+    """
+    Run the command given by ``args`` in a child interpreter with import tracing enabled (``python -X importtime``)
+    and print the time spent importing modules, by top-level package, to stderr.
+
+    :return: the exit status of the command
+    """
+    if sys.version_info < (3, 7):
+        exit("--profile-startup requires Python 3.7 or newer")
+    cmd = [sys.executable, "-X", "importtime", "-c", "from hca.cli import main; main()"] + list(args)
+    start_time = time.time()
+    proc = subprocess.Popen(cmd, stderr=subprocess.PIPE, universal_newlines=True)
+    importtime_lines = []
+    for line in proc.stderr:
+        if line.startswith("import time:"):
+            importtime_lines.append(line)
+        else:
+            sys.stderr.write(line)
+    returncode = proc.wait()
+    wall_time = time.time() - start_time
+
+    summary = _summarize_import_times(importtime_lines)
+    print("\nImport time by top-level package:", file=sys.stderr)
+    for package, self_time, count in summary[:max_packages]:
+        print("  {:<32} {:>8.1f} ms  ({} modules)".format(package, self_time * 1000, count), file=sys.stderr)
+    if len(summary) > max_packages:
+        rest = summary[max_packages:]
+        print("  {:<32} {:>8.1f} ms  ({} modules)".format("({} more)".format(len(rest)),
+                                                          sum(entry[1] for entry in rest) * 1000,
+                                                          sum(entry[2] for entry in rest)), file=sys.stderr)
+    print("Total: {:.1f} ms importing {} modules, {:.1f} ms wall-clock".format(
+        sum(entry[1] for entry in summary) * 1000, sum(entry[2] for entry in summary), wall_time * 1000),
+        file=sys.stderr)
+    return returncode
+
+
 def main(args=None):
     if not args:
         args = sys.argv[1:]
-    if '--help' in args or '-h' in args:
-        parser = get_parser(help_menu=True)
-    else:
-        parser = get_parser()
+    if "--profile-startup" in args:
+        exit(profile_startup([arg for arg in args if arg != "--profile-startup"]))
+    help_menu = '--help' in args or '-h' in args
+    command_path = get_command_path(args)
+    parser = get_parser(help_menu=help_menu, command_path=command_path)
 
     if len(args) < 1:
         parser.print_help()
@@ -131,7 +267,7 @@ def main(args=None):
     try:
         result = parsed_args.entry_point(parsed_args)
     except Exception as e:
-        if isinstance(e, NoRegionError):
+        if isinstance(e, botocore_exceptions.NoRegionError):
             msg = "The AWS CLI is not configured."
             msg += " Please configure it using instructions at"
             msg += " http://docs.aws.amazon.com/cli/latest/userguide/cli-chap-getting-started.html"
@@ -154,5 +290,5 @@ def main(args=None):
     elif result is not None:
         if isinstance(result, bytes):
             sys.stdout.buffer.write(result)
-        elif not isinstance(result, upload_cli.UploadCLICommand):
+        elif not (command_path[:1] == ["upload"] and isinstance(result, upload_cli.UploadCLICommand)):
             print(json.dumps(result, indent=2, default=lambda x: str(x)))
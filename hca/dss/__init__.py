@@ -5,29 +5,40 @@ Data Storage System
 import errno
 import functools
 import json
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
 import concurrent.futures
+from contextlib import contextmanager
 from datetime import datetime
 from fnmatch import fnmatchcase
 import hashlib
 import os
 import re
 import tempfile
+import threading
 import time
 import uuid
 from io import open
 
 import requests
-from atomicwrites import atomic_write
+from atomicwrites import AtomicWriter
 from requests.exceptions import ChunkedEncodingError, ConnectionError, ReadTimeout
 
-from hca.dss.util import iter_paths, object_name_builder, hardlink, atomic_overwrite
+from hca.dss.util import object_name_builder, hardlink, atomic_overwrite
 from glob import escape as glob_escape
 from hca.util import tsv
 from ..util import SwaggerClient, DEFAULT_THREAD_COUNT
+from ..util.compat import pread, pwrite
+from ..util.fs_walk import FileWalk
 from ..util.exceptions import SwaggerAPIException
 from .. import logger
 from .upload_to_cloud import upload_to_cloud
+from .download_journal import DownloadJournal
+from .bundle_manifest_cache import BundleManifestCache
+from .adaptive_concurrency import AdaptiveConcurrency, FixedConcurrency
+
+# Files at least this large are downloaded as several byte ranges over concurrent connections
+DEFAULT_SEGMENTED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_CONNECTIONS_PER_FILE = 4
 
 
 class DSSFile(namedtuple('DSSFile', ['name', 'uuid', 'version', 'sha256', 'size', 'indexed', 'replica'])):
@@ -101,7 +112,8 @@ class DSSClient(SwaggerClient):
         :param str replica: the replica to upload to. The supported replicas are: `aws` for Amazon Web Services, and
             `gcp` for Google Cloud Platform. [aws, gcp]
         :param str staging_bucket: a client controlled AWS S3 storage bucket to upload from.
-        :param int timeout_seconds: the time to wait for a file to upload to replica.
+        :param int timeout_seconds: the time to wait for asynchronous copies of the uploaded files to the replica to
+            complete.
         :param bool no_progress: if set, will not report upload progress. Note that even if this flag
                                  is not set, progress will not be reported if the logging level is higher
                                  than INFO or if the session is not interactive.
@@ -112,62 +124,50 @@ class DSSClient(SwaggerClient):
         bundle_uuid = bundle_uuid if bundle_uuid else str(uuid.uuid4())
         version = datetime.utcnow().strftime("%Y-%m-%dT%H%M%S.%fZ")
 
-        filenames_to_upload, files_uploaded = [], []
-        for filename in iter_paths(src_dir):
-            full_file_name = filename.path
-            filenames_to_upload.append(full_file_name)
+        files_uploaded = []
+        # The directory is walked while the files are being staged, rather than all up front
+        filenames_to_upload = FileWalk([src_dir])
 
-        logger.info("Uploading %i files from %s to %s", len(filenames_to_upload), src_dir, staging_bucket)
+        logger.info("Uploading files from %s to %s", src_dir, staging_bucket)
         file_uuids, uploaded_keys, abs_file_paths = upload_to_cloud(filenames_to_upload, staging_bucket=staging_bucket,
                                                                     replica=replica, from_cloud=False,
-                                                                    log_progress=not no_progress)
+                                                                    log_progress=not no_progress,
+                                                                    threads=self.threads)
         filenames = [object_name_builder(p, src_dir) for p in abs_file_paths]
-        filename_key_list = list(zip(filenames, file_uuids, uploaded_keys))
+        creator_uid = self.config.get("creator_uid", 0)
 
-        for filename, file_uuid, key in filename_key_list:
+        files_to_register = []
+        for filename, file_uuid, key in zip(filenames, file_uuids, uploaded_keys):
             filename = filename.replace('\\', '/')  # for windows paths
             if filename.startswith('/'):
                 filename = filename.lstrip('/')
-            logger.info("File %s: registering...", filename)
-
-            # Generating file data
-            creator_uid = self.config.get("creator_uid", 0)
-            source_url = "s3://{}/{}".format(staging_bucket, key)
-            logger.info("File %s: registering from %s -> uuid %s", filename, source_url, file_uuid)
-
-            response = self.put_file._request(dict(
-                uuid=file_uuid,
-                bundle_uuid=bundle_uuid,
-                version=version,
-                creator_uid=creator_uid,
-                source_url=source_url
-            ))
-            files_uploaded.append(dict(name=filename, version=version, uuid=file_uuid, creator_uid=creator_uid))
+            files_to_register.append((filename, file_uuid, "s3://{}/{}".format(staging_bucket, key)))
+
+        failures = {}
+        pending_copies = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = {executor.submit(self._register_file, filename, file_uuid, source_url,
+                                       bundle_uuid, version, creator_uid): (filename, file_uuid)
+                       for filename, file_uuid, source_url in files_to_register}
+            for future in concurrent.futures.as_completed(futures):
+                filename, file_uuid = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    failures[filename] = e
+                    continue
+                if response.status_code == requests.codes.accepted:
+                    pending_copies[filename] = (file_uuid, response)
+            failures.update(self._wait_for_async_copies(executor, pending_copies, version, timeout_seconds))
 
-            if response.status_code in (requests.codes.ok, requests.codes.created):
-                logger.info("File %s: Sync copy -> %s", filename, version)
-            else:
-                assert response.status_code == requests.codes.accepted
-                logger.info("File %s: Async copy -> %s", filename, version)
+        if failures:
+            for filename, e in sorted(failures.items()):
+                logger.error("File %s: registration FAILED: %s", filename, e)
+            raise RuntimeError("{} of {} file(s) failed to register: {}".format(
+                len(failures), len(files_to_register), ", ".join(sorted(failures))))
 
-                timeout = time.time() + timeout_seconds
-                wait = 1.0
-                while time.time() < timeout:
-                    try:
-                        self.head_file(uuid=file_uuid, replica="aws", version=version)
-                        break
-                    except SwaggerAPIException as e:
-                        if e.code != requests.codes.not_found:
-                            msg = "File {}: Unexpected server response during registration"
-                            req_id = 'X-AWS-REQUEST-ID: {}'.format(response.headers.get("X-AWS-REQUEST-ID"))
-                            raise RuntimeError(msg.format(filename), req_id)
-                        time.sleep(wait)
-                        wait = min(60.0, wait * self.UPLOAD_BACKOFF_FACTOR)
-                else:
-                    # timed out. :(
-                    req_id = 'X-AWS-REQUEST-ID: {}'.format(response.headers.get("X-AWS-REQUEST-ID"))
-                    raise RuntimeError("File {}: registration FAILED".format(filename), req_id)
-                logger.debug("Successfully uploaded file")
+        for filename, file_uuid, _ in files_to_register:
+            files_uploaded.append(dict(name=filename, version=version, uuid=file_uuid, creator_uid=creator_uid))
 
         file_args = [{'indexed': file_["name"].endswith(".json"),
                       'name': file_['name'],
@@ -191,6 +191,68 @@ class DSSClient(SwaggerClient):
             "files": files_uploaded
         }
 
+    def _register_file(self, filename, file_uuid, source_url, bundle_uuid, version, creator_uid):
+        logger.info("File %s: registering from %s -> uuid %s", filename, source_url, file_uuid)
+        response = self.put_file._request(dict(
+            uuid=file_uuid,
+            bundle_uuid=bundle_uuid,
+            version=version,
+            creator_uid=creator_uid,
+            source_url=source_url
+        ))
+        if response.status_code in (requests.codes.ok, requests.codes.created):
+            logger.info("File %s: Sync copy -> %s", filename, version)
+        else:
+            assert response.status_code == requests.codes.accepted
+            logger.info("File %s: Async copy -> %s", filename, version)
+        return response
+
+    def _wait_for_async_copies(self, executor, pending_copies, version, timeout_seconds):
+        """
+        Poll ``head_file`` for every file whose registration resulted in an asynchronous copy until all of them are
+        present or the timeout expires. All pending files are checked in one round per iteration and share a single
+        backoff, so the total wait is bounded by the slowest copy rather than the sum of all copies.
+
+        :return: a dict mapping the name of each file that failed to register to the corresponding exception
+        """
+        def _request_id(response):
+            return 'X-AWS-REQUEST-ID: {}'.format(response.headers.get("X-AWS-REQUEST-ID"))
+
+        failures = {}
+        timeout = time.time() + timeout_seconds
+        wait = 1.0
+        while pending_copies:
+            futures = {executor.submit(self.head_file, uuid=file_uuid, replica="aws", version=version): filename
+                       for filename, (file_uuid, _) in pending_copies.items()}
+            for future in concurrent.futures.as_completed(futures):
+                filename = futures[future]
+                try:
+                    future.result()
+                except SwaggerAPIException as e:
+                    if e.code == requests.codes.not_found:
+                        continue
+                    msg = "File {}: Unexpected server response during registration"
+                    failures[filename] = RuntimeError(msg.format(filename),
+                                                      _request_id(pending_copies.pop(filename)[1]))
+                except Exception as e:
+                    failures[filename] = e
+                    del pending_copies[filename]
+                else:
+                    logger.debug("File %s: Successfully uploaded", filename)
+                    del pending_copies[filename]
+            if not pending_copies:
+                break
+            if time.time() >= timeout:
+                # timed out. :(
+                for filename, (_, response) in pending_copies.items():
+                    failures[filename] = RuntimeError("File {}: registration FAILED".format(filename),
+                                                      _request_id(response))
+                break
+            logger.info("Waiting for %i asynchronous copies to complete...", len(pending_copies))
+            time.sleep(wait)
+            wait = min(60.0, wait * self.UPLOAD_BACKOFF_FACTOR)
+        return failures
+
     def download(self,
                  bundle_uuid,
                  replica,
@@ -201,7 +263,11 @@ class DSSClient(SwaggerClient):
                  no_metadata=False,
                  no_data=False,
                  num_retries=10,
-                 min_delay_seconds=0.25):
+                 min_delay_seconds=0.25,
+                 segmented_download_threshold=DEFAULT_SEGMENTED_DOWNLOAD_THRESHOLD,
+                 connections_per_file=DEFAULT_CONNECTIONS_PER_FILE,
+                 no_manifest_cache=False,
+                 adaptive_concurrency=False):
         """
         Download a bundle and save it to the local filesystem as a directory.
 
@@ -224,6 +290,14 @@ class DSSClient(SwaggerClient):
         :param int num_retries: The initial quota of download failures to accept before exiting due to failures.
                                 The number of retries increase and decrease as file chucks succeed and fail.
         :param float min_delay_seconds: The minimum number of seconds to wait in between retries.
+        :param int segmented_download_threshold: Files of at least this many bytes are split into byte ranges that
+                                                 are downloaded concurrently.
+        :param int connections_per_file: The number of concurrent connections used to download a file whose size
+                                         exceeds the segmented download threshold. 1 disables segmented downloads.
+        :param bool no_manifest_cache: Always fetch the bundle manifest from the DSS instead of reusing a copy cached
+                                       in the filestore by an earlier download.
+        :param bool adaptive_concurrency: Adjust the number of concurrent requests to the observed throughput,
+                                          latency and failure rate instead of using a fixed number of threads.
 
         Download a bundle and save it to the local filesystem as a directory.
 
@@ -248,9 +322,14 @@ class DSSClient(SwaggerClient):
                                   dss_client=self,
                                   replica=replica,
                                   num_retries=num_retries,
-                                  min_delay_seconds=min_delay_seconds)
+                                  min_delay_seconds=min_delay_seconds,
+                                  segmented_download_threshold=segmented_download_threshold,
+                                  connections_per_file=connections_per_file,
+                                  manifest_cache=not no_manifest_cache,
+                                  adaptive_concurrency=adaptive_concurrency)
         with context.runner:
             context.download_bundle(bundle_uuid, version, metadata_filter, data_filter)
+        context.log_metrics()
 
     def download_manifest(self,
                           manifest,
@@ -260,7 +339,11 @@ class DSSClient(SwaggerClient):
                           no_data=False,
                           num_retries=10,
                           min_delay_seconds=0.25,
-                          download_dir=''):
+                          download_dir='',
+                          segmented_download_threshold=DEFAULT_SEGMENTED_DOWNLOAD_THRESHOLD,
+                          connections_per_file=DEFAULT_CONNECTIONS_PER_FILE,
+                          no_manifest_cache=False,
+                          adaptive_concurrency=False):
         """
         Process the given manifest file in TSV (tab-separated values) format and download the files referenced by it.
 
@@ -278,6 +361,14 @@ class DSSClient(SwaggerClient):
         :param float min_delay_seconds: The minimum number of seconds to wait in between retries for downloading any
             file
         :param str download_dir: The directory into which to download
+        :param int segmented_download_threshold: Files of at least this many bytes are split into byte ranges that are
+            downloaded concurrently.
+        :param int connections_per_file: The number of concurrent connections used to download a file whose size
+            exceeds the segmented download threshold. 1 disables segmented downloads.
+        :param bool no_manifest_cache: Always fetch bundle manifests from the DSS instead of reusing copies cached in
+            the filestore by earlier downloads.
+        :param bool adaptive_concurrency: Adjust the number of concurrent requests to the observed throughput, latency
+            and failure rate instead of using a fixed number of threads.
 
         Files are always downloaded to a cache / filestore directory called '.hca'. This directory is created in the
         current directory where download is initiated. A copy of the manifest used is also written to the current
@@ -313,7 +404,11 @@ class DSSClient(SwaggerClient):
                                           dss_client=self,
                                           replica=replica,
                                           num_retries=num_retries,
-                                          min_delay_seconds=min_delay_seconds)
+                                          min_delay_seconds=min_delay_seconds,
+                                          segmented_download_threshold=segmented_download_threshold,
+                                          connections_per_file=connections_per_file,
+                                          manifest_cache=not no_manifest_cache,
+                                          adaptive_concurrency=adaptive_concurrency)
         if layout == 'none':
             if no_metadata or no_data:
                 raise ValueError("--no-metadata and --no-data are only compatible with the 'bundle' layout")
@@ -322,8 +417,9 @@ class DSSClient(SwaggerClient):
             context.download_manifest_bundle_layout(no_metadata, no_data)
         else:
             raise ValueError('Invalid layout {} not one of [none, bundle]'.format(layout))
+        context.log_metrics()
 
-    def _serialize_col_to_manifest(self, uuid, replica, version):
+    def _serialize_col_to_manifest(self, uuid, replica, version, download_dir, manifest_cache=True):
         """
         Given a collection UUID, uses GET `/collection/{uuid}` to
         serialize the collection into a set of dicts that that can be
@@ -332,52 +428,71 @@ class DSSClient(SwaggerClient):
         Most of the heavy lifting is handled by
         :meth:`DSSClient.download_manifest`.
 
+        Nested collections are expanded breadth-first, each collection only
+        once. A bundle in several collections is listed once for each of
+        them. The collections and bundle manifests are fetched concurrently,
+        with at most twice as many requests in flight as there are threads,
+        and the rows are yielded as the bundle manifests come in. Files that
+        aren't in a bundle can't be downloaded, and make it raise a
+        RuntimeError once all the rows have been yielded.
+
         :param uuid: uuid of the collection to serialize
         :param replica: replica to query against
         :param version: version of the specified collection
+        :param download_dir: the directory whose filestore holds the bundle manifest cache
+        :param manifest_cache: whether to use the bundle manifest cache
         """
         errors = 0
-        rows = []
-        seen = []
-        col = self.get_collection(uuid=uuid, replica=replica, version=version)['contents']
-        context = DownloadContext(download_dir=None, dss_client=self, replica=replica,
-                                  num_retries=0, min_delay_seconds=0)
-        while col:
-            obj = col.pop()
-            if obj['type'] == 'file':
-                # Currently cannot download files not associated with a
-                # bundle. This is a limitation of :meth:`download_manifest`
-                errors += 1
-                logger.warning("Failed to download file %s version %s",
-                               obj['uuid'], obj['version'])
-            elif obj['type'] == 'collection':
-                if (obj['uuid'], obj['version']) in seen:
-                    logger.info("Ignoring already-seen collection %s version %s",
-                                obj['uuid'], obj['version'])
-                    continue
-                seen.append((obj['uuid'], obj['version']))
-                col.extend(self.get_collection(uuid=obj['uuid'], replica=replica,
-                                               version=obj.get('version', ''))['contents'])
-            elif obj['type'] == 'bundle':
-                bundle = context._get_full_bundle_manifest(bundle_uuid=obj['uuid'],
-                                                           version=obj['version'])
-                rows.extend(({
-                    'bundle_uuid': obj['uuid'],
-                    'bundle_version': obj.get('version', None),
-                    'file_name': f['name'],
-                    'file_sha256': f['sha256'],
-                    'file_uuid': f['uuid'],
-                    'file_size': f['size'],
-                    'file_version': f['version']} for f in bundle['bundle']['files']))
+        seen = set()
+        context = DownloadContext(download_dir=download_dir, dss_client=self, replica=replica,
+                                  num_retries=0, min_delay_seconds=0, manifest_cache=manifest_cache)
+
+        def fetch(obj):
+            if obj['type'] == 'collection':
+                return self.get_collection(uuid=obj['uuid'], replica=replica, version=obj.get('version', ''))
             else:
-                errors += 1
-                logger.warning("Failed to download file %s version %s",
-                               obj['uuid'], obj['version'])
+                return context._get_full_bundle_manifest(bundle_uuid=obj['uuid'], version=obj['version'])
+
+        pending = deque([{'type': 'collection', 'uuid': uuid, 'version': version}])
+        in_flight = deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while pending or in_flight:
+                while pending and len(in_flight) < 2 * self.threads:
+                    obj = pending.popleft()
+                    in_flight.append((obj, executor.submit(fetch, obj)))
+                obj, future = in_flight.popleft()
+                if obj['type'] == 'bundle':
+                    bundle = future.result()
+                    for f in bundle['bundle']['files']:
+                        yield {
+                            'bundle_uuid': obj['uuid'],
+                            'bundle_version': obj.get('version', None),
+                            'file_name': f['name'],
+                            'file_sha256': f['sha256'],
+                            'file_uuid': f['uuid'],
+                            'file_size': f['size'],
+                            'file_version': f['version']}
+                    continue
+                for obj in future.result()['contents']:
+                    if obj['type'] == 'collection':
+                        if (obj['uuid'], obj['version']) in seen:
+                            logger.info("Ignoring already-seen collection %s version %s",
+                                        obj['uuid'], obj['version'])
+                            continue
+                        seen.add((obj['uuid'], obj['version']))
+                        pending.append(obj)
+                    elif obj['type'] == 'bundle':
+                        pending.append(obj)
+                    else:
+                        # Currently cannot download files not associated with a
+                        # bundle. This is a limitation of :meth:`download_manifest`
+                        errors += 1
+                        logger.warning("Failed to download file %s version %s",
+                                       obj['uuid'], obj['version'])
         if errors:
             raise RuntimeError("%d download failure(s)..." % errors)
-        return rows
 
-    def download_collection(self, uuid, replica, version=None, download_dir=''):
+    def download_collection(self, uuid, replica, version=None, download_dir='', no_manifest_cache=False):
         """
         Download a bundle and save it to the local filesystem as a directory.
 
@@ -389,11 +504,15 @@ class DSSClient(SwaggerClient):
             download the latest. The version is a timestamp of bundle creation
             in RFC3339
         :param str download_dir: The directory into which to download
+        :param bool no_manifest_cache: Always fetch bundle manifests from the DSS instead of reusing copies cached in
+            the filestore by earlier downloads.
 
         Download a bundle and save it to the local filesystem as a directory.
         """
-        collection = self._serialize_col_to_manifest(uuid, replica, version)
-        # Explicitly declare mode `w` (default `w+b`) for Python 3 string compat
+        rows = self._serialize_col_to_manifest(uuid, replica, version, download_dir=download_dir,
+                                               manifest_cache=not no_manifest_cache)
+        # Explicitly declare mode `w` (default `w+b`) for Python 3 string compat. The temporary file is deleted when
+        # the rows fail part way through, as well as when the download is done.
         with tempfile.NamedTemporaryFile(mode='w') as manifest:
             writer = tsv.DictWriter(manifest,
                                     fieldnames=('bundle_uuid',
@@ -404,26 +523,35 @@ class DSSClient(SwaggerClient):
                                                 'file_version',
                                                 'file_size'))
             writer.writeheader()
-            writer.writerows(collection)
+            writer.writerows(rows)
             # Flushing the I/O buffer here is preferable to closing the file
             # handle and deleting the temporary file later because within the
             # context manager there is a guarantee that the temporary file
             # will be deleted when we are done
             manifest.flush()
             self.download_manifest(manifest=manifest.name, replica=replica,
-                                   download_dir=download_dir, layout='bundle')
+                                   download_dir=download_dir, layout='bundle',
+                                   no_manifest_cache=no_manifest_cache)
 
 
 class TaskRunner(object):
     """
-    A wrapper for ThreadPoolExecutor that tracks futures for you and allows
-    dynamic submission of tasks.
+    A wrapper for ThreadPoolExecutor that keeps track of the tasks submitted to it and allows dynamic submission of
+    tasks.
+
+    At most ``max_pending`` tasks submitted from outside the runner are queued or running at any time. Submitting
+    another one blocks until one of them has finished, so a producer iterating over a huge manifest never gets far
+    ahead of the downloads. Tasks submitted by other tasks are never blocked, because the task doing the submitting
+    would be holding up a worker thread that the tasks it is waiting for may need.
     """
 
-    def __init__(self, threads=DEFAULT_THREAD_COUNT):
+    def __init__(self, threads=DEFAULT_THREAD_COUNT, max_pending=None):
         self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
-        self._futures = set()
+        self.max_pending = max_pending or 4 * threads
+        self._pending = 0
         self._errors = 0
+        self._cond = threading.Condition()
+        self._in_task = threading.local()
 
     def __enter__(self):
         return self
@@ -438,51 +566,217 @@ class TaskRunner(object):
         """
         Add task to be run.
 
-        Should only be called from the main thread or from tasks submitted by this method.
+        Should only be called from the main thread or from tasks submitted by this method. Blocks the main thread
+        while too many tasks are pending.
         :param info: Something printable
         :param task: A callable
         """
-        future = self._executor.submit(task, *args, **kwargs)
-        self._futures.add(future)
-
-        def process_future(f):
-            e = f.exception()
-            if e:
+        with self._cond:
+            if not getattr(self._in_task, 'value', False):
+                self._cond.wait_for(lambda: self._pending < self.max_pending)
+            self._pending += 1
+        try:
+            self._executor.submit(self._run, info, task, *args, **kwargs)
+        except BaseException:
+            self._task_done(None)
+            raise
+
+    def _run(self, info, task, *args, **kwargs):
+        self._in_task.value = True
+        error = None
+        try:
+            task(*args, **kwargs)
+        except Exception as e:
+            error = e
+            logger.warning('Download task failed: %r', info, exc_info=e)
+        finally:
+            self._in_task.value = False
+            self._task_done(error)
+
+    def _task_done(self, error):
+        with self._cond:
+            self._pending -= 1
+            if error is not None:
                 self._errors += 1
-                logger.warning('Download task failed: %r', info, exc_info=e)
-
-        future.add_done_callback(process_future)
+            self._cond.notify_all()
 
     def wait_for_futures(self):
         """
-        Wait for all submitted futures to finish.
+        Wait for all submitted tasks, including the ones submitted while waiting, to finish.
 
         Should only be called from the main thread.
         """
-        # This loop is necessary because futures are being dynamically added
-        while self._futures:
-            completed_futures = concurrent.futures.as_completed(self._futures)
-            self._futures.difference_update(completed_futures)
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0)
 
     def raise_if_errors(self):
         if self._errors:
             raise RuntimeError('{} download task(s) failed.'.format(self._errors))
 
 
+class RetryQuota(object):
+    """
+    The quota of download failures to accept for a file before giving up. The quota goes up with every successful block
+    read and down with each failure. The delay before the next retry doubles with each failure and halves with every
+    successful block read. Can be shared by several threads downloading parts of the same file.
+    """
+
+    def __init__(self, num_retries, min_delay_seconds):
+        self.num_retries = num_retries
+        self.min_delay_seconds = min_delay_seconds
+        self.retries_left = num_retries
+        self.delay = min_delay_seconds
+        self._lock = threading.Lock()
+
+    def succeeded(self):
+        with self._lock:
+            self.retries_left = min(self.retries_left + 1, self.num_retries)
+            self.delay = max(self.delay / 2, self.min_delay_seconds)
+
+    def failed(self):
+        """
+        Record a failure.
+
+        :return: the number of seconds to wait before retrying, or None if the quota is exhausted
+        """
+        with self._lock:
+            if self.retries_left <= 0:
+                return None
+            delay = self.delay
+            self.delay *= 2
+            self.retries_left -= 1
+            return delay
+
+
+class _RangeNotSatisfied(Exception):
+    """
+    Raised when the response to a ranged GET does not start at the requested offset.
+    """
+
+
+class _SegmentProgress(object):
+    """
+    Tracks how much of each segment of a segmented download has been written, so that the hash of the file can be
+    computed from the beginning while later segments are still being downloaded.
+    """
+
+    def __init__(self, segments):
+        self._written = {start: start for start, _ in segments}
+        self._cond = threading.Condition()
+        self.error = None
+
+    def advance(self, segment_start, offset):
+        with self._cond:
+            self._written[segment_start] = offset
+            self._cond.notify_all()
+
+    def fail(self, error):
+        with self._cond:
+            if self.error is None:
+                self.error = error
+            self._cond.notify_all()
+
+    def written(self, segment_start):
+        with self._cond:
+            return self._written[segment_start]
+
+    def wait_for(self, segment_start, offset):
+        """
+        Block until data past ``offset`` has been written to the segment starting at ``segment_start``.
+
+        :return: the offset up to which the segment has been written
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.error is not None or self._written[segment_start] > offset)
+            if self.error is not None:
+                raise self.error
+            return self._written[segment_start]
+
+
+class _DownloadCheckpoint(object):
+    """
+    Keeps track of the prefix of a partial download that has been written and hashed, and periodically makes it
+    durable and records its length in the download journal.
+    """
+    INTERVAL = 64 * 1024 * 1024
+
+    def __init__(self, journal, key, fh, offset):
+        self.journal = journal
+        self.key = key
+        self.fh = fh
+        self.offset = offset
+        self._saved_offset = offset
+
+    def __call__(self, offset):
+        self.offset = offset
+        if offset - self._saved_offset >= self.INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.offset != self._saved_offset:
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.journal.checkpoint(self.key, self.fh.name, self.offset)
+            self._saved_offset = self.offset
+
+
 class DownloadContext(object):
     # This variable is the configuration for download_manifest_v2. It specifies the length of the names of nested
     # directories for downloaded files.
     DIRECTORY_NAME_LENGTHS = [2, 4]
 
-    def __init__(self, download_dir, dss_client, replica, num_retries, min_delay_seconds):
-        self.runner = TaskRunner()
+    # The maximum size of the byte ranges a segmented download is split into. Segments are handed to connections in
+    # order, so the part of the file being hashed is never far behind the part being written.
+    SEGMENT_SIZE = 64 * 1024 * 1024
+
+    # Responses that ask the client to slow down
+    THROTTLING_STATUS_CODES = frozenset({requests.codes.too_many_requests, requests.codes.service_unavailable})
+
+    def __init__(self, download_dir, dss_client, replica, num_retries, min_delay_seconds,
+                 segmented_download_threshold=DEFAULT_SEGMENTED_DOWNLOAD_THRESHOLD,
+                 connections_per_file=DEFAULT_CONNECTIONS_PER_FILE, manifest_cache=True, adaptive_concurrency=False):
+        # With adaptive concurrency, the thread pool only caps the number of files being downloaded at once and the
+        # controller decides how many requests are in flight.
+        self.adaptive_concurrency = adaptive_concurrency
+        self._start_time = time.monotonic()
+        if adaptive_concurrency:
+            self.concurrency = AdaptiveConcurrency()
+            self.runner = TaskRunner(threads=AdaptiveConcurrency.DEFAULT_MAXIMUM)
+        else:
+            self.concurrency = FixedConcurrency(DEFAULT_THREAD_COUNT)
+            self.runner = TaskRunner()
         self.download_dir = download_dir
         self.dss_client = dss_client
         self.replica = replica
         self.num_retries = num_retries
         self.min_delay_seconds = min_delay_seconds
+        self.segmented_download_threshold = segmented_download_threshold
+        self.connections_per_file = connections_per_file
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._filestore_lock = threading.Lock()
+        self.manifest_cache = BundleManifestCache(self._filestore_dir(download_dir)) if manifest_cache else None
+
+    @property
+    def journal(self):
+        """
+        The journal of the downloads into the filestore in the download directory, loaded on first use.
+        """
+        with self._journal_lock:
+            if self._journal is None:
+                self._journal = DownloadJournal(self._filestore_dir(self.download_dir))
+            return self._journal
+
+    def log_metrics(self):
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        logger.info("Downloaded %d bytes at %.1f MB/s with a final concurrency of %d.", self.concurrency.total_bytes,
+                    self.concurrency.total_bytes / elapsed / 1e6, self.concurrency.limit)
+
+    def _journal_key(self, dest_path):
+        return os.path.relpath(dest_path, self._filestore_dir(self.download_dir))
 
-    def download_bundle(self, bundle_uuid, version="", metadata_filter=('*',), data_filter=('*',)):
+    def download_bundle(self, bundle_uuid, version="", metadata_filter=('*',), data_filter=('*',),
+                        bundle_manifest=True):
         """
         Returns an iterator of tasks that each download one of the files in a bundle.
 
@@ -495,13 +789,14 @@ class DownloadContext(object):
         bundle_dir = os.path.join(self.download_dir, bundle_fqid)
 
         # Download bundle.json (manifest for bundle as a file)
-        manifest_bytes = json.dumps(manifest, indent=4, sort_keys=True).encode()
-        manifest_dss_file = DSSFile.for_bundle_manifest(manifest_bytes, bundle_uuid, bundle_version, self.replica)
-        task = functools.partial(self._download_bundle_manifest,
-                                 manifest_bytes,
-                                 bundle_dir,
-                                 manifest_dss_file)
-        self.runner.submit(manifest_dss_file, task)
+        if bundle_manifest:
+            manifest_bytes = json.dumps(manifest, indent=4, sort_keys=True).encode()
+            manifest_dss_file = DSSFile.for_bundle_manifest(manifest_bytes, bundle_uuid, bundle_version, self.replica)
+            task = functools.partial(self._download_bundle_manifest,
+                                     manifest_bytes,
+                                     bundle_dir,
+                                     manifest_dss_file)
+            self.runner.submit(manifest_dss_file, task)
 
         for file_ in manifest['bundle']['files']:
             dss_file = DSSFile.from_dss_bundle_response(file_, self.replica)
@@ -536,7 +831,14 @@ class DownloadContext(object):
     def _get_full_bundle_manifest(self, bundle_uuid, version):
         """
         Takes care of paging through the bundle and checks for name collisions.
+
+        Manifests of specific bundle versions are cached in the filestore, since they never change.
         """
+        if version and self.manifest_cache is not None:
+            manifest = self.manifest_cache.get(bundle_uuid, version)
+            if manifest is not None:
+                logger.debug("Using cached manifest of bundle %s version %s", bundle_uuid, version)
+                return manifest
         pages = self.dss_client.get_bundle.paginate(uuid=bundle_uuid,
                                                     version=version if version else None,
                                                     replica=self.replica)
@@ -561,6 +863,8 @@ class DownloadContext(object):
         # there will always be one page (or else we would have gotten a 404)
         # noinspection PyUnboundLocalVariable
         manifest['bundle']['files'] = ordered_files
+        if self.manifest_cache is not None:
+            self.manifest_cache.put(bundle_uuid, manifest['bundle']['version'], manifest)
         return manifest
 
     def _download_to_filestore(self, dss_file):
@@ -568,8 +872,12 @@ class DownloadContext(object):
         Attempt to download the data and save it in the 'filestore' location dictated by self._file_path()
         """
         dest_path = self._file_path(dss_file.sha256, self.download_dir)
-        if os.path.exists(dest_path):
+        # Files completed by earlier downloads are in the journal, which saves looking for each of them
+        if self.journal.is_complete(self._journal_key(dest_path)):
             logger.info("Skipping download of '%s' because it already exists at '%s'.", dss_file.name, dest_path)
+        elif os.path.exists(dest_path):
+            logger.info("Skipping download of '%s' because it already exists at '%s'.", dss_file.name, dest_path)
+            self.journal.complete(self._journal_key(dest_path))
         else:
             logger.debug("Downloading '%s' to '%s'.", dss_file.name, dest_path)
             self._download_file(dss_file, dest_path)
@@ -579,7 +887,15 @@ class DownloadContext(object):
     def _download_and_link_to_filestore(self, dss_file, file_path):
         file_store_path = self._download_to_filestore(dss_file)
         self._make_dirs_if_necessary(file_path)
-        hardlink(file_store_path, file_path)
+        try:
+            hardlink(file_store_path, file_path)
+        except FileNotFoundError:
+            if not self.journal.is_complete(self._journal_key(file_store_path)):
+                raise
+            # The journal says the file is in the filestore but it has been removed since
+            logger.warning("File %s is missing from the filestore. Downloading it again.", file_store_path)
+            self.journal.discard(self._journal_key(file_store_path))
+            hardlink(self._download_to_filestore(dss_file), file_path)
 
     def _download_file(self, dss_file, dest_path):
         """
@@ -589,19 +905,68 @@ class DownloadContext(object):
 
         If we can, we will attempt HTTP resume.  However, we verify that the server supports HTTP resume.  If the
         ranged get doesn't yield the correct header, then we start over.
+
+        The data is written to a partial file next to the destination, which is moved into place once its checksum has
+        been verified. Progress is recorded in the download journal, so if the download is interrupted, the next
+        attempt resumes from the last checkpoint.
         """
         self._make_dirs_if_necessary(dest_path)
-        with atomic_overwrite(dest_path, mode="wb") as fh:
-            if dss_file.size == 0:
-                return
-
-            download_hash = self._do_download_file(dss_file, fh)
+        key = self._journal_key(dest_path)
+        partial_path, offset = self.journal.claim_partial(key) or (None, 0)
+        try:
+            if partial_path is None or not os.path.isfile(partial_path) or os.path.getsize(partial_path) < offset:
+                fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(dest_path),
+                                                    prefix=os.path.basename(dest_path) + '.',
+                                                    suffix='.partial')
+                os.close(fd)
+                offset = 0
+            else:
+                logger.info("%s", "File {}: Resuming interrupted download at {}.".format(dss_file.uuid, offset))
+            with open(partial_path, 'r+b') as fh:
+                checkpoint = _DownloadCheckpoint(self.journal, key, fh, offset)
+                try:
+                    download_hash = self._resume_download_file(dss_file, fh, offset, checkpoint)
+                except BaseException:
+                    checkpoint.save()
+                    if not checkpoint.offset:
+                        os.unlink(partial_path)
+                    raise
+                fh.flush()
+                os.fsync(fh.fileno())
 
-            if download_hash.lower() != dss_file.sha256.lower():
-                # No need to delete what's been written. atomic_overwrite ensures we're cleaned up
+            if int(dss_file.size) != 0 and download_hash.lower() != dss_file.sha256.lower():
+                os.unlink(partial_path)
+                self.journal.discard(key)
                 logger.error("%s", "File {}: GET FAILED. Checksum mismatch.".format(dss_file.uuid))
                 raise ValueError("Expected sha256 {} Received sha256 {}".format(
                     dss_file.sha256.lower(), download_hash.lower()))
+            # Unlike a hard link, a rename works on NFS (#519). A copy downloaded concurrently by another task may
+            # already be linked into a bundle, so it is kept instead.
+            with self._filestore_lock:
+                if os.path.exists(dest_path):
+                    os.unlink(partial_path)
+                else:
+                    os.replace(partial_path, dest_path)
+            self.journal.complete(key)
+        finally:
+            self.journal.release(key)
+
+    def _resume_download_file(self, dss_file, fh, offset, checkpoint):
+        """
+        Download the rest of a file of which the first ``offset`` bytes have already been written to ``fh``.
+
+        :return: the sha256 of the complete file
+        """
+        fh.truncate(offset)
+        hasher = hashlib.sha256()
+        while fh.tell() < offset:
+            hasher.update(fh.read(min(offset - fh.tell(), 1024 * 1024)))
+        if int(dss_file.size) <= offset:
+            return hasher.hexdigest()
+        elif self.connections_per_file > 1 and int(dss_file.size) - offset >= self.segmented_download_threshold:
+            return self._do_segmented_download_file(dss_file, fh, hasher=hasher, checkpoint=checkpoint)
+        else:
+            return self._do_download_file(dss_file, fh, hasher=hasher, checkpoint=checkpoint)
 
     @classmethod
     def _make_dirs_if_necessary(cls, dest_path):
@@ -613,72 +978,225 @@ class DownloadContext(object):
                 if e.errno != errno.EEXIST:
                     raise
 
-    def _do_download_file(self, dss_file, fh):
+    def _do_download_file(self, dss_file, fh, hasher=None, checkpoint=None):
         """
         Abstracts away complications for downloading a file, handles retries and delays, and computes its hash
+
+        :param hasher: the sha256 hasher, if the download is resumed, with the data already in fh fed to it
+        :param checkpoint: called with the number of bytes written after each block
         """
-        hasher = hashlib.sha256()
-        delay = self.min_delay_seconds
-        retries_left = self.num_retries
+        if hasher is None:
+            hasher = hashlib.sha256()
+        quota = RetryQuota(self.num_retries, self.min_delay_seconds)
         while True:
             try:
-                response = self.dss_client.get_file._request(
-                    dict(uuid=dss_file.uuid, version=dss_file.version, replica=dss_file.replica),
-                    stream=True,
-                    headers={
-                        'Range': "bytes={}-".format(fh.tell())
-                    },
-                )
-                try:
-                    if not response.ok:
-                        logger.error("%s", "File {}: GET FAILED.".format(dss_file.uuid))
-                        logger.error("%s", "Response: {}".format(response.text))
-                        break
-
-                    consume_bytes = int(fh.tell())
-                    server_start = 0
-                    content_range_header = response.headers.get('Content-Range', None)
-                    if content_range_header is not None:
-                        cre = re.compile(r"bytes (\d+)-(\d+)")
-                        mo = cre.search(content_range_header)
-                        if mo is not None:
-                            server_start = int(mo.group(1))
-
-                    consume_bytes -= server_start
-                    assert consume_bytes >= 0
-                    if server_start > 0 and consume_bytes == 0:
-                        logger.info("%s", "File {}: Resuming at {}.".format(
-                            dss_file.uuid, server_start))
-                    elif consume_bytes > 0:
-                        logger.info("%s", "File {}: Resuming at {}. Dropping {} bytes to match".format(
-                            dss_file.uuid, server_start, consume_bytes))
-
-                        while consume_bytes > 0:
-                            bytes_to_read = min(consume_bytes, 1024 * 1024)
-                            content = response.iter_content(chunk_size=bytes_to_read)
-                            chunk = next(content)
+                with self.concurrency.slot():
+                    request_start = time.monotonic()
+                    response = self.dss_client.get_file._request(
+                        dict(uuid=dss_file.uuid, version=dss_file.version, replica=dss_file.replica),
+                        stream=True,
+                        headers={
+                            'Range': "bytes={}-".format(fh.tell())
+                        },
+                    )
+                    self.concurrency.record_latency(time.monotonic() - request_start)
+                    try:
+                        if not response.ok:
+                            logger.error("%s", "File {}: GET FAILED.".format(dss_file.uuid))
+                            logger.error("%s", "Response: {}".format(response.text))
+                            break
+
+                        consume_bytes = int(fh.tell())
+                        server_start = 0
+                        content_range_header = response.headers.get('Content-Range', None)
+                        if content_range_header is not None:
+                            cre = re.compile(r"bytes (\d+)-(\d+)")
+                            mo = cre.search(content_range_header)
+                            if mo is not None:
+                                server_start = int(mo.group(1))
+
+                        consume_bytes -= server_start
+                        assert consume_bytes >= 0
+                        if server_start > 0 and consume_bytes == 0:
+                            logger.info("%s", "File {}: Resuming at {}.".format(
+                                dss_file.uuid, server_start))
+                        elif consume_bytes > 0:
+                            logger.info("%s", "File {}: Resuming at {}. Dropping {} bytes to match".format(
+                                dss_file.uuid, server_start, consume_bytes))
+
+                            while consume_bytes > 0:
+                                bytes_to_read = min(consume_bytes, 1024 * 1024)
+                                content = response.iter_content(chunk_size=bytes_to_read)
+                                chunk = next(content)
+                                if chunk:
+                                    consume_bytes -= len(chunk)
+
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
                             if chunk:
-                                consume_bytes -= len(chunk)
-
-                    for chunk in response.iter_content(chunk_size=1024 * 1024):
-                        if chunk:
-                            fh.write(chunk)
-                            hasher.update(chunk)
-                            retries_left = min(retries_left + 1, self.num_retries)
-                            delay = max(delay / 2, self.min_delay_seconds)
-                    break
-                finally:
-                    response.close()
-            except (ChunkedEncodingError, ConnectionError, ReadTimeout):
-                if retries_left > 0:
+                                fh.write(chunk)
+                                hasher.update(chunk)
+                                quota.succeeded()
+                                self.concurrency.record_bytes(len(chunk))
+                                if checkpoint is not None:
+                                    checkpoint(fh.tell())
+                        break
+                    finally:
+                        response.close()
+            except (ChunkedEncodingError, ConnectionError, ReadTimeout, SwaggerAPIException) as e:
+                if not self._retryable(e):
+                    raise
+                self.concurrency.record_failure()
+                delay = quota.failed()
+                if delay is not None:
                     logger.info("%s", "File {}: GET FAILED. Attempting to resume.".format(dss_file.uuid))
                     time.sleep(delay)
-                    delay *= 2
-                    retries_left -= 1
                     continue
                 raise
         return hasher.hexdigest()
 
+    def _do_segmented_download_file(self, dss_file, fh, hasher=None, checkpoint=None):
+        """
+        Download a file as a number of byte ranges fetched over concurrent connections and written into a preallocated
+        file. The sha256 of the file is computed while the download progresses by reading back the part of the file
+        that has been written contiguously from the start. Failures count against a retry quota shared by all
+        connections. If the server does not honor ranged requests, fall back to a single-stream download.
+
+        The download starts at the current position of fh. The arguments are the same as for _do_download_file().
+        """
+        size = int(dss_file.size)
+        offset = fh.tell()
+        segment_size = min(self.SEGMENT_SIZE, -(-(size - offset) // self.connections_per_file))
+        segments = [(start, min(start + segment_size, size)) for start in range(offset, size, segment_size)]
+        progress = _SegmentProgress(segments)
+        quota = RetryQuota(self.num_retries, self.min_delay_seconds)
+        cancelled = threading.Event()
+        fh.truncate(size)
+        logger.info("%s", "File {}: Downloading {} segments over {} connections.".format(
+            dss_file.uuid, len(segments), self.connections_per_file))
+        if hasher is None:
+            hasher = hashlib.sha256()
+
+        def process_future(f):
+            if not f.cancelled() and f.exception() is not None:
+                progress.fail(f.exception())
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.connections_per_file)
+        futures = []
+        try:
+            for start, end in segments:
+                future = executor.submit(self._download_segment, dss_file, fh.fileno(), start, end, quota, progress,
+                                         cancelled)
+                future.add_done_callback(process_future)
+                futures.append(future)
+            with open(fh.name, 'rb', buffering=0) as reader:
+                def hash_written(written):
+                    nonlocal offset
+                    while offset < written:
+                        chunk = pread(reader.fileno(), min(written - offset, 1024 * 1024), offset)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+                        if checkpoint is not None:
+                            checkpoint(offset)
+
+                for i, (start, end) in enumerate(segments):
+                    while offset < end:
+                        try:
+                            written = progress.wait_for(start, offset)
+                        except BaseException:
+                            # Let the segments in flight finish and keep the contiguous part of what was downloaded
+                            for future in futures:
+                                future.cancel()
+                            concurrent.futures.wait(futures)
+                            for start, end in segments[i:]:
+                                hash_written(progress.written(start))
+                                if offset < end:
+                                    break
+                            raise
+                        hash_written(written)
+        except _RangeNotSatisfied:
+            ranges_supported = False
+        else:
+            ranges_supported = True
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+        if not ranges_supported:
+            # Everything up to offset has been hashed, so the download can continue from there
+            logger.info("%s", "File {}: Ranged GET not supported. Downloading over a single connection.".format(
+                dss_file.uuid))
+            fh.truncate(offset)
+            fh.seek(offset)
+            return self._do_download_file(dss_file, fh, hasher=hasher, checkpoint=checkpoint)
+        return hasher.hexdigest()
+
+    def _download_segment(self, dss_file, fd, start, end, quota, progress, cancelled):
+        """
+        Download the bytes in [start, end) of a file and write them at the same offset into the file descriptor fd.
+        """
+        offset = start
+        while offset < end and not cancelled.is_set():
+            try:
+                with self.concurrency.slot():
+                    request_start = time.monotonic()
+                    response = self.dss_client.get_file._request(
+                        dict(uuid=dss_file.uuid, version=dss_file.version, replica=dss_file.replica),
+                        stream=True,
+                        headers={
+                            'Range': "bytes={}-{}".format(offset, end - 1)
+                        },
+                    )
+                    self.concurrency.record_latency(time.monotonic() - request_start)
+                    try:
+                        if not response.ok:
+                            logger.error("%s", "File {}: GET FAILED.".format(dss_file.uuid))
+                            logger.error("%s", "Response: {}".format(response.text))
+                            raise RuntimeError("File {}: GET of bytes {}-{} failed with status {}".format(
+                                dss_file.uuid, offset, end - 1, response.status_code))
+                        mo = re.match(r"bytes (\d+)-", response.headers.get('Content-Range', ''))
+                        if response.status_code != requests.codes.partial or mo is None or int(mo.group(1)) != offset:
+                            raise _RangeNotSatisfied(response.headers.get('Content-Range'))
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            if cancelled.is_set():
+                                return
+                            chunk = chunk[:end - offset]
+                            if chunk:
+                                pwrite(fd, chunk, offset)
+                                offset += len(chunk)
+                                progress.advance(start, offset)
+                                quota.succeeded()
+                                self.concurrency.record_bytes(len(chunk))
+                            if offset >= end:
+                                break
+                    finally:
+                        response.close()
+                    if offset < end:
+                        raise ChunkedEncodingError(
+                            "Response ended at byte {} of segment ending at {}".format(offset, end))
+            except (ChunkedEncodingError, ConnectionError, ReadTimeout, SwaggerAPIException) as e:
+                if not self._retryable(e):
+                    raise
+                self.concurrency.record_failure()
+                delay = quota.failed()
+                if delay is None:
+                    raise
+                logger.info("%s", "File {}: GET FAILED. Attempting to resume at {}.".format(dss_file.uuid, offset))
+                time.sleep(delay)
+
+    def _retryable(self, error):
+        """
+        Whether a failed request should be retried. Responses telling us to slow down are only retried when the
+        concurrency is adaptive, because that's when retrying them does slow us down.
+        """
+        if isinstance(error, SwaggerAPIException):
+            return self.adaptive_concurrency and error.code in self.THROTTLING_STATUS_CODES
+        return True
+
+    @classmethod
+    def _filestore_dir(cls, download_dir):
+        return os.path.join(download_dir, '.hca', 'v2')
+
     @classmethod
     def _file_path(cls, checksum, download_dir):
         """
@@ -689,7 +1207,7 @@ class DownloadContext(object):
         """
         checksum = checksum.lower()
         file_prefix = '_'.join(['files'] + list(map(str, cls.DIRECTORY_NAME_LENGTHS)))
-        path_pieces = [download_dir, '.hca', 'v2', file_prefix]
+        path_pieces = [cls._filestore_dir(download_dir), file_prefix]
         checksum_index = 0
         assert(sum(cls.DIRECTORY_NAME_LENGTHS) <= len(checksum))
         for prefix_length in cls.DIRECTORY_NAME_LENGTHS:
@@ -711,12 +1229,11 @@ class ManifestDownloadContext(DownloadContext):
 
         Note that this method can only be used once per instantiation of context.
         """
-        fieldnames, rows = self._parse_manifest(self.manifest)
-        with self.runner:
-            for row in rows:
-                dss_file = DSSFile.from_manifest_row(row, self.replica)
-                self.runner.submit(dss_file, self._download_to_filestore, dss_file)
-        self._write_output_manifest()
+        with self._rewrite_manifest() as rows:
+            with self.runner:
+                for row in rows:
+                    dss_file = DSSFile.from_manifest_row(row, self.replica)
+                    self.runner.submit(dss_file, self._download_to_filestore, dss_file)
 
     def download_manifest_bundle_layout(self, no_metadata, no_data):
         """
@@ -724,53 +1241,88 @@ class ManifestDownloadContext(DownloadContext):
 
         Note that this method can only be used once per instantiation of context.
         """
-        with self.runner:
-            self._download_manifest_tasks(no_metadata, no_data)
-        self._write_output_manifest()
+        with self._rewrite_manifest() as rows:
+            with self.runner:
+                self._download_manifest_tasks(rows, no_metadata, no_data)
         logger.info('Primary copies of the files have been downloaded to `.hca` and linked '
                     'into per-bundle subdirectories of the current directory.')
 
-    def _download_manifest_tasks(self, no_metadata, no_data):
-        with open(self.manifest) as f:
-            bundles = defaultdict(set)
-            # unicode_literals is on so all strings are unicode. CSV wants a str so we need to jump through a hoop.
-            reader = tsv.DictReader(f)
-            for row in reader:
-                bundles[(row['bundle_uuid'], row['bundle_version'])].add(row['file_name'])
-        for (bundle_uuid, bundle_version), data_files in bundles.items():
+    def _download_manifest_tasks(self, rows, no_metadata, no_data):
+        """
+        Submit a task for each run of consecutive rows that belong to the same bundle. The rows of a bundle are usually
+        adjacent, so only the names of the files in the current run need to be kept. If a bundle shows up again later in
+        the manifest, only the data files in the new run are downloaded, since its metadata files and bundle.json have
+        been taken care of already.
+        """
+        submitted = set()
+
+        def submit(bundle, data_files):
+            bundle_uuid, bundle_version = bundle
             if no_data:
+                if bundle in submitted:
+                    return
                 data_filter = ('',)
             else:
                 data_filter = tuple(glob_escape(file_name) for file_name in data_files if file_name)
-            if no_metadata:
+            if no_metadata or bundle in submitted:
                 metadata_filter = ('',)
             else:
                 metadata_filter = ('*',)
             task = functools.partial(self.download_bundle, bundle_uuid,
-                                     data_filter=data_filter, metadata_filter=metadata_filter)
+                                     data_filter=data_filter, metadata_filter=metadata_filter,
+                                     bundle_manifest=bundle not in submitted)
             self.runner.submit(bundle_uuid, task)
-
-    def _write_output_manifest(self):
+            submitted.add(bundle)
+
+        bundle, data_files = None, set()
+        for row in rows:
+            row_bundle = (row['bundle_uuid'], row['bundle_version'])
+            if row_bundle != bundle:
+                if bundle is not None:
+                    submit(bundle, data_files)
+                bundle, data_files = row_bundle, set()
+            data_files.add(row['file_name'])
+        if bundle is not None:
+            submit(bundle, data_files)
+
+    @contextmanager
+    def _rewrite_manifest(self):
         """
-        Adds the file path column to the manifest and writes the copy to the current directory. If the original manifest
-        is in the current directory it is overwritten with a warning.
+        Read the manifest one row at a time while writing a copy of it with an added file path column to the current
+        directory. If the original manifest is in the current directory it is overwritten with a warning.
+
+        The copy only replaces the output file if the body of the with statement completes without an exception, i.e.
+        after all files have been downloaded.
+
+        :return: a context manager yielding an iterator of the rows of the manifest
         """
         output = os.path.basename(self.manifest)
-        fieldnames, source_manifest = self._parse_manifest(self.manifest)
-        if 'file_path' not in fieldnames:
-            fieldnames.append('file_path')
-        with atomic_write(output, overwrite=True, newline='') as f:
-            writer = tsv.DictWriter(f, fieldnames)
-            writer.writeheader()
-            for row in source_manifest:
-                row['file_path'] = self._file_path(row['file_sha256'], self.download_dir)
-                writer.writerow(row)
-            if os.path.isfile(output):
-                logger.warning('Overwriting manifest %s', output)
+        atomic_writer = AtomicWriter(output, overwrite=True)
+        with open(self.manifest) as source:
+            reader = tsv.DictReader(source)
+            fieldnames = list(reader.fieldnames or ())
+            if 'file_path' not in fieldnames:
+                fieldnames.append('file_path')
+            f = atomic_writer.get_fileobject(newline='')
+            try:
+                with f:
+                    writer = tsv.DictWriter(f, fieldnames)
+                    writer.writeheader()
+
+                    def rows():
+                        for row in reader:
+                            row['file_path'] = self._file_path(row['file_sha256'], self.download_dir)
+                            writer.writerow(row)
+                            yield row
+
+                    yield rows()
+                    atomic_writer.sync(f)
+            except BaseException:
+                atomic_writer.rollback(f)
+                raise
+        # The output may be the manifest itself, which Windows won't replace while it is open, so the copy only
+        # replaces it once both files are closed
+        if os.path.isfile(output):
+            logger.warning('Overwriting manifest %s', output)
+        atomic_writer.commit(f)
         logger.info('Rewrote manifest %s with additional column containing path to downloaded files.', output)
-
-    @classmethod
-    def _parse_manifest(cls, manifest):
-        with open(manifest) as f:
-            reader = tsv.DictReader(f)
-            return reader.fieldnames, list(reader)
@@ -0,0 +1,155 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from .. import logger
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limits the number of concurrent transfers and adjusts the limit to the observed performance, AIMD-style.
+
+    Every transfer holds a slot while its request is in flight. At the end of each interval the throughput and the time
+    to first byte seen during the interval are compared with what was seen before. While transfers are succeeding,
+    latency stays close to the best seen so far and all slots are in use, the limit grows: doubling at first, like TCP
+    slow start, and by one per interval after the first back-off. A failed or throttled request, or latency that has
+    grown to several times the best seen, means the server or the link is saturated, and the limit is halved, at most
+    once per interval.
+
+    The current limit, the number of transfers in flight and the throughput over the last interval are available as
+    attributes and from ``metrics()``.
+    """
+    INTERVAL = 2.0
+    LATENCY_FACTOR = 4
+    DEFAULT_INITIAL = 4
+    DEFAULT_MAXIMUM = 128
+
+    def __init__(self, initial=DEFAULT_INITIAL, minimum=1, maximum=DEFAULT_MAXIMUM, clock=time.monotonic):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.in_flight = 0
+        self.bytes_per_second = 0.0
+        self.total_bytes = 0
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._slow_start = True
+        self._saturated = False
+        self._best_latency = None
+        self._last_decrease = None
+        self._start_window(clock())
+
+    def _start_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_failures = 0
+        self._window_latency = 0.0
+        self._window_requests = 0
+        self._saturated = self.in_flight >= self.limit
+
+    @contextmanager
+    def slot(self):
+        """
+        A context manager that waits for the number of transfers in flight to drop below the limit and counts the body
+        of the with statement as one of them.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def record_latency(self, seconds):
+        """
+        Record the time it took for a request to return its response headers.
+        """
+        with self._cond:
+            self._window_latency += seconds
+            self._window_requests += 1
+            if self._best_latency is None or seconds < self._best_latency:
+                self._best_latency = seconds
+            self._maybe_adjust()
+
+    def record_bytes(self, nbytes):
+        with self._cond:
+            self._window_bytes += nbytes
+            self.total_bytes += nbytes
+            self._maybe_adjust()
+
+    def record_failure(self):
+        """
+        Record a request that failed or was throttled by the server.
+        """
+        with self._cond:
+            self._window_failures += 1
+            self._decrease()
+            self._maybe_adjust()
+
+    def metrics(self):
+        with self._cond:
+            return dict(concurrency=self.limit, in_flight=self.in_flight, bytes_per_second=self.bytes_per_second)
+
+    def _decrease(self):
+        now = self._clock()
+        if self._last_decrease is not None and now - self._last_decrease < self.INTERVAL:
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self._set_limit(self.limit // 2)
+
+    def _maybe_adjust(self):
+        now = self._clock()
+        elapsed = now - self._window_start
+        if elapsed < self.INTERVAL:
+            return
+        self.bytes_per_second = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_requests if self._window_requests else None
+        if latency is not None and latency > self.LATENCY_FACTOR * self._best_latency:
+            self._decrease()
+        elif not self._window_failures and self._saturated:
+            self._set_limit(self.limit * 2 if self._slow_start else self.limit + 1)
+        self._start_window(now)
+
+    def _set_limit(self, limit):
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit != self.limit:
+            logger.info("Download concurrency %d -> %d at %.1f MB/s", self.limit, limit, self.bytes_per_second / 1e6)
+            self.limit = limit
+            self._cond.notify_all()
+
+
+class FixedConcurrency(object):
+    """
+    Stands in for :class:`AdaptiveConcurrency` when the number of concurrent transfers is left to the size of the
+    thread pools.
+    """
+
+    def __init__(self, threads):
+        self.limit = threads
+        self.total_bytes = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        yield
+
+    def record_latency(self, seconds):
+        pass
+
+    def record_bytes(self, nbytes):
+        with self._lock:
+            self.total_bytes += nbytes
+
+    def record_failure(self):
+        pass
+
+    def metrics(self):
+        return dict(concurrency=self.limit, in_flight=None,
+                    bytes_per_second=self.total_bytes / max(time.monotonic() - self._start, 1e-9))
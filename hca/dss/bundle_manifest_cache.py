@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+
+from atomicwrites import atomic_write
+
+
+class BundleManifestCache(object):
+    """
+    A local cache of fully paginated bundle manifests, kept next to the filestore.
+
+    A bundle with a given UUID and version never changes, so its manifest can be reused by later downloads and
+    collection expansions instead of paging through it again. Manifests are stored as one JSON file per bundle, named
+    after the bundle's fully qualified ID. When the files in the cache take up more than ``max_size`` bytes, the least
+    recently used ones are removed until they take up no more than ``LOW_WATER_MARK`` of it, so that the cache isn't
+    scanned again on every subsequent addition.
+    """
+    DIRNAME = "bundles"
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    LOW_WATER_MARK = 0.8
+
+    def __init__(self, filestore_dir, max_size=DEFAULT_MAX_SIZE):
+        self.path = os.path.join(filestore_dir, self.DIRNAME)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._sizes = None
+
+    def _manifest_path(self, bundle_uuid, version):
+        return os.path.join(self.path, "{}.{}.json".format(bundle_uuid, version))
+
+    def _scan(self):
+        if self._sizes is None:
+            self._sizes = {}
+            try:
+                entries = list(os.scandir(self.path))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if entry.name.endswith(".json") and entry.is_file():
+                    self._sizes[entry.path] = entry.stat().st_size
+        return self._sizes
+
+    def get(self, bundle_uuid, version):
+        """
+        :return: the cached manifest of the given version of the given bundle, or None if it isn't in the cache
+        """
+        path = self._manifest_path(bundle_uuid, version)
+        try:
+            with open(path, encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Written by something else, since we only ever write complete files
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # eviction removes the least recently used manifests first
+        except OSError:
+            pass
+        return manifest
+
+    def put(self, bundle_uuid, version, manifest):
+        path = self._manifest_path(bundle_uuid, version)
+        data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with atomic_write(path, mode='wb', overwrite=True) as fh:
+                fh.write(data)
+            self._scan()[path] = len(data)
+            self._evict()
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._scan().pop(path, None)
+
+    def _evict(self):
+        sizes = self._scan()
+        total = sum(sizes.values())
+        if total <= self.max_size:
+            return
+        by_age = []
+        for path in sizes:
+            try:
+                by_age.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                by_age.append((0, path))
+        for _, path in sorted(by_age):
+            if total <= self.max_size * self.LOW_WATER_MARK:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= sizes.pop(path)
@@ -1,7 +1,7 @@
 from . import DSSClient
 
 
-def add_commands(subparsers, help_menu=False):
+def add_commands(subparsers, help_menu=False, subcommand=None):
     dss_parser = subparsers.add_parser('dss', help="Interact with the HCA Data Storage System")
 
     def help(args):
@@ -10,4 +10,4 @@ def add_commands(subparsers, help_menu=False):
     dss_parser.set_defaults(entry_point=help)
     dss_subparsers = dss_parser.add_subparsers()
     dss_cli_client = DSSClient()
-    dss_cli_client.build_argparse_subparsers(dss_subparsers, help_menu=help_menu)
+    dss_cli_client.build_argparse_subparsers(dss_subparsers, help_menu=help_menu, subcommand=subcommand)
@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+
+from atomicwrites import atomic_write
+
+
+class DownloadJournal(object):
+    """
+    A record of the progress of the downloads into a filestore, kept next to the filestore so that an interrupted
+    download can pick up where it left off.
+
+    The journal records which files are complete, so that a restarted download can skip them without looking at the
+    filestore, and for files being downloaded, the path of the partially downloaded file and the length of the prefix of
+    it that is known to have been written to disk. The hash state of a partial download can't be saved, so the prefix is
+    hashed again when the download is resumed, which is much cheaper than downloading it again.
+
+    Entries are keyed by the path of the file relative to the filestore. The journal is a file of JSON records, one per
+    line, that is appended to as downloads progress and compacted when it is loaded.
+    """
+    FILENAME = "journal.jsonl"
+
+    def __init__(self, filestore_dir):
+        self.path = os.path.join(filestore_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._completed = set()
+        self._partials = {}
+        self._claimed = set()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                lines = fh.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a record that was being written when we were interrupted
+            self._apply(record)
+        if len(lines) > len(self._completed) + len(self._partials):
+            with atomic_write(self.path, overwrite=True) as fh:
+                for record in self._records():
+                    fh.write(json.dumps(record) + "\n")
+
+    def _apply(self, record):
+        key = record["key"]
+        self._partials.pop(key, None)
+        if record.get("complete"):
+            self._completed.add(key)
+        else:
+            self._completed.discard(key)
+            if record.get("partial_path"):
+                self._partials[key] = (record["partial_path"], record["offset"])
+
+    def _records(self):
+        for key in sorted(self._completed):
+            yield dict(key=key, complete=True)
+        for key, (partial_path, offset) in sorted(self._partials.items()):
+            yield dict(key=key, partial_path=partial_path, offset=offset)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as fh:
+                fh.write(json.dumps(record) + "\n")
+
+    def is_complete(self, key):
+        return key in self._completed
+
+    def claim_partial(self, key):
+        """
+        Claim the partial download of the file with the given key, if there is one and it isn't already being resumed
+        by another thread.
+
+        :return: a tuple of the path of the partially downloaded file and the number of bytes at the beginning of it
+                 that have been written, or None
+        """
+        with self._lock:
+            if key in self._claimed:
+                return None
+            self._claimed.add(key)
+            return self._partials.get(key)
+
+    def release(self, key):
+        with self._lock:
+            self._claimed.discard(key)
+
+    def checkpoint(self, key, partial_path, offset):
+        """
+        Record that the first ``offset`` bytes of the partial download of the file with the given key have been written
+        to disk.
+        """
+        self._append(dict(key=key, partial_path=partial_path, offset=offset))
+
+    def complete(self, key):
+        self._append(dict(key=key, complete=True))
+
+    def discard(self, key):
+        """
+        Forget about the file with the given key, complete or not.
+        """
+        self._append(dict(key=key))
@@ -3,20 +3,29 @@
 """
 Run "pip install crcmod python-magic boto3" to install this script's dependencies.
 """
+import concurrent.futures
 import logging
 import mimetypes
 import os
 import sys
+import threading
 import uuid
 
-import boto3
-from boto3.s3.transfer import TransferConfig
-import tqdm
-
 from ..config import logger, ProgressBarStreamHandler
+from .._lazy import lazy_import
+from ..util.checksum_cache import get_checksum_cache
+from ..util.fs_walk import FileWalk
+from ..util.s3_lister import list_objects
 from dcplib import s3_multipart
 from dcplib.checksumming_io import ChecksummingBufferedReader
 
+boto3 = lazy_import("boto3")
+transfer = lazy_import("boto3.s3.transfer")
+tqdm = lazy_import("tqdm")
+
+DEFAULT_STAGING_THREADS = 8
+DEFAULT_MAX_INFLIGHT_BYTES = 1024 ** 3
+
 
 def encode_tags(tags):
     return [dict(Key=k, Value=v) for k, v in tags.items()]
@@ -32,33 +41,96 @@ def _mime_type(filename):
 
 
 def _copy_from_s3(path, s3):
+    """
+    Generate a (file uuid, key name) pair for each object under an S3 directory path, as soon as the sharded listing
+    produces it, in no particular order.
+    """
     bucket_end = path.find("/", 5)
     bucket_name = path[5: bucket_end]
     dir_path = path[bucket_end + 1:]
 
-    src_bucket = s3.Bucket(bucket_name)
-    file_uuids = []
-    key_names = []
     logging.info("Key Names:")
-    for obj in src_bucket.objects.filter(Prefix=dir_path):
+    for obj in list_objects(s3.meta.client, bucket_name, dir_path):
+        key = obj['Key']
         # Empty files with no name were throwing errors
-        if obj.key == dir_path:
+        if key == dir_path:
             continue
 
-        logging.info(obj.key)
-
-        file_uuids.append(str(uuid.uuid4()))
-        key_names.append(obj.key)
+        logging.info(key)
 
-    return file_uuids, key_names
+        yield str(uuid.uuid4()), key
 
 
-def upload_to_cloud(file_paths, staging_bucket, replica, from_cloud=False, log_progress=False):
+class _ByteBudget(object):
+    """
+    Limits the total number of bytes that are being staged at any one time. A file larger than the whole budget is
+    admitted once nothing else is in flight so that it can't block forever.
+    """
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._inflight_bytes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self._max_bytes)
+        with self._cond:
+            while self._inflight_bytes and self._inflight_bytes + size > self._max_bytes:
+                self._cond.wait()
+            self._inflight_bytes += size
+        return size
+
+    def release(self, size):
+        with self._cond:
+            self._inflight_bytes -= size
+            self._cond.notify_all()
+
+
+def _stage_file(s3_client, staging_bucket, file_path, callback):
+    checksum_cache = get_checksum_cache()
+    with open(file_path, 'rb') as raw_fh:
+        stat = os.fstat(raw_fh.fileno())
+        file_size = stat.st_size
+        multipart_chunksize = s3_multipart.get_s3_multipart_chunk_size(file_size)
+        tx_cfg = transfer.TransferConfig(multipart_threshold=s3_multipart.MULTIPART_THRESHOLD,
+                                         multipart_chunksize=multipart_chunksize)
+        file_uuid = str(uuid.uuid4())
+        key_name = "{}/{}".format(file_uuid, os.path.basename(raw_fh.name))
+        upload_args = dict(Config=tx_cfg, Callback=callback, ExtraArgs={'ContentType': _mime_type(raw_fh.name)})
+        sums = checksum_cache.get(raw_fh.name, stat=stat)
+        if sums is not None:
+            # The file itself can be read in parallel parts when it doesn't have to be checksummed in order
+            s3_client.upload_fileobj(raw_fh, staging_bucket, key_name, **upload_args)
+        else:
+            with ChecksummingBufferedReader(raw_fh, multipart_chunksize) as fh:
+                s3_client.upload_fileobj(fh, staging_bucket, key_name, **upload_args)
+                sums = fh.get_checksums()
+            checksum_cache.put(raw_fh.name, sums, stat=stat)
+        metadata = {
+            "hca-dss-s3_etag": sums["s3_etag"],
+            "hca-dss-sha1": sums["sha1"],
+            "hca-dss-sha256": sums["sha256"],
+            "hca-dss-crc32c": sums["crc32c"],
+        }
+        s3_client.put_object_tagging(Bucket=staging_bucket,
+                                     Key=key_name,
+                                     Tagging=dict(TagSet=encode_tags(metadata)))
+        return file_uuid, key_name, raw_fh.name
+
+
+def _grow_progress_total(progress, size):
+    progress.total += size
+    progress.refresh()
+
+
+def upload_to_cloud(file_paths, staging_bucket, replica, from_cloud=False, log_progress=False,
+                    threads=DEFAULT_STAGING_THREADS, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES):
     """
     Upload files to cloud.
 
     :param file_paths: If from_cloud, file_handles is a aws s3 directory path to files with appropriate
-                       metadata uploaded. Else, a list of paths of files to upload.
+                       metadata uploaded. Else, an iterable of paths of files to upload. Files are staged as they
+                       are produced; given a :class:`hca.util.fs_walk.FileWalk`, the progress bar's total grows as the
+                       walk adds up the size of the files.
     :param staging_bucket: The aws bucket to upload the files to.
     :param replica: The cloud replica to write to. One of 'aws', 'gc', or 'azure'. No functionality now.
     :param bool log_progress: set to True to log progress to stdout. Progress bar will reflect bytes
@@ -67,6 +139,9 @@ def upload_to_cloud(file_paths, staging_bucket, replica, from_cloud=False, log_p
                               In addition, even if this is set to True, a progress bar will not
                               be shown if (a) the logging level is not INFO or lower or (b) an
                               interactive session is not detected.
+    :param int threads: the number of files to stage concurrently.
+    :param int max_inflight_bytes: the maximum combined size of the files being staged at any one time. A
+                                   single file larger than this is staged on its own.
     :return: a list of file uuids, key-names, and absolute file paths (local) for uploaded files
     """
     s3 = boto3.resource("s3")
@@ -76,45 +151,55 @@ def upload_to_cloud(file_paths, staging_bucket, replica, from_cloud=False, log_p
     log_progress = all((logger.getEffectiveLevel() <= logging.INFO, sys.stdout.isatty(), log_progress))
 
     if from_cloud:
-        file_uuids, key_names = _copy_from_s3(file_paths[0], s3)
+        # The prefix is listed in parallel shards, which produce keys out of order, so only the results are sorted
+        for file_uuid, key_name in sorted(_copy_from_s3(file_paths[0], s3), key=lambda copied: copied[1]):
+            file_uuids.append(file_uuid)
+            key_names.append(key_name)
     else:
-        destination_bucket = s3.Bucket(staging_bucket)
+        # Low-level clients are thread-safe, resources are not, so all workers share the resource's client.
+        s3_client = s3.meta.client
+        if isinstance(file_paths, FileWalk):
+            # The walk has already stat'ed each file; one it couldn't is reported when it is opened for staging
+            sized_paths = ((file_path, file_size or 0) for file_path, file_size in file_paths.with_sizes())
+        else:
+            sized_paths = ((file_path, os.path.getsize(file_path)) for file_path in file_paths)
         if log_progress:
-            total_upload_size = sum(os.path.getsize(f) for f in file_paths)
             logger.addHandler(ProgressBarStreamHandler())
-            progress = tqdm.tqdm(total=total_upload_size, desc="Uploading to " + replica,
-                                 unit="B", unit_scale=True, unit_divisor=1024)
-        for file_path in file_paths:
-            with open(file_path, 'rb') as raw_fh:
-                file_size = os.path.getsize(raw_fh.name)
-                multipart_chunksize = s3_multipart.get_s3_multipart_chunk_size(file_size)
-                tx_cfg = TransferConfig(multipart_threshold=s3_multipart.MULTIPART_THRESHOLD,
-                                        multipart_chunksize=multipart_chunksize)
-                with ChecksummingBufferedReader(raw_fh, multipart_chunksize) as fh:
-                    file_uuid = str(uuid.uuid4())
-                    key_name = "{}/{}".format(file_uuid, os.path.basename(fh.raw.name))
-                    destination_bucket.upload_fileobj(
-                        fh,
-                        key_name,
-                        Config=tx_cfg,
-                        Callback=lambda x: progress.update(x) if log_progress else None,
-                        ExtraArgs={
-                            'ContentType': _mime_type(fh.raw.name),
-                        }
-                    )
-                    sums = fh.get_checksums()
-                    metadata = {
-                        "hca-dss-s3_etag": sums["s3_etag"],
-                        "hca-dss-sha1": sums["sha1"],
-                        "hca-dss-sha256": sums["sha256"],
-                        "hca-dss-crc32c": sums["crc32c"],
-                    }
-                    s3.meta.client.put_object_tagging(Bucket=destination_bucket.name,
-                                                      Key=key_name,
-                                                      Tagging=dict(TagSet=encode_tags(metadata)))
-                    file_uuids.append(file_uuid)
-                    key_names.append(key_name)
-                    abs_file_paths.append(fh.raw.name)
+            if isinstance(file_paths, FileWalk):
+                progress = tqdm.tqdm(total=file_paths.total_size, desc="Uploading to " + replica,
+                                     unit="B", unit_scale=True, unit_divisor=1024)
+                file_paths.on_sized = lambda file_count, size: _grow_progress_total(progress, size)
+            else:
+                sized_paths = list(sized_paths)
+                progress = tqdm.tqdm(total=sum(file_size for _, file_size in sized_paths),
+                                     desc="Uploading to " + replica, unit="B", unit_scale=True, unit_divisor=1024)
+        callback = progress.update if log_progress else None
+        budget = _ByteBudget(max_inflight_bytes)
+        failed = threading.Event()
+
+        def stage(file_path, reserved_bytes):
+            try:
+                return _stage_file(s3_client, staging_bucket, file_path, callback)
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                budget.release(reserved_bytes)
+
+        futures = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            for file_path, file_size in sized_paths:
+                reserved_bytes = budget.acquire(file_size)
+                if failed.is_set():
+                    budget.release(reserved_bytes)
+                    break
+                futures.append(executor.submit(stage, file_path, reserved_bytes))
+        # Results are collected in submission order so that they line up with ``file_paths``.
+        for future in futures:
+            file_uuid, key_name, abs_file_path = future.result()
+            file_uuids.append(file_uuid)
+            key_names.append(key_name)
+            abs_file_paths.append(abs_file_path)
         if log_progress:
             logger.handlers = [l for l in logger.handlers if not isinstance(l, ProgressBarStreamHandler)]
             progress.close()
@@ -1,11 +1,15 @@
+import itertools
 import os
 import sys
 
-import boto3
-
+from hca._lazy import lazy_import
 from hca.upload import UploadService
 from .common import UploadCLICommand
 
+boto3 = lazy_import("boto3")
+s3_lister = lazy_import("hca.util.s3_lister")
+fs_walk = lazy_import("hca.util.fs_walk")
+
 
 class UploadCommand(UploadCLICommand):
     """Upload a file to the currently selected upload area.
@@ -37,29 +41,48 @@ class UploadCommand(UploadCLICommand):
         upload_parser.add_argument('-q', '--quiet', action='store_true', help="Suppress normal output.")
         upload_parser.add_argument('-s', '--sync', action='store_true',
                                    help="If set to true, do not upload files to an area in which the file has already "
-                                        "been uploaded before")
+                                        "been uploaded before. The Upload Service is still notified of those files.")
+        upload_parser.add_argument('--dry-run', action='store_true',
+                                   help="With --sync, report which files would be uploaded, without uploading them.")
+        upload_parser.add_argument('--single-pass', action='store_true',
+                                   help="Checksum files while uploading them instead of beforehand, so that each file "
+                                        "is only read once. Ignored with --sync.")
         upload_parser.set_defaults(entry_point=UploadCommand)
 
     def __init__(self, args):
         self.source_s3_client = boto3.client('s3')
-        self.file_paths = []
-        self.file_size_sum = 0
         self._load_config()
         self._check_args(args)
-        for upload_path in args.upload_paths:
-            self._load_file_paths_from_upload_path(args, upload_path)
+        # Local directories are walked, and S3 prefixes listed, while the upload is under way, so that uploading can
+        # start before the walk or listing is complete
+        local_paths = [path for path in args.upload_paths if not path.startswith("s3://")]
+        s3_paths = [path for path in args.upload_paths if path.startswith("s3://")]
+        file_filter = None
+        if args.file_extension:
+            file_filter = lambda file_name: file_name.endswith(args.file_extension)  # noqa: E731
+        local_file_paths = fs_walk.FileWalk(local_paths, file_filter)
+        file_paths = local_file_paths
+        if s3_paths:
+            file_paths = itertools.chain(local_file_paths, self._iterate_files_from_s3_paths(s3_paths))
         config = UploadService.config()
         area_uuid = config.current_area
         area_uri = config.area_uri(area_uuid)
         upload_service = UploadService(deployment_stage=area_uri.deployment_stage)
         area = upload_service.upload_area(area_uri=area_uri)
-        area.upload_files(self.file_paths,
-                          self.file_size_sum,
+        if args.dry_run:
+            # S3 sources are always copied, and are listed as such
+            plan = area.plan_sync(file_paths,
+                                  target_filename=args.target_filename,
+                                  use_transfer_acceleration=(not args.no_transfer_acceleration))
+            print(plan.report(verbose=True))
+            return
+        area.upload_files(file_paths,
                           target_filename=args.target_filename,
                           use_transfer_acceleration=(not args.no_transfer_acceleration),
                           report_progress=(not args.quiet),
                           dcp_type="data",
-                          sync=(args.sync))
+                          sync=(args.sync),
+                          single_pass=args.single_pass)
 
     def _load_config(self):
         self.config = UploadService.config()
@@ -70,6 +93,9 @@ class UploadCommand(UploadCLICommand):
             exit(1)
 
     def _check_args(self, args):
+        if args.dry_run and not args.sync:
+            print("--dry-run may only be used with --sync.")
+            exit(1)
         if args.target_filename and (len(args.upload_paths) > 1 or os.path.isdir(args.upload_paths[0])):
             print("--target-filename option may only be used when one file is being uploaded.")
             exit(1)
@@ -79,36 +105,11 @@ class UploadCommand(UploadCLICommand):
                     print("--file-extension can only be used when paths targeted for upload are directories")
                     exit(1)
 
-    def _load_file_paths_from_upload_path(self, args, upload_path):
-        if upload_path.startswith("s3://"):
-            s3_file_paths, s3_file_size_sum = self._retrieve_files_list_and_size_sum_tuple_from_s3_path(upload_path)
-            self.file_paths += s3_file_paths
-            self.file_size_sum += s3_file_size_sum
-        elif os.path.isfile(upload_path):
-            self.file_paths.append(upload_path)
-            self.file_size_sum += os.path.getsize(upload_path)
-        elif os.path.isdir(upload_path):
-            for dir_path, sub_dir_list, file_list in os.walk(upload_path):
-                for file_name in file_list:
-                    if not args.file_extension or file_name.endswith(args.file_extension):
-                        file_path = os.path.join(dir_path, file_name)
-                        self.file_paths.append(file_path)
-                        self.file_size_sum += os.path.getsize(file_path)
-
-    def _retrieve_files_list_and_size_sum_tuple_from_s3_path(self, s3_path):
-        s3_file_obj_paths = []
-        s3_file_size_bytes_sum = 0
-        bucket, prefix = self._parse_s3_path(s3_path)
-
-        paginator = self.source_s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
-        for page in page_iterator:
-            if "Contents" in page:
-                for key in page["Contents"]:
-                    s3_file_size_bytes_sum += key['Size']
-                    s3_obj_path = "s3://{0}/{1}".format(bucket, key['Key'])
-                    s3_file_obj_paths.append(s3_obj_path)
-        return s3_file_obj_paths, s3_file_size_bytes_sum
+    def _iterate_files_from_s3_paths(self, s3_paths):
+        for s3_path in s3_paths:
+            bucket, prefix = self._parse_s3_path(s3_path)
+            for obj in s3_lister.list_objects(self.source_s3_client, bucket, prefix):
+                yield "s3://{0}/{1}".format(bucket, obj['Key'])
 
     def _parse_s3_path(self, s3_path):
         s3_path = s3_path.replace("s3://", "")
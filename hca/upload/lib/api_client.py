@@ -2,12 +2,16 @@ try:
     import urllib.parse as urlparse
 except ImportError:
     import urllib as urlparse
+import threading
 
-import requests
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from ..._lazy import lazy_import
 from ..upload_config import UploadConfig
 
+requests = lazy_import("requests")
+retry_util = lazy_import("urllib3.util.retry")
+
 
 class UploadApiException(RuntimeError):
     """
@@ -24,11 +28,39 @@ class ApiClient:
       - when and how to authenticate
 
     ApiClient is not normally called directly, it is used by UploadArea.
+
+    All ApiClients share one pooled HTTP session, so connections to the Upload Service are kept alive and reused
+    across requests, threads and instances. They also share what they learn about which Upload Services don't accept
+    notifications for several files at once, so that each is only asked once.
     """
+    _session = None
+    _session_lock = threading.Lock()
+    # Base URLs of the Upload Services that have no endpoint for notifications about several files
+    _bulk_notifications_unsupported = set()
 
     def __init__(self, deployment_stage, authentication_token=None):
         self.deployment_stage = deployment_stage
         self.auth_token = authentication_token
+        self._base_url = None
+
+    @classmethod
+    def get_session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                from ...util import DEFAULT_THREAD_COUNT
+                # Unsafe methods are not retried here. Those that can safely be repeated are retried by the caller.
+                retry_policy = retry_util.Retry(total=5,
+                                                backoff_factor=0.1,
+                                                status_forcelist=frozenset({500, 502, 503, 504}),
+                                                raise_on_status=False)
+                adapter = requests.adapters.HTTPAdapter(max_retries=retry_policy,
+                                                        pool_maxsize=max(DEFAULT_THREAD_COUNT,
+                                                                         requests.adapters.DEFAULT_POOLSIZE))
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
 
     # Upload Area Manipulation
 
@@ -54,7 +86,7 @@ class ApiClient:
         :return: True or False
         :rtype: bool
         """
-        response = requests.head(self._url(path="/area/{id}".format(id=area_uuid)))
+        response = self.get_session().head(self._url(path="/area/{id}".format(id=area_uuid)))
         return response.ok
 
     def delete_area(self, area_uuid):
@@ -123,6 +155,32 @@ class ApiClient:
         response = self._make_request('post', path=path)
         return response.ok
 
+    def files_upload_notification(self, area_uuid, file_list):
+        """
+        Notify Upload Service that several files have been placed in an Upload Area
+
+        :param str area_uuid: A RFC4122-compliant ID for the upload area
+        :param list file_list: The names of the files in the Upload Area
+        :return: True, or False if the Upload Service does not accept notifications for several files at once. That
+                 is remembered, so that it isn't asked again.
+        :rtype: bool
+        :raises UploadApiException: if the notification failed
+        """
+        # Two segments after the area, so that the path cannot be taken for the per-file notification of a file that
+        # happens to be called "files_uploaded"
+        path = "/area/{uuid}/notifications/files_uploaded".format(uuid=area_uuid)
+        url = self._url(path)
+        if self._base_url in self._bulk_notifications_unsupported:
+            return False
+        file_list = [urlparse.quote(filename) for filename in file_list]
+        # Not retried: the caller notifies the files one by one if this fails
+        response = self.get_session().post(url, json=file_list)
+        if response.status_code in (404, 405, 501):
+            self._bulk_notifications_unsupported.add(self._base_url)
+            return False
+        self._check_response(response)
+        return True
+
     def files_info(self, area_uuid, file_list):
         """
         Get information about files
@@ -226,8 +284,11 @@ class ApiClient:
 
     def _make_request(self, verb, path, **kwargs):
         url = self._url(path)
-        func = getattr(requests, verb)
-        response = func(url=url, **kwargs)
+        response = self.get_session().request(verb, url, **kwargs)
+        return self._check_response(response)
+
+    @staticmethod
+    def _check_response(response):
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -240,9 +301,11 @@ class ApiClient:
             return response
 
     def _url(self, path):
-        if self.deployment_stage == 'prod':
-            return "{base}{path}".format(base=UploadConfig().production_api_url, path=path)
-        else:
-            return "{base}{path}".format(
-                base=UploadConfig().preprod_api_url_template.format(deployment_stage=self.deployment_stage),
-                path=path)
+        if self._base_url is None:
+            # Loading the config rewrites it, so only do that once
+            config = UploadConfig()
+            if self.deployment_stage == 'prod':
+                self._base_url = config.production_api_url
+            else:
+                self._base_url = config.preprod_api_url_template.format(deployment_stage=self.deployment_stage)
+        return "{base}{path}".format(base=self._base_url, path=path)
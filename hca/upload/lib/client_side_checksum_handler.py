@@ -4,6 +4,8 @@ import time
 from dcplib.checksumming_io import ChecksummingSink
 from dcplib.s3_multipart import get_s3_multipart_chunk_size
 
+from ...util.checksum_cache import get_checksum_cache
+
 # Checksum(s) to compute for file; current options: crc32c, sha1, sha256, s3_etag
 CHECKSUM_NAMES = ['crc32c']
 
@@ -41,9 +43,15 @@ class ClientSideChecksumHandler:
             self._checksums = checksums
 
         def compute(self):
-            """ Compute the checksum(s) for the given file and return a map of the value by the hash function name. """
+            """ Compute the checksum(s) for the given file and return a map of the value by the hash function name.
+            Checksums of a file that hasn't changed since they were last computed are taken from the checksum
+            cache instead. """
+            stat = os.stat(self._filename)
+            checksums = get_checksum_cache().get(self._filename, self._checksums, stat=stat)
+            if checksums is not None:
+                return checksums
             start_time = time.time()
-            _file_size = os.path.getsize(self._filename)
+            _file_size = stat.st_size
             _multipart_chunksize = get_s3_multipart_chunk_size(_file_size)
             with ChecksummingSink(_multipart_chunksize, hash_functions=self._checksums) as sink:
                 with open(self._filename, 'rb') as _file_object:
@@ -53,4 +61,25 @@ class ClientSideChecksumHandler:
                         data = _file_object.read(_multipart_chunksize)
                 checksums = sink.get_checksums()
                 print("Checksumming took %.2f milliseconds to compute" % ((time.time() - start_time) * 1000))
+            get_checksum_cache().put(self._filename, checksums, stat=stat)
             return checksums
+
+
+class ChecksummingReader:
+    """ A read-only file-like object that computes the client-side checksums of the data read through it, so that a
+    file can be checksummed while it is being uploaded. It deliberately can't seek, which makes boto3 read it once,
+    front to back."""
+
+    def __init__(self, file_object, file_size, checksums=CHECKSUM_NAMES):
+        self._file_object = file_object
+        self._sink = ChecksummingSink(get_s3_multipart_chunk_size(file_size), hash_functions=checksums)
+
+    def read(self, size=-1):
+        data = self._file_object.read(size)
+        self._sink.write(data)
+        return data
+
+    def get_checksum_metadata_tag(self):
+        """ Returns a map of checksum values by the name of the hashing function that produced it. Only complete
+        once the whole file has been read."""
+        return {str(_hash_name): str(_hash_value) for _hash_name, _hash_value in self._sink.get_checksums().items()}
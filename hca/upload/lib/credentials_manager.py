@@ -1,7 +1,15 @@
+import datetime
+import threading
+
 from botocore.credentials import DeferredRefreshableCredentials, CredentialProvider
+from botocore.utils import parse_timestamp
 
 from .api_client import ApiClient
 
+# Longer than botocore's advisory refresh period (15 minutes), so that when botocore asks for fresh credentials it
+# is not handed the ones it is about to give up on.
+CREDENTIALS_REFRESH_MARGIN = datetime.timedelta(minutes=20)
+
 
 class CredentialsManager(CredentialProvider):
 
@@ -9,18 +17,33 @@ class CredentialsManager(CredentialProvider):
     We are using an internal feature of Boto3 that allows you to provide an object that will refresh credentials
     when they are getting close to expiry.  An instance of CredentialsManager is such an object.
     Based on an original example by Andrey here: https://allspark.dev.data.humancellatlas.org/snippets/1
+
+    Credentials obtained from the Upload Service are kept until they are close to expiry, so that every client of an
+    Upload Area built with the same CredentialsManager shares one set.
     """
     def __init__(self, upload_area):
         super(CredentialsManager, self).__init__()
         self.area = upload_area
+        self._api_client = None
+        self._credentials = None
+        self._lock = threading.Lock()
 
     def load(self):
         return DeferredRefreshableCredentials(refresh_using=self.get_credentials_from_upload_api, method=None)
 
     def get_credentials_from_upload_api(self):
-        api = ApiClient(deployment_stage=self.area.deployment_stage)
-        credentials = api.credentials(area_uuid=self.area.uuid)
-        return dict(access_key=credentials['AccessKeyId'],
-                    secret_key=credentials['SecretAccessKey'],
-                    token=credentials['SessionToken'],
-                    expiry_time=credentials['Expiration'])
+        with self._lock:
+            if self._credentials is None or self._expires_soon(self._credentials):
+                if self._api_client is None:
+                    self._api_client = ApiClient(deployment_stage=self.area.deployment_stage)
+                credentials = self._api_client.credentials(area_uuid=self.area.uuid)
+                self._credentials = dict(access_key=credentials['AccessKeyId'],
+                                         secret_key=credentials['SecretAccessKey'],
+                                         token=credentials['SessionToken'],
+                                         expiry_time=credentials['Expiration'])
+            return dict(self._credentials)
+
+    @staticmethod
+    def _expires_soon(credentials):
+        expiry_time = parse_timestamp(credentials['expiry_time'])
+        return expiry_time - datetime.datetime.now(datetime.timezone.utc) < CREDENTIALS_REFRESH_MARGIN
@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import time
 
 import boto3
 from boto3.s3.transfer import TransferConfig
@@ -10,7 +12,14 @@ from botocore.session import get_session
 from dcplib import s3_multipart
 from tenacity import retry, wait_fixed, stop_after_attempt
 
+from ...util import DEFAULT_THREAD_COUNT
+from ...util.checksum_cache import get_checksum_cache
+from .client_side_checksum_handler import ChecksummingReader
+from .upload_scheduler import estimate_makespan
+
 WRITE_PERCENT_THRESHOLD = 0.1
+# Enough connections for each upload thread to have one, and for a multipart transfer to run all of its parts at once
+DEFAULT_MAX_POOL_CONNECTIONS = DEFAULT_THREAD_COUNT + TransferConfig().max_concurrency
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -28,35 +37,90 @@ def sizeof_fmt(num, suffix='B'):
     return "%.18f %s%s" % (num, 'Yi', suffix)
 
 
-class S3Agent:
+def duration_fmt(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%dh%02dm" % (hours, minutes)
+    if minutes:
+        return "%dm%02ds" % (minutes, seconds)
+    return "%ds" % seconds
 
-    def __init__(self, credentials_provider, transfer_acceleration=True):
-        config = Config(s3={'use_accelerate_endpoint': True}) if transfer_acceleration else Config()
-        botocore_session = get_session()
-        botocore_session.register_component('credential_provider', CredentialResolver(providers=[credentials_provider]))
-        my_session = boto3.Session(botocore_session=botocore_session)
-        self.target_s3 = my_session.resource('s3', config=config)
-        self.source_s3_client = boto3.client('s3')
 
-    def set_s3_agent_variables_for_batch_file_upload(self, file_count=0, file_size_sum=0):
+class UploadBatch:
+
+    """
+    The progress of one call to upload files: how many files and bytes there are to transfer, how much has been
+    transferred so far, and which files failed. S3Agents are shared by every upload to an Upload Area, so this is kept
+    separately for each call.
+
+    Given the UploadScheduler the files are scheduled with and the number of transfer workers, the time remaining is
+    estimated from the jobs still queued or running, rather than from the bytes remaining alone.
+    """
+
+    def __init__(self, file_count=0, file_size_sum=0, scheduler=None, workers=1):
         self.file_count = file_count
         self.file_size_sum = file_size_sum
         self.file_upload_completed_count = 0
         self.cumulative_bytes_transferred = 0
         self.bytes_transferred_at_last_sys_write = 0
         self.failed_uploads = {}
+        self.batch_started_at = time.time()
+        self.scheduler = scheduler
+        self.workers = workers
+        self._lock = threading.Lock()
+
+    def add_to_upload_totals(self, file_count, file_size_sum):
+        """ Account for more files, found after the upload started. """
+        with self._lock:
+            self.file_count += file_count
+            self.file_size_sum += file_size_sum
+
+    def file_completed(self, file_path=None):
+        with self._lock:
+            self.file_upload_completed_count += 1
+        if self.scheduler is not None and file_path is not None:
+            self.scheduler.file_finished(file_path)
+
+    def file_failed(self, file_path, e):
+        self.failed_uploads[file_path] = e
+        if self.scheduler is not None:
+            self.scheduler.file_finished(file_path)
+
+    def estimated_time_remaining(self):
+        """
+        Estimate the seconds left in the batch, assuming each worker transfers at an equal share of the rate the batch
+        has been transferred at so far. The workers share the bytes not yet transferred, but with a scheduler, the
+        estimate is no less than the time the busiest worker takes to finish the jobs queued and running, and no less
+        than the time the largest remaining file takes on its own. Files partly transferred count in full.
+
+        :return: the estimate, or None if nothing has been transferred yet
+        """
+        elapsed = time.time() - self.batch_started_at
+        if self.cumulative_bytes_transferred <= 0 or elapsed <= 0:
+            return None
+        workers = max(self.workers, 1)
+        worker_bytes_remaining = max(self.file_size_sum - self.cumulative_bytes_transferred, 0) / workers
+        if self.scheduler is not None:
+            job_sizes, largest_file = self.scheduler.remaining_work()
+            worker_bytes_remaining = max(worker_bytes_remaining, estimate_makespan(job_sizes, workers, largest_file))
+        return worker_bytes_remaining / (self.cumulative_bytes_transferred / elapsed / workers)
 
     def upload_progress_callback(self, bytes_transferred):
-        self.cumulative_bytes_transferred += bytes_transferred
-        files_remaining = self.file_count - self.file_upload_completed_count
-        if self.should_write_to_terminal():
-            self.bytes_transferred_at_last_sys_write = self.cumulative_bytes_transferred
-            sys.stdout.write(
-                "Completed %s/%s with %s of %s files remaining \r" % (sizeof_fmt(self.cumulative_bytes_transferred),
-                                                                      sizeof_fmt(self.file_size_sum),
-                                                                      files_remaining,
-                                                                      self.file_count))
-            sys.stdout.flush()
+        with self._lock:
+            self.cumulative_bytes_transferred += bytes_transferred
+            files_remaining = self.file_count - self.file_upload_completed_count
+            if self.should_write_to_terminal():
+                self.bytes_transferred_at_last_sys_write = self.cumulative_bytes_transferred
+                time_remaining = self.estimated_time_remaining()
+                sys.stdout.write(
+                    "Completed %s/%s with %s of %s files remaining%s \r" % (
+                        sizeof_fmt(self.cumulative_bytes_transferred),
+                        sizeof_fmt(self.file_size_sum),
+                        files_remaining,
+                        self.file_count,
+                        "" if time_remaining is None else ", about %s left" % duration_fmt(time_remaining)))
+                sys.stdout.flush()
 
     def should_write_to_terminal(self):
         write_to_terminal = False
@@ -67,8 +131,55 @@ class S3Agent:
             write_to_terminal = True
         return write_to_terminal
 
+
+class UploadBatchView:
+
+    """
+    A read-only view of an S3Agent together with the UploadBatch of an upload through it, with the attributes an S3Agent
+    used to have when it kept the progress of the latest upload itself. Only for code written against
+    ``UploadArea.s3agent``, which is deprecated.
+    """
+
+    BATCH_ATTRIBUTES = ('file_count', 'file_size_sum', 'file_upload_completed_count', 'cumulative_bytes_transferred',
+                        'bytes_transferred_at_last_sys_write', 'failed_uploads')
+
+    def __init__(self, s3agent, batch):
+        object.__setattr__(self, '_s3agent', s3agent)
+        object.__setattr__(self, '_batch', batch)
+
+    def __getattr__(self, name):
+        if name in self.BATCH_ATTRIBUTES:
+            return getattr(self._batch, name)
+        return getattr(self._s3agent, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UploadArea.s3agent is read-only")
+
+
+class S3Agent:
+
+    """
+    Transfers files to and from an Upload Area. An S3Agent is meant to be kept for as long as the Upload Area is in
+    use: its clients and their connection pools are reused by every transfer, and credentials are only requested again
+    when the credentials provider's expire. It holds no state of its own about the transfers, so it may be used by
+    several uploads at once: each reports its progress to the UploadBatch it is given.
+    """
+
+    def __init__(self, credentials_provider, transfer_acceleration=True,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+        if transfer_acceleration:
+            config = Config(max_pool_connections=max_pool_connections, s3={'use_accelerate_endpoint': True})
+        else:
+            config = Config(max_pool_connections=max_pool_connections)
+        botocore_session = get_session()
+        botocore_session.register_component('credential_provider', CredentialResolver(providers=[credentials_provider]))
+        my_session = boto3.Session(botocore_session=botocore_session)
+        self.target_s3 = my_session.resource('s3', config=config)
+        self.source_s3_client = boto3.client('s3', config=Config(max_pool_connections=max_pool_connections))
+
     @retry(reraise=True, wait=wait_fixed(2), stop=stop_after_attempt(3))
-    def copy_s3_file(self, s3_path, target_bucket, target_key, content_type, checksums={}, report_progress=False):
+    def copy_s3_file(self, s3_path, target_bucket, target_key, content_type, checksums={}, report_progress=False,
+                     count_size=False, batch=None):
         # Here we are using s3's managed copy to allow for s3 to s3 file upload
         # We override any original metadata or content types
         s3_path_split = s3_path.replace("s3://", "").split("/", 1)
@@ -76,6 +187,8 @@ class S3Agent:
         source_key = s3_path_split[1]
         response = self.source_s3_client.head_object(Bucket=source_bucket, Key=source_key)
         file_size = response['ContentLength']
+        if count_size and batch is not None:
+            batch.add_to_upload_totals(0, file_size)
         copy_source = {
             'Bucket': source_bucket,
             'Key': source_key
@@ -93,34 +206,74 @@ class S3Agent:
             'Bucket': target_bucket,
             'Key': target_key
         }
-        if report_progress:
-            upload_args['Callback'] = self.upload_progress_callback
+        if report_progress and batch is not None:
+            upload_args['Callback'] = batch.upload_progress_callback
         self.target_s3.meta.client.copy(**upload_args)
 
     @retry(reraise=True, wait=wait_fixed(2), stop=stop_after_attempt(3))
     def upload_local_file(self, local_path, target_bucket, target_key, content_type, checksums, report_progress=False,
-                          sync=True):
+                          sync=True, batch=None):
+        """
+        Upload a local file with its checksums as metadata.
+
+        If checksums is None, they are computed while the file is being uploaded, and set on the uploaded object with
+        an in-place copy afterwards, so the file is only read once. Syncing needs them before the upload starts.
+
+        :return: the checksums
+        """
         if sync:
             if self._item_exists_in_bucket(target_bucket, target_key, checksums):
-                return
+                return checksums
 
-        file_size = os.path.getsize(local_path)
+        stat = os.stat(local_path)
+        file_size = stat.st_size
         bucket = self.target_s3.Bucket(target_bucket)
         obj = bucket.Object(target_key)
+        extra_args = {'ContentType': content_type, 'ACL': 'bucket-owner-full-control'}
+        if checksums is not None:
+            extra_args['Metadata'] = checksums
         upload_fileobj_args = {
-            'ExtraArgs': {'ContentType': content_type, 'ACL': 'bucket-owner-full-control', 'Metadata': checksums},
+            'ExtraArgs': extra_args,
             'Config': self.transfer_config(file_size)
         }
-        if report_progress:
-            upload_fileobj_args['Callback'] = self.upload_progress_callback
+        if report_progress and batch is not None:
+            upload_fileobj_args['Callback'] = batch.upload_progress_callback
         with open(local_path, 'rb') as fh:
-            obj.upload_fileobj(fh, **upload_fileobj_args)
+            if checksums is None:
+                reader = ChecksummingReader(fh, file_size)
+                obj.upload_fileobj(reader, **upload_fileobj_args)
+                checksums = reader.get_checksum_metadata_tag()
+                get_checksum_cache().put(local_path, checksums, stat=stat)
+                self._replace_metadata(target_bucket, target_key, content_type, checksums, file_size)
+            else:
+                obj.upload_fileobj(fh, **upload_fileobj_args)
+        return checksums
+
+    def _replace_metadata(self, bucket, key, content_type, metadata, file_size):
+        copy_args = {
+            'CopySource': {'Bucket': bucket, 'Key': key},
+            'ExtraArgs': {
+                'ContentType': content_type,
+                'MetadataDirective': 'REPLACE',
+                'ACL': 'bucket-owner-full-control',
+                'Metadata': metadata
+            },
+            'Config': self.transfer_config(file_size),
+            'Bucket': bucket,
+            'Key': key
+        }
+        self.target_s3.meta.client.copy(**copy_args)
 
     def list_bucket_by_page(self, bucket_name, key_prefix):
+        for page in self.list_objects_by_page(bucket_name, key_prefix, page_size=100):
+            yield [o['Key'] for o in page]
+
+    def list_objects_by_page(self, bucket_name, key_prefix, page_size=1000):
+        """ Generate pages of the objects under a prefix, as the dicts in the ``Contents`` of a listing. """
         paginator = self.target_s3.meta.client.get_paginator('list_objects')
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=key_prefix, PaginationConfig={'PageSize': 100}):
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=key_prefix, PaginationConfig={'PageSize': page_size}):
             if 'Contents' in page:
-                yield [o['Key'] for o in page['Contents']]
+                yield page['Contents']
 
     @classmethod
     def transfer_config(cls, file_size):
@@ -0,0 +1,227 @@
+import os
+
+from .api_client import UploadApiException
+from .client_side_checksum_handler import ClientSideChecksumHandler
+from .s3_agent import sizeof_fmt
+
+FILES_INFO_BATCH_SIZE = 100
+# The most objects S3 returns in one page of a listing
+LISTING_PAGE_SIZE = 1000
+SYNC_WINDOW = 1000
+
+
+class SyncPlan:
+
+    """
+    The result of comparing local files with the contents of an Upload Area.
+
+    :ivar to_upload: paths of files that are missing from the area, or differ from the file there
+    :ivar to_check: paths of files that are in the area, but whose checksums the Upload Service doesn't have yet, or
+                    that weren't compared with a listing of the area because it is much larger than the number of
+                    local files. They are compared one by one, with the checksums stored on the uploaded file, when
+                    uploaded.
+    :ivar unchanged: paths of files that are already in the area with the same checksums
+    :ivar to_copy: S3 paths of files, which are copied to the area without being compared
+    :ivar collisions: the paths of local files that would be uploaded under the same name as another local file, by
+                      name. They are all in to_upload, unless planned in an earlier window.
+    :ivar sizes: the size of each local file
+    """
+
+    def __init__(self):
+        self.to_upload = []
+        self.to_check = []
+        self.unchanged = []
+        self.to_copy = []
+        self.collisions = {}
+        self.sizes = {}
+
+    def extend(self, plan):
+        """ Add the files of another plan to this one. """
+        self.to_upload += plan.to_upload
+        self.to_check += plan.to_check
+        self.unchanged += plan.unchanged
+        self.to_copy += plan.to_copy
+        for name, file_paths in plan.collisions.items():
+            self.collisions.setdefault(name, []).extend(file_paths)
+        self.sizes.update(plan.sizes)
+
+    def _size_of(self, file_paths):
+        return sum(self.sizes.get(file_path, 0) for file_path in file_paths)
+
+    def report(self, verbose=False):
+        """
+        :param verbose: also list the files to be uploaded, checked or copied
+        :return: a description of the plan
+        """
+        lines = ["{count} files {action} ({size})".format(count=len(file_paths), action=action,
+                                                          size=sizeof_fmt(self._size_of(file_paths)))
+                 for action, file_paths in (("to upload", self.to_upload),
+                                            ("to compare individually", self.to_check),
+                                            ("unchanged", self.unchanged))]
+        if self.to_copy:
+            lines.append("{count} files to copy from S3 without comparing".format(count=len(self.to_copy)))
+        for name, file_paths in sorted(self.collisions.items()):
+            lines.append("{count} files would be uploaded as {name}: {paths}".format(
+                count=len(file_paths), name=name, paths=", ".join(file_paths)))
+        if verbose:
+            lines += ["upload  {}".format(file_path) for file_path in self.to_upload]
+            lines += ["compare {}".format(file_path) for file_path in self.to_check]
+            lines += ["copy    {}".format(file_path) for file_path in self.to_copy]
+        return "\n".join(lines)
+
+
+class SyncPlanner:
+
+    """
+    Works out which local files need to be uploaded to an Upload Area to bring it up to date, without a request per
+    file. The area is listed once, files whose size differs from the uploaded file's are uploaded straight away, and
+    the checksums of the rest are fetched from the Upload Service in batches of ``FILES_INFO_BATCH_SIZE`` and compared
+    with the local files' checksums, which are computed on ``checksum_executor`` if one is given.
+
+    Local files are planned in windows of ``window`` files as they arrive, the first of them smaller, so that the first
+    files can be uploaded while the rest are still being found. The area is listed as the windows are planned, up to
+    one page more than the number of local files planned so far: until the listing is complete, files are left to be
+    compared one by one, so that a few files aren't held up by the listing of a large area.
+    """
+
+    def __init__(self, upload_area, s3agent, checksum_executor=None, window=SYNC_WINDOW):
+        self.area = upload_area
+        self.s3agent = s3agent
+        self.checksum_executor = checksum_executor
+        self.window = window
+        self._pages = None
+        self._pages_listed = 0
+        self._page_budget = 0
+        self._listed = False
+        self._uploaded_sizes = {}
+        # The first path planned with each name, and how many have been
+        self._names = {}
+        self._collided_names = set()
+
+    def plan(self, file_paths, target_filename=None):
+        """
+        :param file_paths: paths of local files, or S3 paths to be copied
+        :param target_filename: the name to upload a single file under, instead of its own
+        :rtype: SyncPlan
+        """
+        plan = SyncPlan()
+        for window_plan in self.iter_plans(((file_path, None) for file_path in file_paths), target_filename):
+            plan.extend(window_plan)
+        return plan
+
+    def iter_plans(self, sized_paths, target_filename=None):
+        """
+        Plan the files in windows, as they arrive.
+
+        :param sized_paths: (path, size) pairs, where the size is None if not known yet
+        :param target_filename: the name to upload a single file under, instead of its own
+        :return: a SyncPlan for each window of files
+        """
+        # The first window only needs a request for checksums, so that the first files are planned straight away
+        window, window_size = [], min(self.window, FILES_INFO_BATCH_SIZE)
+        for file_path, file_size in sized_paths:
+            window.append((file_path, file_size))
+            if len(window) >= window_size:
+                yield self._plan_window(window, target_filename)
+                window, window_size = [], self.window
+        if window:
+            yield self._plan_window(window, target_filename)
+
+    def _plan_window(self, sized_paths, target_filename):
+        plan = SyncPlan()
+        uploaded_sizes = self._list_area(len(sized_paths))
+        named_paths = []
+        for file_path, file_size in sized_paths:
+            if file_path.startswith("s3://"):
+                plan.to_copy.append(file_path)
+                continue
+            if file_size is None:
+                try:
+                    file_size = os.path.getsize(file_path)
+                except OSError:
+                    # Left for the upload to report
+                    plan.to_upload.append(file_path)
+                    continue
+            plan.sizes[file_path] = file_size
+            name = target_filename or os.path.basename(file_path)
+            self._names.setdefault(name, [file_path, 0])[1] += 1
+            named_paths.append((name, file_path))
+        candidates = {}
+        for name, file_path in named_paths:
+            first_path, count = self._names[name]
+            if count > 1:
+                # Which of them ends up in the area depends on the order they finish in, so all are uploaded
+                collisions = plan.collisions.setdefault(name, [])
+                if name not in self._collided_names and first_path not in plan.sizes:
+                    # Planned in an earlier window
+                    collisions.append(first_path)
+                self._collided_names.add(name)
+                collisions.append(file_path)
+                plan.to_upload.append(file_path)
+            elif uploaded_sizes is None:
+                plan.to_check.append(file_path)
+            elif uploaded_sizes.get(name) == plan.sizes[file_path]:
+                candidates[name] = file_path
+            else:
+                plan.to_upload.append(file_path)
+        names = sorted(candidates)
+        local_checksums = self._checksum([candidates[name] for name in names])
+        for start in range(0, len(names), FILES_INFO_BATCH_SIZE):
+            batch = names[start:start + FILES_INFO_BATCH_SIZE]
+            try:
+                files_info = self.area.upload_service.api_client.files_info(self.area.uuid, batch)
+            except UploadApiException:
+                # Without the Upload Service's checksums, each file is compared with the uploaded file instead
+                files_info = []
+            uploaded_checksums = {info['name']: info.get('checksums') or {} for info in files_info}
+            for name in batch:
+                file_path = candidates[name]
+                checksums = local_checksums[file_path]
+                uploaded = uploaded_checksums.get(name, {})
+                if checksums is None:
+                    # Left for the upload to report
+                    plan.to_upload.append(file_path)
+                elif any(uploaded[key] != value for key, value in checksums.items() if key in uploaded):
+                    plan.to_upload.append(file_path)
+                elif all(key in uploaded for key in checksums):
+                    plan.unchanged.append(file_path)
+                else:
+                    plan.to_check.append(file_path)
+        return plan
+
+    def _list_area(self, file_count):
+        """
+        List more of the area, up to a page for each of the ``file_count`` more files to be planned.
+
+        :return: the size of each file in the area by name, or None if the area hasn't been listed in full yet
+        """
+        key_prefix = self.area.uuid + "/"
+        if self._pages is None:
+            self._pages = self.s3agent.list_objects_by_page(bucket_name=self.area.uri.bucket_name,
+                                                            key_prefix=key_prefix, page_size=LISTING_PAGE_SIZE)
+        self._page_budget += file_count
+        # The page after the last one costs nothing, so the listing may take up one page more than the budget
+        while not self._listed and self._pages_listed <= self._page_budget:
+            try:
+                page = next(self._pages)
+            except StopIteration:
+                self._listed = True
+                break
+            self._pages_listed += 1
+            for obj in page:
+                self._uploaded_sizes[obj['Key'][len(key_prefix):]] = obj['Size']
+        return self._uploaded_sizes if self._listed else None
+
+    def _checksum(self, file_paths):
+        def checksum(file_path):
+            try:
+                checksum_handler = ClientSideChecksumHandler(file_path)
+                checksum_handler.compute_checksum()
+                return checksum_handler.get_checksum_metadata_tag()
+            except (IOError, OSError):
+                return None
+
+        if self.checksum_executor is None:
+            return {file_path: checksum(file_path) for file_path in file_paths}
+        futures = [self.checksum_executor.submit(checksum, file_path) for file_path in file_paths]
+        return {file_path: future.result() for file_path, future in zip(file_paths, futures)}
@@ -0,0 +1,92 @@
+import threading
+
+
+class UploadNotifier:
+    """
+    Tells the Upload Service about files placed in an Upload Area.
+
+    Unless ``bulk`` is set, each file passed to ``notify()`` is notified on its own, from the thread that calls it.
+    With ``bulk``, filenames are queued instead, and a background thread sends them in a single request whenever
+    ``batch_size`` of them have queued up, or ``interval`` seconds after the oldest one was queued. If the Upload
+    Service turns out not to support notifications for several files at once, it falls back to notifying each file on
+    its own. If a notification for several files fails, each of them is notified on its own.
+
+    Files whose notification failed are in ``failures``, mapped to the exception, once ``close()`` has returned.
+    """
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_INTERVAL = 1.0
+
+    def __init__(self, api_client, area_uuid, bulk=False, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL):
+        self.api_client = api_client
+        self.area_uuid = area_uuid
+        self.batch_size = batch_size
+        self.interval = interval
+        self.bulk_supported = None if bulk else False
+        self.failures = {}
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def notify(self, filename):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Notifier is closed")
+            if self.bulk_supported is not False:
+                self._pending.append(filename)
+                if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+                return
+        self._notify_one(filename)
+
+    def close(self):
+        """
+        Send the notifications still queued and wait for them to complete.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait_for(lambda: self._pending or self._closed)
+                self._cond.wait_for(lambda: len(self._pending) >= self.batch_size or self._closed, self.interval)
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                if not batch and self._closed:
+                    return
+            self._send(batch)
+
+    def _send(self, batch):
+        if self.bulk_supported is not False:
+            try:
+                supported = self.api_client.files_upload_notification(self.area_uuid, batch)
+            except Exception:
+                # The files are notified one by one instead, so that a failure only affects the file it is about
+                for filename in batch:
+                    self._notify_one(filename)
+                return
+            with self._cond:
+                self.bulk_supported = supported
+                if supported:
+                    return
+                # Leave the rest of the queue to this thread; new notifications are sent by their callers.
+                batch += self._pending
+                self._pending = []
+        for filename in batch:
+            self._notify_one(filename)
+
+    def _notify_one(self, filename):
+        try:
+            self.api_client.file_upload_notification(self.area_uuid, filename)
+        except Exception as e:
+            self.failures[filename] = e
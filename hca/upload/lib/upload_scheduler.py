@@ -0,0 +1,146 @@
+import heapq
+import threading
+import time
+
+SMALL_FILE_SIZE = 1024 * 1024
+MAX_BATCH_FILES = 64
+MAX_BATCH_SIZE = 16 * 1024 * 1024
+DEFAULT_WINDOW = 10000
+# The first window is small, so that uploading starts while the rest of the files are still being found
+DEFAULT_FIRST_WINDOW = 100
+# Seconds a window waits for more files before it is scheduled anyway, for when the files are found slowly
+DEFAULT_MAX_WINDOW_WAIT = 1.0
+
+
+class UploadJob:
+
+    """
+    One or more files to be uploaded one after another by the same worker.
+    """
+
+    def __init__(self):
+        self.file_paths = []
+        self.file_sizes = []
+        self.size = 0
+        self.remaining = 0
+
+    def add(self, file_path, file_size):
+        self.file_paths.append(file_path)
+        self.file_sizes.append(file_size)
+        self.size += file_size
+        self.remaining += file_size
+
+
+def estimate_makespan(job_sizes, workers, largest_file=0):
+    """
+    Estimate how many bytes the busiest of ``workers`` workers has left to transfer, if the jobs are started largest
+    first, each on the worker with the least left to do. The files of a job are transferred in turn, so this is at least
+    the size of the largest file, however many workers are idle.
+    """
+    loads = [0] * max(workers, 1)
+    for job_size in sorted(job_sizes, reverse=True):
+        heapq.heapreplace(loads, loads[0] + job_size)
+    return max(max(loads), largest_file)
+
+
+class UploadScheduler:
+
+    """
+    Orders files for upload so that a batch finishes as soon as possible.
+
+    Files are collected into windows of ``window`` files. Within a window, files of at least ``small_file_size`` bytes
+    each make a job of their own, and smaller files are grouped into jobs of up to ``max_batch_files`` files and
+    ``max_batch_size`` bytes, so that the per-file overheads of handing work to a pool are paid once per group. The
+    jobs are released largest first, so that the largest files are not left running on their own at the end of the
+    upload while the other workers are idle.
+
+    So that the first uploads start straight away, the first window is only ``first_window`` files, and a window that
+    has waited ``max_window_wait`` seconds since its first file is released with the files it has at the next add.
+
+    Files are only ordered within a window, so a large file in a later window still starts after the files of the
+    earlier ones, and an upload of more files than fit in a window may end with large files running on their own.
+    Pass ``window=None`` when all the files are known in advance, to schedule them all together.
+
+    The scheduler keeps track of the jobs it has released until each of their files is reported finished with
+    :meth:`file_finished`, so that :meth:`remaining_work` can tell what is still queued or running.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, small_file_size=SMALL_FILE_SIZE, max_batch_files=MAX_BATCH_FILES,
+                 max_batch_size=MAX_BATCH_SIZE, first_window=DEFAULT_FIRST_WINDOW,
+                 max_window_wait=DEFAULT_MAX_WINDOW_WAIT):
+        self.window = window
+        self.small_file_size = small_file_size
+        self.max_batch_files = max_batch_files
+        self.max_batch_size = max_batch_size
+        self.first_window = first_window
+        self.max_window_wait = max_window_wait
+        self._pending = []
+        self._flushed = False
+        self._window_started_at = None
+        self._outstanding = {}
+        self._lock = threading.Lock()
+
+    def add(self, file_path, file_size):
+        """
+        Add a file to be scheduled.
+
+        :return: a list of the UploadJobs that are ready to be started, largest first
+        """
+        with self._lock:
+            if not self._pending:
+                self._window_started_at = time.time()
+            self._pending.append((file_size, file_path))
+        if self.window is None:
+            return []
+        window = self.window if self._flushed else min(self.window, self.first_window or self.window)
+        if len(self._pending) >= window or (self.max_window_wait is not None and
+                                            time.time() - self._window_started_at >= self.max_window_wait):
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        :return: a list of UploadJobs for all the files not yet scheduled, largest first
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flushed = True
+        pending.sort(key=lambda sized_path: sized_path[0], reverse=True)
+        jobs = []
+        batch = None
+        for file_size, file_path in pending:
+            if file_size >= self.small_file_size:
+                job = UploadJob()
+                job.add(file_path, file_size)
+                jobs.append(job)
+                continue
+            if batch is None or (len(batch.file_paths) >= self.max_batch_files or
+                                 batch.size + file_size > self.max_batch_size):
+                batch = UploadJob()
+                jobs.append(batch)
+            batch.add(file_path, file_size)
+        jobs.sort(key=lambda job: job.size, reverse=True)
+        with self._lock:
+            for job in jobs:
+                for file_path, file_size in zip(job.file_paths, job.file_sizes):
+                    self._outstanding[file_path] = (file_size, job)
+        return jobs
+
+    def file_finished(self, file_path):
+        """ Note that a file released in a job has been uploaded, or has failed. Other files are ignored. """
+        with self._lock:
+            file_size, job = self._outstanding.pop(file_path, (0, None))
+            if job is not None:
+                job.remaining -= file_size
+
+    def remaining_work(self):
+        """
+        :return: the sizes of the jobs queued or running, counting only their unfinished files, and of the files not
+                 yet released, each as a job of its own, together with the size of the largest of those files
+        """
+        with self._lock:
+            jobs = {id(job): job for _, job in self._outstanding.values()}
+            job_sizes = [job.remaining for job in jobs.values()] + [file_size for file_size, _ in self._pending]
+            largest_file = max([file_size for file_size, _ in self._outstanding.values()] +
+                               [file_size for file_size, _ in self._pending] + [0])
+        return job_sizes, largest_file
@@ -1,15 +1,24 @@
+import concurrent.futures
 import mimetypes
+import multiprocessing
 import os
+import threading
+import warnings
 
-from dcplib.media_types import DcpMediaType
-
-from hca.util.pool import ThreadPool
-from .lib.client_side_checksum_handler import ClientSideChecksumHandler
-from .lib.credentials_manager import CredentialsManager
+from .._lazy import lazy_import
 from .exceptions import UploadException
-from .lib.s3_agent import S3Agent
 from .upload_area_uri import UploadAreaURI
 
+media_types = lazy_import("dcplib.media_types")
+thread_pool = lazy_import("hca.util.pool")
+client_side_checksum_handler = lazy_import("hca.upload.lib.client_side_checksum_handler")
+credentials_manager = lazy_import("hca.upload.lib.credentials_manager")
+s3_agent = lazy_import("hca.upload.lib.s3_agent")
+upload_notifier = lazy_import("hca.upload.lib.upload_notifier")
+upload_scheduler = lazy_import("hca.upload.lib.upload_scheduler")
+sync_planner = lazy_import("hca.upload.lib.sync_planner")
+fs_walk = lazy_import("hca.util.fs_walk")
+
 
 class UploadArea:
 
@@ -23,7 +32,10 @@ class UploadArea:
             raise UploadException("You must provide an UploadAreaURI")
         self.uri = uri
         self.upload_service = upload_service
-        self.s3_agent = None
+        self._credentials_provider = None
+        self._s3_agents = {}
+        self._s3_agents_lock = threading.Lock()
+        self._latest_upload = None
 
     def __str__(self):
         return "UploadArea {uri}".format(uri=self.uri)
@@ -36,6 +48,21 @@ class UploadArea:
     def uuid(self):
         return self.uri.area_uuid
 
+    @property
+    def s3agent(self):
+        """
+        Deprecated: use the UploadBatch returned by upload_files instead.
+
+        A read-only view of the S3Agent used by the latest call to upload_files, with the progress and failures of that
+        call, such as ``file_upload_completed_count`` and ``failed_uploads``. None before any files are uploaded.
+        """
+        warnings.warn("UploadArea.s3agent is deprecated, use the UploadBatch returned by upload_files instead",
+                      DeprecationWarning, stacklevel=2)
+        if self._latest_upload is None:
+            return None
+        use_transfer_acceleration, batch = self._latest_upload
+        return s3_agent.UploadBatchView(self._get_s3_agent(use_transfer_acceleration), batch)
+
     def delete(self):
         """
         Request deletion of this Upload Area by the Upload Service.
@@ -60,8 +87,7 @@ class UploadArea:
         :return: a dict containing AWS credentials in a format suitable for passing to Boto3
             or if capitalized, used as environment variables
         """
-        creds_mgr = CredentialsManager(self)
-        creds = creds_mgr.get_credentials_from_upload_api()
+        creds = self._get_credentials_provider().get_credentials_from_upload_api()
         return {
             'aws_access_key_id': creds['access_key'],
             'aws_secret_access_key': creds['secret_key'],
@@ -75,8 +101,7 @@ class UploadArea:
         :param detail: return detailed file information (slower)
         :return: a list of dicts containing at least 'name', or more of detail was requested
         """
-        creds_provider = CredentialsManager(upload_area=self)
-        s3agent = S3Agent(credentials_provider=creds_provider)
+        s3agent = self._get_s3_agent()
         key_prefix = self.uuid + "/"
         key_prefix_length = len(key_prefix)
         for page in s3agent.list_bucket_by_page(bucket_name=self.uri.bucket_name, key_prefix=key_prefix):
@@ -107,34 +132,141 @@ class UploadArea:
                                                          content_type=content_type)
 
     def upload_files(self, file_paths, file_size_sum=0, dcp_type="data", target_filename=None,
-                     use_transfer_acceleration=True, report_progress=False, sync=True):
+                     use_transfer_acceleration=True, report_progress=False, sync=True, single_pass=False):
         """
         A function that takes in a list of file paths and other optional args for parallel file upload
+
+        Local files are checksummed and uploaded on thread pools shared by all uploads, in the order chosen by an
+        :class:`hca.upload.lib.upload_scheduler.UploadScheduler`. With sync, they are first compared with the Upload
+        Area by a :class:`hca.upload.lib.sync_planner.SyncPlanner`; see those classes for the details.
+
+        :param file_paths: a list of local or S3 paths, or an iterator of them, such as a
+                           :class:`hca.util.fs_walk.FileWalk`, in which case uploads start as the first paths arrive
+        :param file_size_sum: the combined size of the files, for reporting progress; ignored unless file_paths is a
+                              list and sync is off
+        :param target_filename: the name to upload a single file under, instead of its own
+        :param report_progress: print the progress of the upload
+        :param sync: don't upload files that are already in the Upload Area; they still count as completed and are
+                     notified to the Upload Service
+        :param single_pass: checksum local files while uploading them, so that each is read only once; ignored with
+                            sync
+        :return: the progress and failures of this upload
+        :rtype: hca.upload.lib.s3_agent.UploadBatch
+        :raises UploadException: if any file failed to upload
         """
-        self._setup_s3_agent_for_file_upload(file_count=len(file_paths),
-                                             file_size_sum=file_size_sum,
-                                             use_transfer_acceleration=use_transfer_acceleration)
-        pool = ThreadPool()
+        single_pass = single_pass and not sync
+        streaming = not isinstance(file_paths, (list, tuple))
+        sized_by_walk = isinstance(file_paths, fs_walk.FileWalk)
+        if sized_by_walk:
+            sized_paths = file_paths.with_sizes()
+        else:
+            sized_paths = ((file_path, None) for file_path in file_paths)
+        # Unless they are known in advance, the totals are counted as the files are submitted
+        counted_on_submit = sync or (streaming and not sized_by_walk)
+        known_in_advance = not (streaming or sync)
+        checksum_executor = thread_pool.shared_executor("upload-checksum", max_workers=multiprocessing.cpu_count())
+        transfer_executor = thread_pool.shared_executor("upload-transfer")
+        scheduler = upload_scheduler.UploadScheduler(
+            window=None if known_in_advance else upload_scheduler.DEFAULT_WINDOW)
+        batch = s3_agent.UploadBatch(file_count=len(file_paths) if known_in_advance else 0,
+                                     file_size_sum=file_size_sum if known_in_advance else 0,
+                                     scheduler=scheduler, workers=transfer_executor.max_workers)
+        if sized_by_walk and not sync:
+            file_paths.on_sized = batch.add_to_upload_totals
+        self._latest_upload = (use_transfer_acceleration, batch)
+        notifier = upload_notifier.UploadNotifier(self.upload_service.api_client, self.uuid,
+                                                  bulk=self.upload_service.config().bulk_notifications)
+        submitted_paths = []
+        plan, sync_paths = None, None
+        if sync:
+            plan, sync_paths = sync_planner.SyncPlan(), set()
+
+            def skip_unchanged(file_path):
+                # Files found unchanged count as uploaded, and are notified, as if they had been compared one by one
+                submitted_paths.append(file_path)
+                batch.add_to_upload_totals(1, 0)
+                batch.file_completed()
+                notifier.notify(target_filename or os.path.basename(file_path))
+
+            sized_paths = self._iter_files_to_sync(sized_paths, plan, sync_paths, target_filename,
+                                                   use_transfer_acceleration, skip_unchanged)
+        upload_args = dict(target_filename=target_filename,
+                           use_transfer_acceleration=use_transfer_acceleration,
+                           report_progress=report_progress,
+                           sync=sync,
+                           sync_paths=sync_paths,
+                           notifier=notifier,
+                           single_pass=single_pass,
+                           batch=batch)
+        checksum_futures, transfer_futures = [], []
+        cancelled = threading.Event()
         if report_progress:
-            print("\nStarting upload of %s files to upload area %s" % (len(file_paths), self.uuid))
-        for file_path in file_paths:
-            pool.add_task(self._upload_file, file_path,
-                          target_filename=target_filename,
-                          use_transfer_acceleration=use_transfer_acceleration,
-                          report_progress=report_progress,
-                          sync=sync)
-        pool.wait_for_completion()
-        number_of_errors = len(self.s3agent.failed_uploads)
+            if not known_in_advance:
+                print("\nStarting upload to upload area %s" % self.uuid)
+            else:
+                print("\nStarting upload of %s files to upload area %s" % (len(file_paths), self.uuid))
+
+        def submit_jobs(jobs):
+            for job in jobs:
+                if single_pass:
+                    transfer_futures.append((transfer_executor.submit(
+                        self._upload_files_in_turn, [(file_path, None) for file_path in job.file_paths], cancelled,
+                        upload_args), job.file_paths))
+                else:
+                    checksum_futures.append((checksum_executor.submit(self._checksum_files, job.file_paths,
+                                                                      transfer_executor, transfer_futures, cancelled,
+                                                                      upload_args), job.file_paths))
+
+        try:
+            for file_path, file_size in sized_paths:
+                submitted_paths.append(file_path)
+                if counted_on_submit:
+                    batch.add_to_upload_totals(1, 0)
+                if file_path.startswith("s3://"):
+                    transfer_futures.append((transfer_executor.submit(self._upload_file, file_path,
+                                                                      count_size=counted_on_submit, **upload_args),
+                                             [file_path]))
+                    continue
+                if file_size is None:
+                    try:
+                        file_size = os.path.getsize(file_path)
+                    except OSError as e:
+                        self._record_failure(batch, file_path, e)
+                        continue
+                if counted_on_submit:
+                    batch.add_to_upload_totals(0, file_size)
+                submit_jobs(scheduler.add(file_path, file_size))
+            submit_jobs(scheduler.flush())
+            # Every transfer is submitted by the time its checksums are done
+            self._wait_for_jobs(batch, checksum_futures)
+            self._wait_for_jobs(batch, transfer_futures)
+        except BaseException:
+            # Whatever stopped the producer, the transfers already running finish and are notified before it is closed
+            self._abandon_jobs(cancelled, checksum_futures, transfer_futures)
+            raise
+        finally:
+            notifier.close()
+        if report_progress and plan is not None:
+            print("\n" + plan.report())
+        file_paths_by_name = {target_filename or os.path.basename(file_path): file_path
+                              for file_path in submitted_paths}
+        for filename, e in notifier.failures.items():
+            file_path = file_paths_by_name.get(filename, filename)
+            print("\nWhile notifying upload of {file} encountered exception {klass}{args}: {e}".format(
+                file=file_path, klass=type(e), args=e.args, e=str(e)))
+            batch.failed_uploads[file_path] = e
+        number_of_errors = len(batch.failed_uploads)
         if report_progress and number_of_errors == 0:
             print(
                 "Completed upload of %d files to upload area %s\n" %
-                (self.s3agent.file_upload_completed_count, self.uuid))
+                (batch.file_upload_completed_count, self.uuid))
         elif number_of_errors > 0:
             error = "\nThe following files failed:"
-            for k, v in self.s3agent.failed_uploads.items():
+            for k, v in batch.failed_uploads.items():
                 error += "\n%s: [Exception] %s" % (k, v)
             error += "\nPlease retry or contact an hca administrator at data-help@humancellatlas.org for help.\n"
             raise UploadException(error)
+        return batch
 
     def validate_files(self, file_list, validator_image, original_validation_id="", environment={}):
         """
@@ -198,10 +330,53 @@ class UploadArea:
         """
         return self.upload_service.api_client.validation_statuses(area_uuid=self.uuid)
 
-    def _setup_s3_agent_for_file_upload(self, file_count=0, file_size_sum=0, use_transfer_acceleration=True):
-        creds_provider = CredentialsManager(upload_area=self)
-        self.s3agent = S3Agent(credentials_provider=creds_provider, transfer_acceleration=use_transfer_acceleration)
-        self.s3agent.set_s3_agent_variables_for_batch_file_upload(file_count=file_count, file_size_sum=file_size_sum)
+    def plan_sync(self, file_paths, target_filename=None, use_transfer_acceleration=True):
+        """
+        Work out which local files need to be uploaded to bring this Upload Area up to date, listing the area once and
+        fetching the checksums of the files in it in batches, rather than checking each file separately.
+
+        :param file_paths: paths of local files, or S3 paths, which are always copied
+        :param target_filename: the name to upload a single file under, instead of its own
+        :rtype: hca.upload.lib.sync_planner.SyncPlan
+        """
+        checksum_executor = thread_pool.shared_executor("upload-checksum", max_workers=multiprocessing.cpu_count())
+        planner = sync_planner.SyncPlanner(self, self._get_s3_agent(use_transfer_acceleration), checksum_executor)
+        return planner.plan(file_paths, target_filename=target_filename)
+
+    def _iter_files_to_sync(self, sized_paths, plan, sync_paths, target_filename, use_transfer_acceleration,
+                            skip_unchanged):
+        """
+        Plan the files in windows as they arrive, adding each window to ``plan`` and the files in it to be compared
+        individually to ``sync_paths``, calling ``skip_unchanged`` with each file found unchanged, and generate the
+        (path, size) of each file in it to be uploaded.
+        """
+        checksum_executor = thread_pool.shared_executor("upload-checksum", max_workers=multiprocessing.cpu_count())
+        planner = sync_planner.SyncPlanner(self, self._get_s3_agent(use_transfer_acceleration), checksum_executor)
+        for window_plan in planner.iter_plans(sized_paths, target_filename=target_filename):
+            plan.extend(window_plan)
+            sync_paths.update(window_plan.to_check)
+            for file_path in window_plan.unchanged:
+                skip_unchanged(file_path)
+            for file_path in window_plan.to_upload + window_plan.to_check + window_plan.to_copy:
+                yield file_path, window_plan.sizes.get(file_path)
+
+    def _get_credentials_provider(self):
+        with self._s3_agents_lock:
+            if self._credentials_provider is None:
+                self._credentials_provider = credentials_manager.CredentialsManager(upload_area=self)
+            return self._credentials_provider
+
+    def _get_s3_agent(self, use_transfer_acceleration=True):
+        """
+        Return this Upload Area's S3Agent, creating it on first use, so that its clients, connection pools and
+        credentials are reused by every listing and upload.
+        """
+        credentials_provider = self._get_credentials_provider()
+        with self._s3_agents_lock:
+            if use_transfer_acceleration not in self._s3_agents:
+                self._s3_agents[use_transfer_acceleration] = s3_agent.S3Agent(
+                    credentials_provider=credentials_provider, transfer_acceleration=use_transfer_acceleration)
+            return self._s3_agents[use_transfer_acceleration]
 
     def _determine_s3_file_content_type(self, file_path, dcp_type="data"):
         mime_type_tuple = mimetypes.guess_type(file_path)
@@ -214,29 +389,90 @@ class UploadArea:
         content_type = "{0}; dcp-type={1}".format(mime_type, dcp_type)
         return content_type
 
+    def _checksum_files(self, file_paths, transfer_executor, transfer_futures, cancelled, upload_args):
+        checksummed = []
+        for file_path in file_paths:
+            if cancelled.is_set():
+                return
+            try:
+                checksum_handler = client_side_checksum_handler.ClientSideChecksumHandler(file_path)
+                checksum_handler.compute_checksum()
+                checksummed.append((file_path, checksum_handler.get_checksum_metadata_tag()))
+            except Exception as e:
+                self._record_failure(upload_args['batch'], file_path, e)
+        if not checksummed:
+            return
+        future = transfer_executor.submit(self._upload_files_in_turn, checksummed, cancelled, upload_args)
+        transfer_futures.append((future, [file_path for file_path, _ in checksummed]))
+        if cancelled.is_set():
+            future.cancel()
+
+    def _upload_files_in_turn(self, checksummed_paths, cancelled, upload_args):
+        for file_path, checksums in checksummed_paths:
+            if cancelled.is_set():
+                return
+            self._upload_file(file_path, checksums=checksums, **upload_args)
+
+    def _wait_for_jobs(self, batch, jobs):
+        """
+        Wait for the given (future, file paths) pairs, and record an exception raised by a job as a failure of each of
+        its files that hasn't failed already.
+        """
+        concurrent.futures.wait([future for future, _ in jobs])
+        for future, file_paths in jobs:
+            if future.cancelled() or future.exception() is None:
+                continue
+            for file_path in file_paths:
+                if file_path not in batch.failed_uploads:
+                    self._record_failure(batch, file_path, future.exception())
+
+    def _abandon_jobs(self, cancelled, checksum_futures, transfer_futures):
+        """ Cancel the jobs that haven't started, and wait for the rest to finish. """
+        cancelled.set()
+        thread_pool.cancel_futures([future for future, _ in checksum_futures + transfer_futures])
+        # Checksum jobs still running may submit one more transfer, which they cancel themselves
+        concurrent.futures.wait([future for future, _ in checksum_futures])
+        thread_pool.cancel_futures([future for future, _ in transfer_futures])
+        concurrent.futures.wait([future for future, _ in transfer_futures])
+
+    def _record_failure(self, batch, file_path, e):
+        print("\nWhile uploading {file} encountered exception {klass}{args}: {e}".format(
+            file=file_path, klass=type(e), args=e.args, e=str(e)))
+        batch.file_failed(file_path, e)
+
     def _upload_file(self, file_path=None, dcp_type="data", target_filename=None, use_transfer_acceleration=True,
-                     report_progress=False, sync=True):
+                     report_progress=False, sync=True, *, batch=None, notifier=None, checksums=None, single_pass=False,
+                     count_size=False, sync_paths=None):
+        if batch is None:
+            # Uploaded on its own, rather than as part of upload_files()
+            batch = s3_agent.UploadBatch(file_count=1)
+            self._latest_upload = (use_transfer_acceleration, batch)
+        if sync_paths is not None:
+            sync = file_path in sync_paths
+        s3agent = self._get_s3_agent(use_transfer_acceleration)
         try:
             target_bucket = self.uri.bucket_name
             if file_path.startswith("s3://"):
                 file_name = file_path.split('/')[-1]
                 target_key = "%s/%s" % (self.uuid, target_filename or file_name)
                 content_type = self._determine_s3_file_content_type(file_path, dcp_type)
-                self.s3agent.copy_s3_file(file_path, target_bucket, target_key, content_type,
-                                          report_progress=report_progress)
+                s3agent.copy_s3_file(file_path, target_bucket, target_key, content_type,
+                                     report_progress=report_progress, count_size=count_size, batch=batch)
             else:
                 target_key = "%s/%s" % (self.uuid, target_filename or os.path.basename(file_path))
-                content_type = str(DcpMediaType.from_file(file_path, dcp_type))
-                checksum_handler = ClientSideChecksumHandler(file_path)
-                checksum_handler.compute_checksum()
-                checksums = checksum_handler.get_checksum_metadata_tag()
-                self.s3agent.upload_local_file(file_path, target_bucket, target_key, content_type, checksums,
-                                               report_progress=report_progress, sync=sync)
-            self.s3agent.file_upload_completed_count += 1
-            self.upload_service.api_client.file_upload_notification(self.uuid,
-                                                                    target_filename or os.path.basename(file_path))
+                content_type = str(media_types.DcpMediaType.from_file(file_path, dcp_type))
+                if checksums is None and not single_pass:
+                    checksum_handler = client_side_checksum_handler.ClientSideChecksumHandler(file_path)
+                    checksum_handler.compute_checksum()
+                    checksums = checksum_handler.get_checksum_metadata_tag()
+                s3agent.upload_local_file(file_path, target_bucket, target_key, content_type, checksums,
+                                          report_progress=report_progress, sync=sync, batch=batch)
+            batch.file_completed(file_path)
+            filename = target_filename or os.path.basename(file_path)
+            if notifier is None:
+                self.upload_service.api_client.file_upload_notification(self.uuid, filename)
+            else:
+                notifier.notify(filename)
             print("Upload complete of %s to upload area %s" % (file_path, self.uri))
         except Exception as e:
-            print("\nWhile uploading {file} encountered exception {klass}{args}: {e}".format(
-                file=file_path, klass=type(e), args=e.args, e=str(e)))
-            self.s3agent.failed_uploads[file_path] = e
+            self._record_failure(batch, file_path, e)
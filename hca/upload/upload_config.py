@@ -13,6 +13,7 @@ class UploadConfig:
     DEFAULT_BUCKET_NAME_TEMPLATE = "org-humancellatlas-upload-{deployment_stage}"
     DEFAULT_PREPROD_API_URL_TEMPLATE = "https://upload.{deployment_stage}.data.humancellatlas.org/v1"
     DEFAULT_PRODUCTION_API_URL = "https://upload.data.humancellatlas.org/v1"
+    DEFAULT_BULK_NOTIFICATIONS = False
 
     def __init__(self):
         self._load_config()
@@ -34,6 +35,8 @@ class UploadConfig:
             self._config.upload.production_api_url = self.DEFAULT_PRODUCTION_API_URL
         if 'preprod_api_url_template' not in self._config.upload:
             self._config.upload.preprod_api_url_template = self.DEFAULT_PREPROD_API_URL_TEMPLATE
+        if 'bulk_notifications' not in self._config.upload:
+            self._config.upload.bulk_notifications = self.DEFAULT_BULK_NOTIFICATIONS
         self.save()
 
     @property
@@ -82,6 +85,16 @@ class UploadConfig:
         """
         return self._config.upload.production_api_url
 
+    @property
+    def bulk_notifications(self):
+        """
+        Whether the Upload Service is told about uploaded files several at a time, rather than one by one.
+        Only switch this on for Upload Service deployments that accept such notifications.
+        :return: True if notifications for several files at once are to be sent
+        :rtype: bool
+        """
+        return self._config.upload.bulk_notifications
+
     def area_uri(self, area_uuid):
         """
         Return the URI for an Upload Area
@@ -1,3 +1,5 @@
+import threading
+
 from . import UploadAreaURI, UploadArea, UploadConfig
 from .lib.api_client import ApiClient
 
@@ -17,6 +19,8 @@ class UploadService:
         self.api_token = api_token
         self.api_client = ApiClient(deployment_stage=self.deployment_stage,
                                     authentication_token=self.api_token)
+        self._areas = {}
+        self._areas_lock = threading.Lock()
 
     @staticmethod
     def config():
@@ -40,8 +44,12 @@ class UploadService:
     def upload_area(self, area_uri):
         """
         Initialize an UploadArea object.  Note this does not create an Upload Area.
+        The same object is returned for the same URI, so that its S3 connections and credentials are reused.
         :param UploadAreaURI area_uri: URI of Upload Area
         :return: Upload Area object
         :rtype: UploadArea
         """
-        return UploadArea(uri=area_uri, upload_service=self)
+        with self._areas_lock:
+            if str(area_uri) not in self._areas:
+                self._areas[str(area_uri)] = UploadArea(uri=area_uri, upload_service=self)
+            return self._areas[str(area_uri)]
@@ -28,6 +28,13 @@ and saved into the user config directory (for example,
 encoding of ``swagger_url``. On subsequent uses, this file will be
 loaded instead to get the Swagger API definition.
 
+Resolving the API definition into client methods is comparatively
+expensive, so the result (the resolved definition, method tables,
+signatures and docstrings) is compiled once and pickled next to the
+cached definition, keyed by a hash of the definition and the client
+class. Later instantiations load the compiled form directly and skip
+JSON parsing and reference resolution.
+
 The Swagger API definition is then used to dynamically construct and
 attach API client methods as class methods, decorate them with API
 metadata such as docstrings and I/O signatures. Method names are
@@ -60,6 +67,20 @@ can be paged like this:
   for result in APIClient().get_foo_bar.iterate():
       ...
 
+To overlap the latency of fetching a page with consuming the previous
+one, pass ``read_ahead``, the number of pages to fetch in a background
+thread ahead of the caller (``--read-ahead`` when auto-paging in the
+CLI):
+
+  for result in APIClient().get_foo_bar.iterate(read_ahead=2):
+      ...
+
+Each client method also has a coroutine counterpart under ``aio``, for
+issuing many concurrent requests from one asyncio event loop (this
+requires aiohttp; see ``hca.util.aio``):
+
+  results = await APIClient().aio.get_foo_bar(qs_param="x")
+
 Routes that require authentication trigger the use of the auth
 middleware provided by requests_oauthlib (work in progress).
 
@@ -89,14 +110,17 @@ import json
 import errno
 import base64
 import argparse
+import glob
+import hashlib
+import pickle
+import queue
+import sys
+import threading
 import time
-import jwt
 import requests
-import jmespath
 
 from inspect import signature, Parameter
 from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
-from requests_oauthlib import OAuth2Session
 from urllib3.util import retry, timeout
 from urllib.parse import urljoin
 from jsonpointer import resolve_pointer
@@ -105,10 +129,15 @@ from argparse import RawTextHelpFormatter
 from dcplib.networking import Session
 
 from .. import get_config, logger
+from .._lazy import lazy_import
 from .exceptions import SwaggerAPIException, SwaggerClientInternalError
 from ._docs import _pagination_docstring, _streaming_docstring, _md2rst, _parse_docstring
 from .fs_helper import FSHelper as fs
 
+jwt = lazy_import("jwt")
+jmespath = lazy_import("jmespath")
+requests_oauthlib = lazy_import("requests_oauthlib")
+
 """Based on https://askubuntu.com/questions/668538/cores-vs-threads-how-many-threads-should-i-run-on-this-machine
         and https://github.com/bloomreach/s4cmd/blob/master/s4cmd.py#L121."""
 DEFAULT_THREAD_COUNT = multiprocessing.cpu_count() * 2
@@ -123,7 +152,10 @@ class _ClientMethodFactory(object):
         self.__dict__.update(locals())
         self._context_manager_response = None
 
-    def _request(self, req_args, url=None, stream=False, headers=None):
+    def _prepare_request(self, req_args, url=None, headers=None):
+        """
+        Sort the arguments of a call into the URL, query parameters, JSON body and headers of its request.
+        """
         supplied_path_params = [p for p in req_args if p in self.path_parameters and req_args[p] is not None]
         if url is None:
             url = self.client.host + self.client.http_paths[self.method_name][frozenset(supplied_path_params)]
@@ -132,14 +164,17 @@ class _ClientMethodFactory(object):
         query = {k: v for k, v in req_args.items()
                  if self.parameters.get(k, {}).get("in") == "query" and v is not None}
         body = {k: v for k, v in req_args.items() if k in self.body_props and v is not None}
+        json_input = body if self.body_props else None
+        headers = headers or {}
+        headers.update({k: v for k, v in req_args.items() if self.parameters.get(k, {}).get('in') == 'header'})
+        return url, query, json_input, headers
+
+    def _request(self, req_args, url=None, stream=False, headers=None):
+        url, query, json_input, headers = self._prepare_request(req_args, url=url, headers=headers)
         if "security" in self.method_data:
             session = self.client.get_authenticated_session()
         else:
             session = self.client.get_session()
-
-        json_input = body if self.body_props else None
-        headers = headers or {}
-        headers.update({k: v for k, v in req_args.items() if self.parameters.get(k, {}).get('in') == 'header'})
         res = session.request(self.http_method, url, params=query, json=json_input, stream=stream,
                               headers=headers, timeout=self.client.timeout_policy)
         if res.status_code >= 400:
@@ -173,8 +208,54 @@ class _ClientMethodFactory(object):
         self._context_manager_response = None
 
 
+def _read_ahead(iterator, depth):
+    """
+    Iterate over ``iterator`` in a background thread that keeps up to ``depth`` items ready ahead of the consumer.
+    Exceptions raised by ``iterator`` are raised to the consumer in order. The background thread stops once it has
+    produced one more item after the consumer stops iterating.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put((item, None))
+                if stop.is_set():
+                    return
+            items.put((end, None))
+        except BaseException as e:
+            items.put((end, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting for room in the queue
+        while True:
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                break
+
+
 class _PaginatingClientMethodFactory(_ClientMethodFactory):
-    def _get_raw_pages(self, **kwargs):
+    def _get_raw_pages(self, read_ahead=0, **kwargs):
+        """
+        :param int read_ahead: if greater than zero, fetch up to this many pages ahead of the caller in the background
+        """
+        pages = self._fetch_pages(**kwargs)
+        return _read_ahead(pages, read_ahead) if read_ahead > 0 else pages
+
+    def _fetch_pages(self, **kwargs):
         page = None
         while page is None or page.links.get("next", {}).get("url"):
             page = self._request(kwargs, url=page.links["next"]["url"] if page else None)
@@ -186,25 +267,49 @@ class _PaginatingClientMethodFactory(_ClientMethodFactory):
 
         For example, GET /bundles/{id} and GET /collections/{id} yield the
         items contained within; POST /search yields search result items.
+
+        Pass ``read_ahead=N`` to have up to N further pages fetched in the
+        background while the items of the current one are being consumed.
         """
         for page in self._get_raw_pages(**kwargs):
-            content_key = page.headers.get("X-OpenAPI-Paginated-Content-Key", "results")
-            results = page.json()
-            for key in content_key.split("."):
-                results = results[key]
-            for result in results:
+            for result in self._get_page_items(page):
                 yield result
 
+    @staticmethod
+    def _get_page_items(page):
+        content_key = page.headers.get("X-OpenAPI-Paginated-Content-Key", "results")
+        results = page.json()
+        for key in content_key.split("."):
+            results = results[key]
+        return results
+
     def paginate(self, **kwargs):
-        """Yield paginated responses one response body at a time."""
+        """
+        Yield paginated responses one response body at a time.
+
+        Pass ``read_ahead=N`` to have up to N further pages fetched in the background.
+        """
         for page in self._get_raw_pages(**kwargs):
             yield page.json()
 
     def _cli_call(self, cli_args):
+        if cli_args.json_lines:
+            return self._print_json_lines(**vars(cli_args))
         if cli_args.paginate is not True:
             return super()._cli_call(cli_args)
         return self._auto_page(**vars(cli_args))
 
+    def _print_json_lines(self, paginate=True, **kwargs):
+        """
+        Print each result on a line of its own as soon as the page containing it arrives, instead of collecting all
+        pages into one response first.
+        """
+        pages = self._get_raw_pages(**kwargs) if paginate else [self._request(kwargs)]
+        for page in pages:
+            for result in self._get_page_items(page):
+                sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
     def _auto_page(self, **kwargs):
         '''This method allows for autopaging in commands and bindings'''
         response_data = None
@@ -232,6 +337,8 @@ class SwaggerClient(object):
     _authenticated_session = None
     _session = None
     _spec_valid_for_days = 7
+    # Bump this whenever the structure of the compiled API definition changes to invalidate existing caches.
+    _compiled_spec_version = 2
     _swagger_spec_lock = Lock()
     _type_map = {
         "string": str,
@@ -255,21 +362,16 @@ class SwaggerClient(object):
         self._session_kwargs = session_kwargs
         self._swagger_spec = None
 
-        self.__class__.__doc__ = _md2rst(self.swagger_spec["info"]["description"])
         self.methods = {}
+        self._method_tables = {}
+        self._aio = None
         self.commands = [self.login, self.logout]
-        self.http_paths = collections.defaultdict(dict)
-        if "openapi" in self.swagger_spec:
-            server = self.swagger_spec["servers"][0]
-            variables = {k: v["default"] for k, v in server.get("variables", {}).items()}
-            self.host = server["url"].format(**variables)
-        else:
-            self.host = "{scheme}://{host}{base}".format(scheme=self.scheme,
-                                                         host=self.swagger_spec["host"],
-                                                         base=self.swagger_spec["basePath"])
-        for http_path, path_data in self.swagger_spec["paths"].items():
-            for http_method, method_data in path_data.items():
-                self._build_client_method(http_method, http_path, method_data)
+        compiled_spec = self._get_compiled_spec()
+        self.__class__.__doc__ = compiled_spec["description"]
+        self.host = compiled_spec["host"]
+        self.http_paths = collections.defaultdict(dict, compiled_spec["http_paths"])
+        for method_table in compiled_spec["methods"]:
+            self._attach_client_method(method_table)
 
     @staticmethod
     def load_swagger_json(swagger_json, ptr_str="$ref"):
@@ -294,38 +396,108 @@ class SwaggerClient(object):
     def swagger_spec(self):
         with self._swagger_spec_lock:
             if not self._swagger_spec:
-                if "swagger_filename" in self.config:
-                    swagger_filename = self.config.swagger_filename
-                    if not swagger_filename.startswith("/"):
-                        swagger_filename = os.path.join(os.path.dirname(__file__), swagger_filename)
-                else:
-                    swagger_filename = self._get_swagger_filename(self.swagger_url)
-                if (("swagger_filename" not in self.config) and
-                    ((not os.path.exists(swagger_filename)) or
-                     (fs.get_days_since_last_modified(swagger_filename) >= self._spec_valid_for_days))):
-                    try:
-                        os.makedirs(self.config.user_config_dir)
-                    except OSError as e:
-                        if not (e.errno == errno.EEXIST and os.path.isdir(self.config.user_config_dir)):
-                            raise
-                    res = self.get_session().get(self.swagger_url)
-                    res.raise_for_status()
-                    res_json = res.json()
-                    assert "swagger" in res_json or "openapi" in res_json
-                    fs.atomic_write(swagger_filename, res.content)
+                swagger_filename = self._refresh_swagger_file()
                 with open(swagger_filename) as fh:
                     self._swagger_spec = self.load_swagger_json(fh)
         return self._swagger_spec
 
+    def _refresh_swagger_file(self):
+        """
+        Return the name of the local Swagger definition file, downloading it first if it is missing or older than
+        ``_spec_valid_for_days``.
+        """
+        if "swagger_filename" in self.config:
+            swagger_filename = self.config.swagger_filename
+            if not swagger_filename.startswith("/"):
+                swagger_filename = os.path.join(os.path.dirname(__file__), swagger_filename)
+        else:
+            swagger_filename = self._get_swagger_filename(self.swagger_url)
+        if (("swagger_filename" not in self.config) and
+            ((not os.path.exists(swagger_filename)) or
+             (fs.get_days_since_last_modified(swagger_filename) >= self._spec_valid_for_days))):
+            try:
+                os.makedirs(self.config.user_config_dir)
+            except OSError as e:
+                if not (e.errno == errno.EEXIST and os.path.isdir(self.config.user_config_dir)):
+                    raise
+            res = self.get_session().get(self.swagger_url)
+            res.raise_for_status()
+            res_json = res.json()
+            assert "swagger" in res_json or "openapi" in res_json
+            fs.atomic_write(swagger_filename, res.content)
+        return swagger_filename
+
     def _get_swagger_filename(self, swagger_url):
         swagger_filename = base64.urlsafe_b64encode(swagger_url.encode()).decode() + ".json"
         swagger_filename = os.path.join(self.config.user_config_dir, swagger_filename)
         return swagger_filename
 
+    def _get_compiled_spec_filename(self, spec_hash=None):
+        prefix = os.path.splitext(self._get_swagger_filename(self.swagger_url))[0]
+        return "{}.{}.{}.pickle".format(prefix, self.__class__.__name__, spec_hash or "*")
+
+    def _get_compiled_spec(self):
+        """
+        Return the compiled form of the Swagger definition, loading it from the pickle cache if possible and
+        compiling and caching it otherwise. The cache is an optimization only, so any problem reading or writing it
+        falls back to compiling the definition from scratch.
+        """
+        compiled_spec_filename = None
+        try:
+            with self._swagger_spec_lock:
+                with open(self._refresh_swagger_file(), "rb") as fh:
+                    spec_hash = hashlib.sha256(fh.read())
+                spec_hash.update("{}:{}:{}".format(self._compiled_spec_version, self.__class__.__module__,
+                                                   self.__class__.__name__).encode())
+                compiled_spec_filename = self._get_compiled_spec_filename(spec_hash.hexdigest())
+                if os.path.exists(compiled_spec_filename):
+                    with open(compiled_spec_filename, "rb") as fh:
+                        compiled_spec = pickle.load(fh)
+                    self._swagger_spec = compiled_spec["swagger_spec"]
+                    return compiled_spec
+        except Exception as e:
+            logger.debug("Unable to load compiled API definition: %s", e)
+        compiled_spec = self._compile_spec()
+        if compiled_spec_filename is not None:
+            try:
+                for stale_filename in glob.glob(self._get_compiled_spec_filename()):
+                    os.remove(stale_filename)
+                fs.atomic_write(compiled_spec_filename, pickle.dumps(compiled_spec, protocol=pickle.HIGHEST_PROTOCOL))
+            except Exception as e:
+                logger.debug("Unable to save compiled API definition: %s", e)
+        return compiled_spec
+
+    def _compile_spec(self):
+        if "openapi" in self.swagger_spec:
+            server = self.swagger_spec["servers"][0]
+            variables = {k: v["default"] for k, v in server.get("variables", {}).items()}
+            host = server["url"].format(**variables)
+        else:
+            host = "{scheme}://{host}{base}".format(scheme=self.scheme,
+                                                    host=self.swagger_spec["host"],
+                                                    base=self.swagger_spec["basePath"])
+        http_paths = collections.defaultdict(dict)
+        methods = []
+        for http_path, path_data in self.swagger_spec["paths"].items():
+            for http_method, method_data in path_data.items():
+                method_table = self._compile_client_method(http_method, http_path, method_data)
+                http_paths[method_table["method_name"]][frozenset(method_table["path_parameters"])] = http_path
+                methods.append(method_table)
+        return dict(swagger_spec=self.swagger_spec,
+                    description=_md2rst(self.swagger_spec["info"]["description"]),
+                    host=host,
+                    http_paths=dict(http_paths),
+                    methods=methods)
+
     def clear_cache(self):
         """
         Clear the cached API definitions for a component. This can help resolve errors communicating with the API.
         """
+        for compiled_spec_filename in glob.glob(self._get_compiled_spec_filename()):
+            try:
+                os.remove(compiled_spec_filename)
+            except EnvironmentError:
+                pass
         try:
             os.remove(self._get_swagger_filename(self.swagger_url))
         except EnvironmentError as e:
@@ -340,6 +512,18 @@ class SwaggerClient(object):
             self.config.application_secrets = requests.get(app_secrets_url).json()
         return self.config.application_secrets
 
+    @property
+    def aio(self):
+        """
+        An asyncio counterpart of this client, with a coroutine for each API method. Requires aiohttp.
+
+        See :class:`hca.util.aio.AsyncSwaggerClient`.
+        """
+        if self._aio is None:
+            from .aio import AsyncSwaggerClient
+            self._aio = AsyncSwaggerClient(self)
+        return self._aio
+
     def get_session(self):
         if self._session is None:
             self._session = Session(**self._session_kwargs)
@@ -461,16 +645,16 @@ class SwaggerClient(object):
             oauth2_client_data = self.application_secrets["installed"]
             if 'GOOGLE_APPLICATION_CREDENTIALS' in os.environ:
                 token, expires_at = self._get_jwt_from_service_account_credentials()
-                self._authenticated_session = OAuth2Session(client_id=oauth2_client_data["client_id"],
-                                                            token=dict(access_token=token,
-                                                                       expires_at=expires_at),
-                                                            **self._session_kwargs)
+                self._authenticated_session = requests_oauthlib.OAuth2Session(
+                    client_id=oauth2_client_data["client_id"],
+                    token=dict(access_token=token, expires_at=expires_at),
+                    **self._session_kwargs)
             else:
                 if "oauth2_token" not in self.config:
                     msg = ('Please configure {prog} authentication credentials using "{prog} login" '
                            'or set the GOOGLE_APPLICATION_CREDENTIALS environment variable')
                     raise Exception(msg.format(prog=self.__module__.replace(".", " ")))
-                self._authenticated_session = OAuth2Session(
+                self._authenticated_session = requests_oauthlib.OAuth2Session(
                     client_id=oauth2_client_data["client_id"],
                     token=self.config.oauth2_token,
                     auto_refresh_url=oauth2_client_data["token_uri"],
@@ -532,7 +716,7 @@ class SwaggerClient(object):
             method_name = method_name[:-1]
         return method_name
 
-    def _build_client_method(self, http_method, http_path, method_data):
+    def _compile_client_method(self, http_method, http_path, method_data):
         method_name = self._build_method_name(http_method, http_path)
         parameters = {p["name"]: p for p in method_data.get("parameters", [])}
         body_json_schema = {"properties": {}}
@@ -545,22 +729,15 @@ class SwaggerClient(object):
                     break
 
         path_parameters = [p_name for p_name, p_data in parameters.items() if p_data["in"] == "path"]
-        self.http_paths[method_name][frozenset(path_parameters)] = http_path
 
         body_props, method_args = self._process_method_args(parameters=parameters, body_json_schema=body_json_schema)
 
         method_supports_pagination = True if str(requests.codes.partial) in method_data["responses"] else False
         highlight_streaming_support = True if str(requests.codes.found) in method_data["responses"] else False
 
-        factory = _PaginatingClientMethodFactory if method_supports_pagination else _ClientMethodFactory
-        client_method = factory(self, parameters, path_parameters, http_method, method_name, method_data, body_props)
-        client_method.__name__ = method_name
-        client_method.__qualname__ = self.__class__.__name__ + "." + method_name
-
         params = [Parameter("factory", Parameter.POSITIONAL_OR_KEYWORD),
                   Parameter("client", Parameter.POSITIONAL_OR_KEYWORD)]
         params += [v["param"] for k, v in method_args.items() if not k.startswith("_")]
-        client_method.__signature__ = signature(client_method).replace(parameters=params)
         docstring = method_data.get("summary", '') + "\n\n"
 
         if method_supports_pagination:
@@ -575,11 +752,33 @@ class SwaggerClient(object):
                 docstring += ":param {}: {}\n".format(param, param_doc.replace("\n", " "))
                 docstring += ":type {}: {}\n".format(param, method_args[param]["param"].annotation)
         docstring += "\n\n" + _md2rst(method_data.get("description", ''))
-        client_method.__doc__ = docstring
+
+        return dict(method_name=method_name,
+                    http_method=http_method,
+                    method_data=method_data,
+                    parameters=parameters,
+                    path_parameters=path_parameters,
+                    body_props=body_props,
+                    method_args=method_args,
+                    paginated=method_supports_pagination,
+                    signature_params=params,
+                    docstring=docstring)
+
+    def _attach_client_method(self, method_table):
+        method_name = method_table["method_name"]
+        self._method_tables[method_name] = method_table
+        factory = _PaginatingClientMethodFactory if method_table["paginated"] else _ClientMethodFactory
+        client_method = factory(self, method_table["parameters"], method_table["path_parameters"],
+                                method_table["http_method"], method_name, method_table["method_data"],
+                                method_table["body_props"])
+        client_method.__name__ = method_name
+        client_method.__qualname__ = self.__class__.__name__ + "." + method_name
+        client_method.__signature__ = signature(client_method).replace(parameters=method_table["signature_params"])
+        client_method.__doc__ = method_table["docstring"]
 
         setattr(self.__class__, method_name, types.MethodType(client_method, SwaggerClient))
-        self.methods[method_name] = dict(method_data, entry_point=getattr(self, method_name)._cli_call,
-                                         signature=client_method.__signature__, args=method_args)
+        self.methods[method_name] = dict(method_table["method_data"], entry_point=getattr(self, method_name)._cli_call,
+                                         signature=client_method.__signature__, args=method_table["method_args"])
 
     def _command_arg_forwarder_factory(self, command, command_sig):
         def arg_forwarder(parsed_args):
@@ -606,9 +805,19 @@ class SwaggerClient(object):
             return anno.__args__[0]
         return anno
 
-    def build_argparse_subparsers(self, subparsers, help_menu=False):
+    def build_argparse_subparsers(self, subparsers, help_menu=False, subcommand=None):
+        """
+        Add a subparser for each API method and command to ``subparsers``.
+
+        :param subcommand: if not None, only the subparser for the subcommand with this name is fully constructed.
+                           All others are registered with their summary only, which is enough to list them in the
+                           help output and to complete their names.
+        """
         for method_name, method_data in self.methods.items():
             subcommand_name = method_name.replace("_", "-")
+            if subcommand is not None and subcommand != subcommand_name:
+                subparsers.add_parser(subcommand_name, help=method_data.get("summary"))
+                continue
             subparser = subparsers.add_parser(subcommand_name,
                                               help=method_data.get("summary"),
                                               description=method_data.get("description"),
@@ -632,13 +841,24 @@ class SwaggerClient(object):
             if str(requests.codes.partial) in method_data["responses"]:
                 subparser.add_argument("--no-paginate", action="store_false", dest="paginate",
                                        help='Do not automatically page the responses', default=True)
+                subparser.add_argument("--read-ahead", type=int, default=0, metavar="PAGES",
+                                       help='When automatically paging, fetch up to this many pages ahead in the '
+                                            'background')
+                subparser.add_argument("--json-lines", action="store_true", default=False,
+                                       help='Print the results as JSON Lines, one result per line, as each page '
+                                            'arrives')
             subparser.set_defaults(entry_point=method_data["entry_point"])
 
         for command in self.commands:
-            sig = signature(command)
             if not getattr(command, "__doc__", None):
                 raise SwaggerClientInternalError("Command {} has no docstring".format(command))
             docstring = command.__doc__.format(prog=subparsers._prog_prefix)
+            if subcommand is not None and subcommand != command.__name__.replace("_", "-"):
+                # Parsing the docstring is comparatively slow, and the summary is only shown when listing subcommands
+                summary = _parse_docstring(docstring)['summary'] if subcommand == "" else None
+                subparsers.add_parser(command.__name__.replace("_", "-"), help=summary)
+                continue
+            sig = signature(command)
             method_args = _parse_docstring(docstring)
             command_subparser = subparsers.add_parser(command.__name__.replace("_", "-"),
                                                       help=method_args['summary'],
@@ -1,10 +1,10 @@
-import commonmark
-
-from docutils import utils
-from docutils.frontend import OptionParser
-from docutils.parsers.rst import Parser as RSTParser
-
 from .. import logger
+from .._lazy import lazy_import
+
+commonmark = lazy_import("commonmark")
+utils = lazy_import("docutils.utils")
+frontend = lazy_import("docutils.frontend")
+rst = lazy_import("docutils.parsers.rst")
 
 _pagination_docstring = """
 .. admonition:: Pagination
@@ -18,7 +18,8 @@ _pagination_docstring = """
        ...
 
  The keyword arguments for ``{client_name}.{method_name}.iterate()`` are identical to the arguments for
- ``{client_name}.{method_name}()`` listed here.
+ ``{client_name}.{method_name}()`` listed here, plus ``read_ahead``, the number of pages to fetch in the background
+ while the results of the current page are being consumed (0 by default).
 """
 
 _streaming_docstring = """
@@ -84,8 +85,8 @@ def _parse_docstring(docstring):
     :return:
     :rtype: dict
     """
-    settings = OptionParser(components=(RSTParser,)).get_default_values()
-    rstparser = RSTParser()
+    settings = frontend.OptionParser(components=(rst.Parser,)).get_default_values()
+    rstparser = rst.Parser()
     document = utils.new_document(' ', settings)
     rstparser.parse(docstring, document)
     if document.children[0].tagname != 'block_quote':
@@ -0,0 +1,307 @@
+"""
+Asyncio bindings for Swagger API clients.
+
+Every ``SwaggerClient`` has an ``aio`` attribute with a coroutine for each API method, built from the same method
+tables as the synchronous ones. The coroutines take the same arguments and return the same results, but many of them
+can be in flight at once on a single event loop, without a thread per request:
+
+  async with DSSClient().aio as dss:
+      bundles = await asyncio.gather(*(dss.get_bundle(uuid=uuid, replica="aws") for uuid in uuids))
+
+Paginated routes can be paged with ``async for``:
+
+  async for page in dss.get_bundle.paginate(uuid=uuid, replica="aws"):
+      ...
+  async for file_ in dss.get_bundle.iterate(uuid=uuid, replica="aws"):
+      ...
+
+Large responses can be streamed, by reading from the ``content`` of the ``aiohttp.ClientResponse``:
+
+  async with dss.get_file.stream(uuid=uuid, replica="aws") as response:
+      async for chunk in response.content.iter_chunked(1024 * 1024):
+          ...
+
+Requests are retried according to the client's ``retry_policy``, the ``Retry-After`` header is obeyed on redirects as
+it is by the synchronous client, and errors are raised as :class:`SwaggerAPIException`, with a ``requests.Response``
+holding the error response.
+
+This module requires aiohttp, which is not installed with the hca package by default (``pip install hca[aio]``).
+"""
+import asyncio
+import email.utils
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, ProtocolError, ReadTimeoutError
+
+from .. import logger
+from .._lazy import lazy_import
+from . import _ClientMethodFactory
+from .exceptions import SwaggerAPIException
+
+aiohttp = lazy_import("aiohttp")
+
+
+class AsyncSwaggerClient(object):
+    """
+    The asyncio counterpart of a :class:`hca.util.SwaggerClient`. Close it with ``await client.close()``, or use it as
+    an asynchronous context manager, before the event loop it was used on is closed.
+
+    :param client: the synchronous client, whose API definition, configuration, credentials and retry policy are used
+    :param int limit: the maximum number of connections open at once
+    """
+
+    def __init__(self, client, limit=100):
+        self.client = client
+        self.limit = limit
+        self._session = None
+        self._token_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only called for methods that haven't been built yet
+        try:
+            method_table = self.client._method_tables[name]
+        except KeyError:
+            raise AttributeError(name)
+        factory = _AsyncPaginatingClientMethodFactory if method_table["paginated"] else _AsyncClientMethodFactory
+        method = factory(self.client, method_table["parameters"], method_table["path_parameters"],
+                         method_table["http_method"], name, method_table["method_data"], method_table["body_props"])
+        method.aio_client = self
+        method.__name__ = name
+        method.__qualname__ = "{}.aio.{}".format(self.client.__class__.__name__, name)
+        method.__doc__ = method_table["docstring"]
+        setattr(self, name, method)
+        return method
+
+    def __dir__(self):
+        return list(super(AsyncSwaggerClient, self).__dir__()) + list(self.client._method_tables)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def get_session(self):
+        if self._session is None or self._session.closed:
+            timeout_policy = self.client.timeout_policy
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(sock_connect=timeout_policy.connect_timeout,
+                                              sock_read=timeout_policy.read_timeout),
+                headers={"User-Agent": self.client.__class__.__name__})
+        return self._session
+
+    async def get_auth_headers(self):
+        # Obtaining and refreshing the token may block, so it is done from a thread rather than from the event loop
+        loop = asyncio.get_event_loop()
+        access_token = await loop.run_in_executor(None, self._get_access_token)
+        return {"Authorization": "Bearer " + access_token}
+
+    def _get_access_token(self):
+        with self._token_lock:
+            session = self.client.get_authenticated_session()
+            # A session made from a saved login only refreshes its token when it sends a request, which this client
+            # doesn't do through it, so an expired token is refreshed here
+            expires_at = session.token.get("expires_at")
+            if session.auto_refresh_url and expires_at and float(expires_at) <= time.time() + 10:
+                token = session.refresh_token(session.auto_refresh_url, **session.auto_refresh_kwargs)
+                if session.token_updater:
+                    session.token_updater(token)
+            return session.token["access_token"]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class _RetryResponse(object):
+    """
+    The parts of a urllib3 response that ``Retry.increment()`` looks at.
+    """
+
+    def __init__(self, status):
+        self.status = status
+
+    def get_redirect_location(self):
+        return False
+
+
+def _retry_after(headers):
+    """
+    :return: the number of seconds the Retry-After header says to wait, or None
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(email.utils.mktime_tz(date) - time.time(), 0)
+
+
+class _AsyncClientMethodFactory(_ClientMethodFactory):
+    aio_client = None
+
+    async def _request(self, req_args, url=None, headers=None, stream=False):
+        """
+        :param stream: if set, the body of a successful response is left unread, and the ``aiohttp.ClientResponse`` is
+                       returned instead of a ``requests.Response``. The caller must release it.
+        """
+        url, query, json_input, headers = self._prepare_request(req_args, url=url, headers=headers)
+        if "security" in self.method_data:
+            headers.update(await self.aio_client.get_auth_headers())
+        # aiohttp only accepts strings as query parameter values. Convert them as requests does for the synchronous
+        # client, which sends True as "True".
+        query = {k: str(v) if isinstance(v, bool) else v for k, v in query.items()}
+        retries = self.client.retry_policy.new()
+        method = self.http_method.upper()
+        redirects = 0
+        while True:
+            try:
+                res = await self.aio_client.get_session().request(method, url, params=query, json=json_input,
+                                                                  headers=headers, allow_redirects=False)
+                if not stream or res.status >= 300:
+                    try:
+                        body = await res.read()
+                    finally:
+                        res.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientConnectorError):
+                    error = ConnectTimeoutError(str(e))
+                elif isinstance(e, asyncio.TimeoutError):
+                    error = ReadTimeoutError(None, url, str(e))
+                else:
+                    error = ProtocolError(str(e))
+                try:
+                    retries = retries.increment(method, url, error=error)
+                except (MaxRetryError, ConnectTimeoutError, ReadTimeoutError, ProtocolError):
+                    raise requests.exceptions.ConnectionError(e)
+                logger.debug("Retrying %s %s after %r", method, url, e)
+                await asyncio.sleep(retries.get_backoff_time())
+                continue
+            location = res.headers.get("Location")
+            if res.status in (301, 302, 303, 307, 308) and location:
+                redirects += 1
+                if redirects > self.client.max_redirects:
+                    raise requests.exceptions.TooManyRedirects("Exceeded {} redirects.".format(redirects - 1))
+                retry_after = _retry_after(res.headers)
+                if retry_after:
+                    logger.warning("Waiting %ss before redirect per Retry-After header", res.headers["Retry-After"])
+                    await asyncio.sleep(retry_after)
+                next_url = res.url.join(type(res.url)(location))
+                if next_url.host != res.url.host:
+                    headers.pop("Authorization", None)
+                url, query = str(next_url), None
+                if res.status == 303 or (res.status in (301, 302) and method == "POST"):
+                    method, json_input = "GET", None
+                continue
+            if retries.is_retry(method, res.status, has_retry_after="Retry-After" in res.headers):
+                try:
+                    retries = retries.increment(method, url, response=_RetryResponse(res.status))
+                except MaxRetryError as e:
+                    if retries.raise_on_status:
+                        raise requests.exceptions.RetryError(e)
+                else:
+                    retry_after = _retry_after(res.headers) if retries.respect_retry_after_header else None
+                    await asyncio.sleep(retry_after or retries.get_backoff_time())
+                    continue
+            break
+        if stream and res.status < 300:
+            return res
+        response = self._build_response(res, body)
+        if response.status_code >= 400:
+            raise SwaggerAPIException(response=response)
+        return response
+
+    @staticmethod
+    def _build_response(res, body):
+        response = requests.Response()
+        response.status_code = res.status
+        response.reason = res.reason
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.url = str(res.url)
+        response.encoding = res.get_encoding() if body else None
+        response._content = body
+        return response
+
+    async def __call__(self, **kwargs):
+        return self._consume_response(await self._request(kwargs))
+
+    def stream(self, **kwargs):
+        """
+        :return: an asynchronous context manager yielding the ``aiohttp.ClientResponse``, with its body unread
+        """
+        return _AsyncStream(self, kwargs)
+
+
+class _AsyncStream(object):
+
+    def __init__(self, method, kwargs):
+        self.method = method
+        self.kwargs = kwargs
+        self._response = None
+
+    async def __aenter__(self):
+        self._response = await self.method._request(self.kwargs, stream=True)
+        return self._response
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # The connection is only reused if the body was read to the end
+        self._response.release()
+        self._response = None
+
+
+class _AsyncPageIterator(object):
+    """
+    Iterates asynchronously over the pages of a paginated response, or over the items in them.
+    """
+
+    def __init__(self, method, kwargs, items):
+        self.method = method
+        self.kwargs = kwargs
+        self.items = items
+        self._next_url = None
+        self._done = False
+        self._buffer = deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._buffer:
+            if self._done:
+                raise StopAsyncIteration
+            page = await self.method._request(self.kwargs, url=self._next_url)
+            self._next_url = page.links.get("next", {}).get("url")
+            self._done = not self._next_url
+            if self.items:
+                content_key = page.headers.get("X-OpenAPI-Paginated-Content-Key", "results")
+                results = page.json()
+                for key in content_key.split("."):
+                    results = results[key]
+                self._buffer.extend(results)
+            else:
+                self._buffer.append(page.json())
+        return self._buffer.popleft()
+
+
+class _AsyncPaginatingClientMethodFactory(_AsyncClientMethodFactory):
+    def iterate(self, **kwargs):
+        """
+        Asynchronously iterate over specific items from each response depending on its contents.
+
+        For example, GET /bundles/{id} and GET /collections/{id} yield the
+        items contained within; POST /search yields search result items.
+        """
+        return _AsyncPageIterator(self, kwargs, items=True)
+
+    def paginate(self, **kwargs):
+        """Asynchronously iterate over paginated responses one response body at a time."""
+        return _AsyncPageIterator(self, kwargs, items=False)
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+
+from .. import get_config, logger
+
+CHECKSUM_NAMES = ('crc32c', 'sha1', 'sha256', 's3_etag')
+# Names the database to use instead of the one in the user's configuration directory
+PATH_ENVIRONMENT_VARIABLE = 'HCA_CHECKSUM_CACHE'
+
+
+class ChecksumCache(object):
+    """
+    A persistent record of the checksums of local files, so that files that haven't changed since they were last
+    checksummed don't have to be read again.
+
+    Checksums are stored in an SQLite database, against the device and inode of the file. They are only returned while
+    the file still has the size and modification time it had when they were computed. Any of the checksums in
+    ``CHECKSUM_NAMES`` may be stored; a file's entry accumulates them as different callers compute different ones.
+
+    The cache is an optimization only: if the database can't be read or written, that is logged and treated as a miss.
+
+    Unless ``path`` is given, the database is the one named by the ``HCA_CHECKSUM_CACHE`` environment variable, or else
+    ``checksums.sqlite`` in the user's configuration directory.
+    """
+    FILENAME = "checksums.sqlite"
+
+    def __init__(self, path=None):
+        self.path = (path or os.environ.get(PATH_ENVIRONMENT_VARIABLE) or
+                     os.path.join(get_config().user_config_dir, self.FILENAME))
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS checksums ("
+                       "device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                       "{}, PRIMARY KEY (device, inode))".format(", ".join(n + " TEXT" for n in CHECKSUM_NAMES)))
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _entry(self, db, stat):
+        row = db.execute("SELECT size, mtime_ns, {} FROM checksums WHERE device = ? AND inode = ?".format(
+            ", ".join(CHECKSUM_NAMES)), (stat.st_dev, stat.st_ino)).fetchone()
+        if row is None or tuple(row[:2]) != (stat.st_size, stat.st_mtime_ns):
+            return {}
+        return {name: value for name, value in zip(CHECKSUM_NAMES, row[2:]) if value is not None}
+
+    def get(self, file_path, checksum_names=CHECKSUM_NAMES, stat=None):
+        """
+        :param stat: the result of ``os.stat(file_path)``, if the caller already has it
+        :return: a dict of the named checksums of the file, or None if any of them isn't known for the file as it is now
+        """
+        stat = stat or os.stat(file_path)
+        try:
+            with self._lock:
+                known = self._entry(self._connect(), stat)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Unable to read checksum cache %s: %s", self.path, e)
+            return None
+        if not all(name in known for name in checksum_names):
+            return None
+        return {name: known[name] for name in checksum_names}
+
+    def put(self, file_path, checksums, stat=None):
+        """
+        Record checksums of a file.
+
+        :param stat: the result of ``os.stat(file_path)`` from before the checksums were computed. If the file was
+                     modified while it was being read, the entry then won't match the file.
+        """
+        stat = stat or os.stat(file_path)
+        checksums = {name: value for name, value in checksums.items() if name in CHECKSUM_NAMES}
+        try:
+            with self._lock:
+                db = self._connect()
+                with db:
+                    checksums = dict(self._entry(db, stat), **checksums)
+                    db.execute("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, {})".format(
+                        ", ".join("?" for _ in CHECKSUM_NAMES)),
+                        (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) +
+                        tuple(checksums.get(name) for name in CHECKSUM_NAMES))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Unable to write checksum cache %s: %s", self.path, e)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_checksum_cache = None
+_checksum_cache_lock = threading.Lock()
+
+
+def get_checksum_cache():
+    """
+    :return: the checksum cache shared by the whole process, at the default location of a ChecksumCache
+    """
+    global _checksum_cache
+    with _checksum_cache_lock:
+        if _checksum_cache is None:
+            _checksum_cache = ChecksumCache()
+        return _checksum_cache
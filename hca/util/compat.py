@@ -1,8 +1,42 @@
+import os
 import sys
+import threading
 
 if sys.version_info < (3, 5):
     from scandir import scandir, walk
 else:
     from os import scandir, walk
 
-__all__ = ('scandir', 'walk')
+__all__ = ('scandir', 'walk', 'pread', 'pwrite')
+
+_positional_io_lock = threading.Lock()
+
+
+def pread(fd, size, offset):
+    """
+    Read up to size bytes at offset from the file descriptor fd, like os.pread. Windows has no os.pread, so there the
+    file offset is moved and read from under a lock instead, which callers sharing fd must not rely on.
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    with _positional_io_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+def pwrite(fd, data, offset):
+    """
+    Write data at offset into the file descriptor fd, like os.pwrite, but always writing all of it. Windows has no
+    os.pwrite, so there the file offset is moved and written to under a lock instead.
+    """
+    if hasattr(os, 'pwrite'):
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+        return written
+    with _positional_io_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        return written
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+from .. import logger
+from . import _read_ahead
+from .compat import scandir
+
+DEFAULT_READ_AHEAD = 10000
+# The walk reports the files it has found in batches of this many, or after this many seconds
+SIZED_BATCH = 1000
+SIZED_BATCH_WAIT = 0.1
+
+
+def _iter_file_entries(path, file_filter=None):
+    """
+    Generate the files beneath ``path`` with ``scandir``, as DirEntry objects, depth first. Like ``os.walk``,
+    symbolic links to directories are not followed. Files are yielded as soon as they are found, without reading the
+    rest of the tree first. Like ``os.walk``, directories that can't be read are skipped, with a warning.
+    """
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            entries = list(scandir(dir_path))
+        except OSError as e:
+            logger.warning("Skipping directory %s: %s", dir_path, e)
+            continue
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError as e:
+                logger.warning("Skipping %s: %s", entry.path, e)
+                continue
+            if is_dir:
+                if not entry.is_symlink():
+                    stack.append(entry.path)
+            elif file_filter is None or file_filter(entry.name):
+                yield entry
+
+
+class FileWalk(object):
+    """
+    The files at or beneath some paths, for handing to an uploader while the directories are still being walked.
+
+    Iterating over a FileWalk walks the paths in a background thread, keeping up to ``read_ahead`` file paths ready,
+    so that the first files can be uploaded straight away and the paths never all have to be held in memory. The same
+    walk adds up the number and size of the files from the stat results of ``scandir`` as it finds them, so each
+    directory is read and each file stat'ed only once, and the totals run ahead of the consumer by up to
+    ``read_ahead`` files. ``file_count`` and ``total_size`` grow as it goes, ``sized`` is set once it is finished,
+    and ``on_sized`` (if set before iterating) is called with the number and combined size of each batch of files
+    found. Iterate over ``with_sizes()`` instead to have each path together with its size.
+
+    :param paths: paths of files or directories. Paths that are neither are skipped.
+    :param file_filter: if given, only files whose name it returns True for are included
+    """
+
+    def __init__(self, paths, file_filter=None, read_ahead=DEFAULT_READ_AHEAD):
+        self.paths = list(paths)
+        self.file_filter = file_filter
+        self.read_ahead = read_ahead
+        self.file_count = 0
+        self.total_size = 0
+        self.sized = threading.Event()
+        self.on_sized = None
+
+    def _iter_sized_paths(self):
+        count, size, added_at = 0, 0, time.monotonic()
+        try:
+            for path in self.paths:
+                if os.path.isdir(path):
+                    sized_paths = ((entry.path, self._size_of(entry.stat))
+                                   for entry in _iter_file_entries(path, self.file_filter))
+                elif os.path.isfile(path):
+                    sized_paths = [(path, self._size_of(lambda: os.stat(path)))]
+                else:
+                    continue
+                for file_path, file_size in sized_paths:
+                    if file_size is not None:
+                        count += 1
+                        size += file_size
+                        if count == SIZED_BATCH or time.monotonic() - added_at >= SIZED_BATCH_WAIT:
+                            self._add(count, size)
+                            count, size, added_at = 0, 0, time.monotonic()
+                    yield file_path, file_size
+            self._add(count, size)
+        finally:
+            self.sized.set()
+
+    @staticmethod
+    def _size_of(stat):
+        try:
+            return stat().st_size
+        except OSError:
+            # Left for whoever opens the file to report
+            return None
+
+    def _add(self, count, size):
+        if not count:
+            return
+        self.file_count += count
+        self.total_size += size
+        if self.on_sized is not None:
+            self.on_sized(count, size)
+
+    def __iter__(self):
+        return (file_path for file_path, _ in self.with_sizes())
+
+    def with_sizes(self):
+        """
+        Iterate over the files as (path, size) pairs, with the sizes from the ``scandir`` stat results. The size is
+        None if the file can't be stat'ed.
+        """
+        return _read_ahead(self._iter_sized_paths(), self.read_ahead)
@@ -1,42 +1,60 @@
-from threading import Thread
+import concurrent.futures
+import threading
+
 from . import DEFAULT_THREAD_COUNT
 
-from queue import Queue
-
-
-class Worker(Thread):
-    """ Thread executing tasks from a given tasks queue."""
-    def __init__(self, thread_pool):
-        Thread.__init__(self)
-        self.thread_pool = thread_pool
-        self.tasks = self.thread_pool.tasks
-        self.daemon = True
-        self.start()
-
-    def run(self):
-        while True:
-            try:
-                func, args, kargs = self.tasks.get()
-                func(*args, **kargs)
-                self.tasks.task_done()
-            except Exception as e:
-                # An exception happened in this thread
-                self.thread_pool.thread_failure = e
-                self.tasks.task_done()
-
-
-class ThreadPool:
-    """ Pool of threads with an associated queue """
-    def __init__(self, num_threads=DEFAULT_THREAD_COUNT):
-        self.tasks = Queue()
-        self.thread_failure = None
-        for _ in range(num_threads):
-            Worker(self)
-
-    def add_task(self, func, *args, **kargs):
-        """ Add a task to the queue """
-        self.tasks.put((func, args, kargs))
-
-    def wait_for_completion(self):
-        """ Wait for completion of all the tasks in the queue """
-        self.tasks.join()
+
+class BoundedExecutor:
+    """
+    A thread pool that holds at most ``max_pending`` tasks, queued or running, at a time. ``submit()`` blocks while it
+    is full, so a producer can't get arbitrarily far ahead of the workers. Each task gets a Future for its result or
+    exception.
+    """
+    def __init__(self, max_workers=DEFAULT_THREAD_COUNT, max_pending=None):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+
+    def submit(self, func, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_shared_executors = {}
+_shared_executors_lock = threading.Lock()
+
+
+def shared_executor(name, max_workers=None):
+    """
+    Return the BoundedExecutor called ``name``, creating it with ``max_workers`` threads (DEFAULT_THREAD_COUNT if not
+    given) on first use, so that its worker threads are reused by every caller instead of being started for each batch
+    of work.
+
+    :raises ValueError: if the executor already exists with a different number of threads than ``max_workers``
+    """
+    with _shared_executors_lock:
+        if name not in _shared_executors:
+            _shared_executors[name] = BoundedExecutor(max_workers=max_workers or DEFAULT_THREAD_COUNT)
+        executor = _shared_executors[name]
+    if max_workers is not None and max_workers != executor.max_workers:
+        raise ValueError("Executor {name} has {count} threads, not {max_workers}".format(
+            name=name, count=executor.max_workers, max_workers=max_workers))
+    return executor
+
+
+def cancel_futures(futures):
+    """
+    Cancel the given futures that haven't started running yet.
+
+    :return: the number of futures cancelled
+    """
+    return sum(1 for future in futures if future.cancel())
@@ -0,0 +1,89 @@
+import concurrent.futures
+import queue
+import threading
+
+DEFAULT_LISTING_THREADS = 16
+_DONE = object()
+
+
+class ShardedS3Lister(object):
+    """
+    Lists the objects under an S3 prefix with many ``list_objects_v2`` requests in flight at once.
+
+    A single listing has to page through the keys one request after another. Instead, each prefix is listed with a
+    delimiter, and every sub-prefix that turns up is listed by another thread, so a prefix holding a tree of "folders"
+    is enumerated as fast as the threads allow. Objects are yielded as soon as their page arrives, in no particular
+    order, while the listing continues in the background. At most ``max_pages`` pages wait to be consumed.
+
+    :param s3_client: a boto3 S3 client, which may be used from several threads
+    """
+
+    def __init__(self, s3_client, threads=DEFAULT_LISTING_THREADS, delimiter="/", max_pages=64):
+        self.s3_client = s3_client
+        self.threads = threads
+        self.delimiter = delimiter
+        self.max_pages = max_pages
+
+    def list_objects(self, bucket, prefix=""):
+        """
+        Generate the objects under ``prefix``, as the dicts found in the ``Contents`` of a ``list_objects_v2``
+        response.
+        """
+        results = queue.Queue(maxsize=self.max_pages)
+        stopped = threading.Event()
+        lock = threading.Lock()
+        pending = [0]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def submit(prefix):
+            with lock:
+                pending[0] += 1
+            executor.submit(list_prefix, prefix)
+
+        def list_prefix(prefix):
+            try:
+                paginator = self.s3_client.get_paginator('list_objects_v2')
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter=self.delimiter):
+                    if stopped.is_set():
+                        return
+                    for common_prefix in page.get('CommonPrefixes', []):
+                        submit(common_prefix['Prefix'])
+                    if page.get('Contents'):
+                        put(page['Contents'])
+            except Exception as e:
+                put(e)
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    done = pending[0] == 0
+                if done:
+                    put(_DONE)
+
+        submit(prefix)
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                for obj in item:
+                    yield obj
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False)
+
+
+def list_objects(s3_client, bucket, prefix="", threads=DEFAULT_LISTING_THREADS):
+    """
+    Generate the objects under an S3 prefix, listing it in parallel. See :class:`ShardedS3Lister`.
+    """
+    return ShardedS3Lister(s3_client, threads=threads).list_objects(bucket, prefix)
@@ -28,6 +28,9 @@ setup(
             'typing >= 3.6.2, < 4',
             'scandir >= 1.9.0, < 2'
         ],
+        'aio': [
+            'aiohttp >= 3.5.4, < 4'
+        ],
     },
     packages=find_packages(exclude=['test']),
     entry_points={
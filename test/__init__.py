@@ -1,7 +1,10 @@
+import atexit
 import io
 import os
 import sys
 import pickle
+import shutil
+import tempfile
 from functools import wraps
 
 import hca, hca.config
@@ -9,6 +12,12 @@ import hca, hca.config
 if 'DEPLOYMENT_STAGE' not in os.environ:
     os.environ['DEPLOYMENT_STAGE'] = 'test'
 
+if 'HCA_CHECKSUM_CACHE' not in os.environ:
+    # Keep the checksums of the files that tests upload out of the user's checksum cache
+    _checksum_cache_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, _checksum_cache_dir, ignore_errors=True)
+    os.environ['HCA_CHECKSUM_CACHE'] = os.path.join(_checksum_cache_dir, 'checksums.sqlite')
+
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -9,6 +9,7 @@ import responses
 
 import hca
 from hca.upload import UploadService, UploadConfig, UploadAreaURI
+from hca.upload.lib.api_client import ApiClient
 from test import TweakResetter
 
 
@@ -33,6 +34,8 @@ class UploadTestCase(unittest.TestCase):
         # Upload Service
         self.api_token = "bogo-api-token"
         self.upload_service = UploadService(deployment_stage=self.deployment_stage, api_token=self.api_token)
+        # Whether the Upload Service accepts notifications for several files is up to each test
+        ApiClient._bulk_notifications_unsupported.clear()
 
     def tearDown(self):
         self.s3_mock.stop()
@@ -7,14 +7,17 @@ import sys
 import unittest
 from argparse import Namespace
 
+import boto3
 import responses
 from mock import Mock, patch
 
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
+from hca.upload import UploadArea
 from hca.upload.cli.upload_command import UploadCommand
-from test import TEST_DIR
+from hca.upload.lib.s3_agent import DEFAULT_MAX_POOL_CONNECTIONS
+from test import TEST_DIR, CapturingIO
 from test.integration.upload import UploadTestCase
 
 
@@ -42,7 +45,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
             no_transfer_acceleration=False,
             quiet=True,
             file_extension=None,
-            sync=True)
+            sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
@@ -57,7 +60,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
     @responses.activate
     def test_parse_s3_path_with_no_prefix(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         s3_path_with_no_prefix = "s3://fake-bucket"
@@ -70,7 +73,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
     @responses.activate
     def test_parse_s3_path_with_dir_prefix(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         s3_path_with_no_prefix = "s3://fake-bucket/fake-dir/"
@@ -83,7 +86,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
     @responses.activate
     def test_parse_s3_path_with_obj_prefix(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         s3_path_with_no_prefix = "s3://fake-bucket/fake-dir/fake-obj"
@@ -94,74 +97,52 @@ class TestUploadCliUploadCommand(UploadTestCase):
         self.assertEqual(prefix, "fake-dir/fake-obj")
 
     @responses.activate
-    def test_retrieve_files_list_and_size_sum_tuple_from_s3_path_with_dir_key(self):
+    def test_iterate_files_from_s3_paths_with_dir_key(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         area_s3_path = "s3://{0}/{1}".format(self.upload_bucket_name, self.area.uuid)
 
-        s3_file_paths, total_fize_size = upload_command._retrieve_files_list_and_size_sum_tuple_from_s3_path(
-            area_s3_path)
+        s3_file_paths = list(upload_command._iterate_files_from_s3_paths([area_s3_path]))
 
         for file in self.test_files:
             file_key = "{0}/{1}".format(area_s3_path, file)
             self.assertEqual(True, file_key in s3_file_paths)
-        self.assertIsInstance(total_fize_size, int)
 
     @responses.activate
-    def test_retrieve_files_list_and_size_sum_tuple_from_s3_path_with_partial_obj_key(self):
+    def test_iterate_files_from_s3_paths_with_partial_obj_key(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         area_path = "s3://{0}/{1}".format(self.upload_bucket_name, self.area.uuid)
         partial_obj_key = "{0}/LIC".format(area_path)
         complete_obj_key = "{0}/LICENSE".format(area_path)
 
-        s3_file_paths, total_fize_size = upload_command._retrieve_files_list_and_size_sum_tuple_from_s3_path(
-            partial_obj_key)
+        s3_file_paths = list(upload_command._iterate_files_from_s3_paths([partial_obj_key]))
 
         self.assertEqual(True, complete_obj_key in s3_file_paths)
         self.assertEqual(1, len(s3_file_paths))
-        self.assertIsInstance(total_fize_size, int)
 
     @responses.activate
-    def test_load_file_paths_from_upload_path_with_s3_input(self):
+    def test_iterate_files_from_s3_paths_with_complete_obj_key(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
-        self.simulate_credentials_api(area_uuid=self.area.uuid)
-        upload_command = self.upload_command(args)
-        area_path = "s3://{0}/{1}".format(self.upload_bucket_name, self.area.uuid)
-        partial_obj_key = "{0}/LIC".format(area_path)
-        complete_obj_key = "{0}/LICENSE".format(area_path)
-
-        upload_command._load_file_paths_from_upload_path(args, partial_obj_key)
-
-        self.assertEqual(True, complete_obj_key in upload_command.file_paths)
-        self.assertEqual(3, len(upload_command.file_paths))
-        self.assertIsInstance(upload_command.file_size_sum, int)
-
-    @responses.activate
-    def test_retrieve_files_list_and_size_sum_tuple_from_s3_path_with_complete_obj_key(self):
-        args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         upload_command = self.upload_command(args)
         area_path = "s3://{0}/{1}".format(self.upload_bucket_name, self.area.uuid)
         complete_obj_key = "{0}/LICENSE".format(area_path)
 
-        s3_file_paths, total_fize_size = upload_command._retrieve_files_list_and_size_sum_tuple_from_s3_path(
-            complete_obj_key)
+        s3_file_paths = list(upload_command._iterate_files_from_s3_paths([complete_obj_key]))
 
         self.assertEqual(True, complete_obj_key in s3_file_paths)
         self.assertEqual(1, len(s3_file_paths))
-        self.assertIsInstance(total_fize_size, int)
 
     @responses.activate
     def test_upload_with_dcp_type_option(self):
         args = Namespace(upload_paths=['LICENSE'], target_filename=None, no_transfer_acceleration=False, quiet=True,
-                         file_extension=None, sync=True)
+                         file_extension=None, sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
@@ -179,23 +160,26 @@ class TestUploadCliUploadCommand(UploadTestCase):
 
         with patch('hca.upload.lib.s3_agent.S3Agent.upload_local_file'), \
              patch('hca.upload.lib.s3_agent.Config', new=Mock(wraps=botocore.config.Config)) as mock_config:
-            args = Namespace(upload_paths=['LICENSE'], target_filename=None, quiet=True, file_extension=None, sync=True)
+            args = Namespace(upload_paths=['LICENSE'], target_filename=None, quiet=True, file_extension=None, sync=True,
+                             single_pass=False, dry_run=False)
             args.no_transfer_acceleration = False
 
             self.simulate_credentials_api(area_uuid=self.area.uuid)
 
             self.upload_command(args)
-            mock_config.assert_called_once_with(s3={'use_accelerate_endpoint': True})
+            mock_config.assert_any_call(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                                        s3={'use_accelerate_endpoint': True})
 
             mock_config.reset_mock()
             args.no_transfer_acceleration = True
             self.upload_command(args)
-            mock_config.assert_called_once_with()
+            for call in mock_config.call_args_list:
+                self.assertEqual(call, ((), {'max_pool_connections': DEFAULT_MAX_POOL_CONNECTIONS}))
 
     @responses.activate
     def test_multiple_uploads(self):
         args = Namespace(upload_paths=self.test_files, target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
@@ -210,9 +194,13 @@ class TestUploadCliUploadCommand(UploadTestCase):
     @responses.activate
     def test_upload_do_not_overwrite_same_file_with_sync_on(self):
         args = Namespace(upload_paths=['LICENSE'], target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=True)
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
+        # The Upload Service hasn't checksummed the file yet, so it is compared with the uploaded file's metadata
+        files_info_url = 'https://upload.{stage}.data.humancellatlas.org/v1/area/{uuid}/files_info'.format(
+            stage=self.deployment_stage, uuid=self.area.uuid)
+        responses.add(responses.PUT, files_info_url, json=[{'name': 'LICENSE', 'checksums': {}}])
 
         self.upload_command(args)
         last_modified_time_for_first_attempted_upload = self.upload_bucket.Object(
@@ -224,10 +212,40 @@ class TestUploadCliUploadCommand(UploadTestCase):
 
         self.assertEqual(last_modified_time_for_first_attempted_upload, last_modified_time_for_second_attempted_upload)
 
+    @responses.activate
+    def test_sync_dry_run_reports_plan_without_uploading(self):
+        args = Namespace(upload_paths=['LICENSE'], target_filename=None, no_transfer_acceleration=False,
+                         dcp_type=None, quiet=True, file_extension=None, sync=True, single_pass=False, dry_run=True)
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+
+        with CapturingIO('stdout') as stdout:
+            self.upload_command(args)
+
+        self.assertIn("1 files to upload", stdout.captured())
+        self.assertIn("upload  LICENSE", stdout.captured())
+        self.assertEqual(list(self.upload_bucket.objects.all()), [])
+
+    @responses.activate
+    def test_sync_dry_run_lists_s3_sources(self):
+        source_bucket = boto3.resource('s3').Bucket('org-bogo-source')
+        source_bucket.create()
+        source_bucket.put_object(Key='data/a.json', Body=b'content')
+        args = Namespace(upload_paths=['LICENSE', 's3://org-bogo-source/data'], target_filename=None,
+                         no_transfer_acceleration=False, quiet=True, file_extension=None, sync=True,
+                         single_pass=False, dry_run=True)
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+
+        with CapturingIO('stdout') as stdout:
+            UploadCommand(args)
+
+        self.assertIn("1 files to copy from S3 without comparing", stdout.captured())
+        self.assertIn("copy    s3://org-bogo-source/data/a.json", stdout.captured())
+        self.assertEqual(list(self.upload_bucket.objects.all()), [])
+
     @responses.activate
     def test_upload_overwrite_same_file_with_sync_off(self):
         args = Namespace(upload_paths=['LICENSE'], target_filename=None, no_transfer_acceleration=False,
-                         dcp_type=None, quiet=True, file_extension=None, sync=False)
+                         dcp_type=None, quiet=True, file_extension=None, sync=False, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
@@ -250,7 +268,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
             no_transfer_acceleration=False,
             quiet=True,
             file_extension=None,
-            sync=True)
+            sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         self.upload_command(args)
@@ -265,7 +283,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
             no_transfer_acceleration=False,
             quiet=True,
             file_extension="fastq.gz",
-            sync=True)
+            sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         self.upload_command(args)
@@ -281,7 +299,7 @@ class TestUploadCliUploadCommand(UploadTestCase):
             no_transfer_acceleration=False,
             quiet=True,
             file_extension=None,
-            sync=True)
+            sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         self.upload_command(args)
@@ -297,12 +315,35 @@ class TestUploadCliUploadCommand(UploadTestCase):
             no_transfer_acceleration=False,
             quiet=True,
             file_extension="fastq.gz",
-            sync=True)
+            sync=True, single_pass=False, dry_run=False)
 
         self.simulate_credentials_api(area_uuid=self.area.uuid)
         self.upload_command(args)
         self.assertEqual(len(list(self.upload_bucket.objects.all())), 2)
 
+    @responses.activate
+    def test_s3_upload_path_streams_listing_into_uploads(self):
+        source_bucket = boto3.resource('s3').Bucket('org-bogo-source')
+        source_bucket.create()
+        keys = ['data/a.json', 'data/sub1/b.json', 'data/sub1/deeper/c.json', 'data/sub2/d.json']
+        for key in keys:
+            source_bucket.put_object(Key=key, Body=b'content of ' + key.encode())
+            self.add_upload_mock(self.area.uuid, os.path.basename(key))
+        source_bucket.put_object(Key='other/e.json', Body=b'not uploaded')
+        args = Namespace(upload_paths=['s3://org-bogo-source/data'], target_filename=None,
+                         no_transfer_acceleration=False, quiet=True, file_extension=None, sync=False,
+                         single_pass=False, dry_run=False)
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+
+        with patch('hca.upload.upload_area.UploadArea.upload_files', autospec=True,
+                   side_effect=UploadArea.upload_files) as upload_files:
+            UploadCommand(args)
+
+        self.assertNotIsInstance(upload_files.call_args[0][1], list)
+        uploaded = {obj.key: obj.get()['Body'].read() for obj in self.upload_bucket.objects.all()}
+        self.assertEqual(uploaded, {"{}/{}".format(self.area.uuid, os.path.basename(key)): b'content of ' + key.encode()
+                                    for key in keys})
+
 
 if __name__ == "__main__":
     unittest.main()
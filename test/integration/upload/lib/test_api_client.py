@@ -7,6 +7,7 @@ import random
 import sys
 import unittest
 import uuid
+from unittest.mock import patch
 
 import responses
 
@@ -14,7 +15,7 @@ pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '
 sys.path.insert(0, pkg_root)  # noqa
 
 from hca.upload import UploadConfig
-from hca.upload.lib.api_client import ApiClient
+from hca.upload.lib.api_client import ApiClient, UploadApiException
 from test.integration.upload import UploadTestCase
 
 
@@ -132,6 +133,64 @@ class TestApiClient(UploadTestCase):
         self.assertTrue('Api-Key' not in responses.calls[0].request.headers)  # Unauthenticated endpoint
         self.assertTrue(result)
 
+    @responses.activate
+    def test_files_upload_notification(self):
+        upload_area_id = uuid.uuid4()
+        url = 'https://prefix.test.suffix/v1/area/{uuid}/notifications/files_uploaded'.format(uuid=upload_area_id)
+        responses.add(responses.POST, url, status=202)
+
+        result = self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["a b", "c"])
+
+        self.assertEqual(1, len(responses.calls))
+        self.assertEqual('POST', responses.calls[0].request.method)
+        self.assertEqual(url, responses.calls[0].request.url)
+        self.assertEqual(["a%20b", "c"], json.loads(responses.calls[0].request.body))
+        self.assertTrue(result)
+
+    @responses.activate
+    def test_files_upload_notification_unsupported(self):
+        upload_area_id = uuid.uuid4()
+        url = 'https://prefix.test.suffix/v1/area/{uuid}/notifications/files_uploaded'.format(uuid=upload_area_id)
+        responses.add(responses.POST, url, status=404)
+
+        self.assertFalse(self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["a"]))
+        # Remembered for every ApiClient
+        api_client = ApiClient(deployment_stage="test", authentication_token=self.api_key)
+        self.assertFalse(api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["b"]))
+        self.assertEqual(1, len(responses.calls))
+
+    @responses.activate
+    def test_files_upload_notification_not_allowed(self):
+        upload_area_id = uuid.uuid4()
+        url = 'https://prefix.test.suffix/v1/area/{uuid}/notifications/files_uploaded'.format(uuid=upload_area_id)
+        responses.add(responses.POST, url, status=405)
+
+        self.assertFalse(self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["a"]))
+        self.assertFalse(self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["b"]))
+        self.assertEqual(1, len(responses.calls))
+
+    @responses.activate
+    def test_files_upload_notification_failure_is_not_retried(self):
+        upload_area_id = uuid.uuid4()
+        url = 'https://prefix.test.suffix/v1/area/{uuid}/notifications/files_uploaded'.format(uuid=upload_area_id)
+        responses.add(responses.POST, url, status=500)
+
+        with self.assertRaises(UploadApiException):
+            self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["a"])
+        self.assertEqual(1, len(responses.calls))
+
+    @responses.activate
+    def test_files_upload_notification_is_not_taken_for_a_file_notification(self):
+        upload_area_id = uuid.uuid4()
+        # A service without bulk notifications, which accepts a notification for a file called "files_uploaded"
+        url = 'https://prefix.test.suffix/v1/area/{uuid}/{path}'
+        responses.add(responses.POST, url.format(uuid=upload_area_id, path='files_uploaded'), status=202)
+        responses.add(responses.POST, url.format(uuid=upload_area_id, path='notifications/files_uploaded'), status=404)
+
+        self.assertFalse(self.api_client.files_upload_notification(area_uuid=upload_area_id, file_list=["a"]))
+        self.assertEqual(url.format(uuid=upload_area_id, path='notifications/files_uploaded'),
+                         responses.calls[0].request.url)
+
     @responses.activate
     def test_files_info(self):
         upload_area_id = uuid.uuid4()
@@ -268,7 +327,19 @@ class TestApiClient(UploadTestCase):
         self.assertTrue('Api-Key' not in responses.calls[0].request.headers)  # Unauthenticated endpoint
         self.assertEqual(result_data, result)
 
+    @responses.activate
+    def test_connections_and_config_are_reused(self):
+        upload_area_id = uuid.uuid4()
+        url = 'https://prefix.test.suffix/v1/area/{area_id}/checksums'.format(area_id=upload_area_id)
+        responses.add(responses.GET, url, json={}, status=200)
+
+        with patch('hca.upload.lib.api_client.UploadConfig', wraps=UploadConfig) as config_class:
+            for _ in range(3):
+                self.api_client.checksum_statuses(area_uuid=upload_area_id)
 
+        self.assertEqual(3, len(responses.calls))
+        self.assertEqual(1, config_class.call_count)
+        self.assertIs(ApiClient.get_session(), ApiClient(deployment_stage="test").get_session())
 
 
 if __name__ == "__main__":
@@ -32,10 +32,10 @@ class TestCredentialsManager(UploadTestCase):
         config.save()
         return stored_creds
 
-    def _simulate_credentials_api(self):
+    def _simulate_credentials_api(self, expires_in=datetime.timedelta(hours=1)):
         api_host = "upload.{stage}.data.humancellatlas.org".format(stage=self.area.deployment_stage)
         creds_url = 'https://{api_host}/v1/area/{uuid}/credentials'.format(api_host=api_host, uuid=self.area.uuid)
-        expiration = (datetime.datetime.utcnow() + datetime.timedelta(hours=1)).isoformat() + 'Z'
+        expiration = (datetime.datetime.utcnow() + expires_in).isoformat() + 'Z'
         api_creds = {
             'AccessKeyId': 'apikey',
             'SecretAccessKey': 'apisecret',
@@ -61,6 +61,20 @@ class TestCredentialsManager(UploadTestCase):
         self.assertEqual(responses.calls[0].request.url, creds_url)
         self.assertEqual(expected_creds, creds)
 
+    @responses.activate
+    def test_credentials_are_cached_until_close_to_expiry(self):
+        self._simulate_credentials_api()
+        self.cm.get_credentials_from_upload_api()
+        self.cm.get_credentials_from_upload_api()
+        self.assertEqual(len(responses.calls), 1)
+
+        responses.reset()
+        self.cm = CredentialsManager(upload_area=self.area)
+        self._simulate_credentials_api(expires_in=datetime.timedelta(minutes=5))
+        self.cm.get_credentials_from_upload_api()
+        self.cm.get_credentials_from_upload_api()
+        self.assertEqual(len(responses.calls), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import functools
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 import uuid
 from mock import Mock, patch
@@ -14,8 +18,12 @@ sys.path.insert(0, pkg_root)  # noqa
 
 from test import TEST_DIR
 from test.integration.upload import UploadTestCase
-from hca.upload.lib.s3_agent import WRITE_PERCENT_THRESHOLD
-from hca.upload import UploadAreaURI, UploadService
+from hca.upload.lib.client_side_checksum_handler import ClientSideChecksumHandler
+from hca.upload.lib.s3_agent import WRITE_PERCENT_THRESHOLD, UploadBatch
+from hca.upload.lib.sync_planner import SyncPlanner
+from hca.upload.lib.upload_scheduler import UploadScheduler
+from hca.util.fs_walk import FileWalk
+from hca.upload import UploadArea, UploadAreaURI, UploadException, UploadService
 
 
 class TestUploadArea(UploadTestCase):
@@ -187,6 +195,24 @@ class TestUploadAreaFileUpload(UploadTestCase):
             expected_contents = fh.read()
             self.assertEqual(obj.get()['Body'].read(), expected_contents)
 
+    @responses.activate
+    def test_file_upload_single_pass(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+
+        file_path = os.path.join(TEST_DIR, "res", "bundle", "assay.json")
+        self.add_upload_mock(self.area.uuid, 'assay.json')
+        with patch('hca.upload.lib.client_side_checksum_handler.ClientSideChecksumHandler') as checksum_handler:
+            self.area.upload_files(file_paths=[file_path], sync=False, single_pass=True)
+        checksum_handler.assert_not_called()
+
+        obj = self.upload_bucket.Object("{}/assay.json".format(self.area.uuid))
+        self.assertEqual(obj.content_type, 'application/json; dcp-type=data')
+        expected_checksums = ClientSideChecksumHandler(file_path)
+        expected_checksums.compute_checksum()
+        self.assertEqual(obj.metadata, expected_checksums.get_checksum_metadata_tag())
+        with open(file_path, 'rb') as fh:
+            self.assertEqual(obj.get()['Body'].read(), fh.read())
+
     @responses.activate
     def test_file_upload_with_target_filename_option(self):
         self.simulate_credentials_api(area_uuid=self.area.uuid)
@@ -204,23 +230,69 @@ class TestUploadAreaFileUpload(UploadTestCase):
     def test_s3_agent_setup_for_file_upload__for_a_single_file(self):
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
-        self.area._setup_s3_agent_for_file_upload(file_size_sum=1078, file_count=1)
+        batch = UploadBatch(file_size_sum=1078, file_count=1)
+
+        self.assertEqual(batch.file_count, 1)
+        self.assertEqual(batch.file_size_sum, 1078)
+        self.assertEqual(batch.file_upload_completed_count, 0)
+        self.assertEqual(batch.cumulative_bytes_transferred, 0)
+
+    @responses.activate
+    def test_s3_agent_and_credentials_are_reused(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        self.add_upload_mock(self.area.uuid, 'LICENSE')
+
+        self.area.upload_files(file_paths=["LICENSE"])
+        s3agent = self.area._get_s3_agent()
+        self.area.upload_files(file_paths=["LICENSE"], sync=False)
+        list(self.area.list())
+
+        self.assertIs(self.area._get_s3_agent(), s3agent)
+        credentials_calls = [call for call in responses.calls if call.request.url.endswith('/credentials')]
+        self.assertEqual(len(credentials_calls), 1)
+
+    @responses.activate
+    def test_deprecated_s3agent_shows_the_latest_upload(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        self.add_upload_mock(self.area.uuid, 'LICENSE')
+
+        with self.assertWarns(DeprecationWarning):
+            self.assertIsNone(self.area.s3agent)
+        batch = self.area.upload_files(file_paths=["LICENSE"])
+
+        with self.assertWarns(DeprecationWarning):
+            s3agent = self.area.s3agent
+        self.assertEqual(s3agent.file_upload_completed_count, batch.file_upload_completed_count)
+        self.assertIs(s3agent.failed_uploads, batch.failed_uploads)
+        self.assertIs(s3agent.target_s3, self.area._get_s3_agent().target_s3)
+        with self.assertRaises(AttributeError):
+            s3agent.failed_uploads = {}
+
+    @responses.activate
+    def test_upload_file_on_its_own(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        self.add_upload_mock(self.area.uuid, 'LICENSE')
+
+        with patch('hca.upload.lib.s3_agent.S3Agent.upload_local_file') as upload_local_file:
+            self.area._upload_file("LICENSE", "data", None, True, False, False)
 
-        self.assertEqual(self.area.s3agent.file_count, 1)
-        self.assertEqual(self.area.s3agent.file_size_sum, 1078)
-        self.assertEqual(self.area.s3agent.file_upload_completed_count, 0)
-        self.assertEqual(self.area.s3agent.cumulative_bytes_transferred, 0)
+        self.assertEqual(upload_local_file.call_args[1]['sync'], False)
+        with self.assertWarns(DeprecationWarning):
+            s3agent = self.area.s3agent
+        self.assertEqual(s3agent.file_count, 1)
+        self.assertEqual(s3agent.file_upload_completed_count, 1)
+        self.assertEqual(s3agent.failed_uploads, {})
 
     @responses.activate
     def test_s3_agent_setup_for_file_upload__for_multiple_files(self):
         self.simulate_credentials_api(area_uuid=self.area.uuid)
 
-        self.area._setup_s3_agent_for_file_upload(file_size_sum=2156, file_count=2)
+        batch = UploadBatch(file_size_sum=2156, file_count=2)
 
-        self.assertEqual(self.area.s3agent.file_count, 2)
-        self.assertEqual(self.area.s3agent.file_size_sum, 2156)
-        self.assertEqual(self.area.s3agent.file_upload_completed_count, 0)
-        self.assertEqual(self.area.s3agent.cumulative_bytes_transferred, 0)
+        self.assertEqual(batch.file_count, 2)
+        self.assertEqual(batch.file_size_sum, 2156)
+        self.assertEqual(batch.file_upload_completed_count, 0)
+        self.assertEqual(batch.cumulative_bytes_transferred, 0)
 
     @responses.activate
     def test_test_s3_agent_setup_for_file_upload__for_single_file__computes_stats_correctly(self):
@@ -228,11 +300,11 @@ class TestUploadAreaFileUpload(UploadTestCase):
         file_paths = ["LICENSE"]
         self.add_upload_mock(self.area.uuid, 'LICENSE')
 
-        self.area.upload_files(file_paths=file_paths, file_size_sum=1078)
+        batch = self.area.upload_files(file_paths=file_paths, file_size_sum=1078)
 
-        self.assertEqual(self.area.s3agent.file_count, 1)
-        self.assertEqual(self.area.s3agent.file_size_sum, 1078)
-        self.assertEqual(self.area.s3agent.file_upload_completed_count, 1)
+        self.assertEqual(batch.file_count, 1)
+        self.assertEqual(batch.file_size_sum, 1078)
+        self.assertEqual(batch.file_upload_completed_count, 1)
 
     @responses.activate
     def test_test_s3_agent_setup_for_file_upload__for_multiple_files__computes_stats_correctly(self):
@@ -240,27 +312,256 @@ class TestUploadAreaFileUpload(UploadTestCase):
         file_paths = ["LICENSE", "LICENSE"]
         self.add_upload_mock(self.area.uuid, 'LICENSE')
 
-        self.area.upload_files(file_paths=file_paths, file_size_sum=2156)
+        batch = self.area.upload_files(file_paths=file_paths, file_size_sum=2156)
 
-        self.assertEqual(self.area.s3agent.file_count, 2)
-        self.assertEqual(self.area.s3agent.file_size_sum, 2156)
-        self.assertEqual(self.area.s3agent.file_upload_completed_count, 2)
+        self.assertEqual(batch.file_count, 2)
+        self.assertEqual(batch.file_size_sum, 2156)
+        self.assertEqual(batch.file_upload_completed_count, 2)
+
+    @responses.activate
+    def test_concurrent_uploads_keep_their_own_progress_and_failures(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        self.add_upload_mock(self.area.uuid, 'LICENSE')
+        batches, errors = [], []
+
+        def upload(file_paths):
+            try:
+                batches.append(self.area.upload_files(file_paths=file_paths, sync=False))
+            except UploadException as e:
+                errors.append(e)
+
+        uploads = [threading.Thread(target=upload, args=(file_paths,))
+                   for file_paths in (["LICENSE"], ["LICENSE", "missing"])]
+        for thread in uploads:
+            thread.start()
+        for thread in uploads:
+            thread.join()
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual((batches[0].file_count, batches[0].file_upload_completed_count), (1, 1))
+        self.assertEqual(batches[0].failed_uploads, {})
+        self.assertEqual(len(errors), 1)
+        self.assertIn("missing", str(errors[0]))
+        self.assertNotIn("LICENSE", str(errors[0]))
 
     @responses.activate
     def test_s3_agent_should_write_to_terminal(self):
-        self.area._setup_s3_agent_for_file_upload(file_size_sum=2156, file_count=2)
-        below_threshold_bytes = WRITE_PERCENT_THRESHOLD / 100.0 * self.area.s3agent.file_size_sum / 2
-        above_threshold_bytes = WRITE_PERCENT_THRESHOLD / 100.0 * self.area.s3agent.file_size_sum * 2
-        self.assertEqual(self.area.s3agent.file_size_sum, 2156)
+        batch = UploadBatch(file_size_sum=2156, file_count=2)
+        below_threshold_bytes = WRITE_PERCENT_THRESHOLD / 100.0 * batch.file_size_sum / 2
+        above_threshold_bytes = WRITE_PERCENT_THRESHOLD / 100.0 * batch.file_size_sum * 2
+        self.assertEqual(batch.file_size_sum, 2156)
 
-        self.area.s3agent.cumulative_bytes_transferred = below_threshold_bytes
-        write_to_terminal = self.area.s3agent.should_write_to_terminal()
+        batch.cumulative_bytes_transferred = below_threshold_bytes
+        write_to_terminal = batch.should_write_to_terminal()
         self.assertEqual(write_to_terminal, False)
 
-        self.area.s3agent.cumulative_bytes_transferred = above_threshold_bytes
-        write_to_terminal = self.area.s3agent.should_write_to_terminal()
+        batch.cumulative_bytes_transferred = above_threshold_bytes
+        write_to_terminal = batch.should_write_to_terminal()
         self.assertEqual(write_to_terminal, True)
 
+    @responses.activate
+    def test_plan_sync(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        file_paths = {}
+        for name in ("unchanged", "changed", "unchecksummed", "resized", "new"):
+            file_paths[name] = os.path.join(tempdir.name, name)
+            with open(file_paths[name], "w") as fh:
+                fh.write("local")
+        for name in ("unchanged", "changed", "unchecksummed"):
+            self.upload_bucket.Object("{}/{}".format(self.area.uuid, name)).put(Body="local")
+        self.upload_bucket.Object("{}/resized".format(self.area.uuid)).put(Body="remote file")
+        checksum_handler = ClientSideChecksumHandler(file_paths["unchanged"])
+        checksum_handler.compute_checksum()
+        local_checksums = checksum_handler.get_checksum_metadata_tag()
+        files_info_url = 'https://upload.{stage}.data.humancellatlas.org/v1/area/{uuid}/files_info'.format(
+            stage=self.deployment_stage, uuid=self.area.uuid)
+        responses.add(responses.PUT, files_info_url, json=[
+            {'name': 'unchanged', 'checksums': local_checksums},
+            {'name': 'changed', 'checksums': {key: "0" for key in local_checksums}},
+            {'name': 'unchecksummed', 'checksums': {}}
+        ])
+
+        plan = self.area.plan_sync(list(file_paths.values()))
+
+        files_info_calls = [call for call in responses.calls if call.request.url == files_info_url]
+        self.assertEqual(len(files_info_calls), 1)
+        self.assertEqual(sorted(plan.to_upload), sorted(file_paths[name] for name in ("changed", "resized", "new")))
+        self.assertEqual(plan.to_check, [file_paths["unchecksummed"]])
+        self.assertEqual(plan.unchanged, [file_paths["unchanged"]])
+        self.assertIn("3 files to upload (15 B)", plan.report())
+
+    @responses.activate
+    def test_sync_notifies_unchanged_files(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        file_path = os.path.join(tempdir.name, "unchanged")
+        with open(file_path, "w") as fh:
+            fh.write("local")
+        self.upload_bucket.Object("{}/unchanged".format(self.area.uuid)).put(Body="local")
+        checksum_handler = ClientSideChecksumHandler(file_path)
+        checksum_handler.compute_checksum()
+        responses.add(responses.PUT, 'https://upload.{stage}.data.humancellatlas.org/v1/area/{uuid}/files_info'.format(
+            stage=self.deployment_stage, uuid=self.area.uuid),
+            json=[{'name': 'unchanged', 'checksums': checksum_handler.get_checksum_metadata_tag()}])
+        self.add_upload_mock(self.area.uuid, 'unchanged')
+
+        with patch('hca.upload.lib.s3_agent.S3Agent.upload_local_file') as upload_local_file:
+            batch = self.area.upload_files(file_paths=[file_path], sync=True)
+
+        upload_local_file.assert_not_called()
+        self.assertEqual((batch.file_count, batch.file_upload_completed_count), (1, 1))
+        notification_url = 'https://upload.test.data.humancellatlas.org/v1/area/{uuid}/unchanged'.format(
+            uuid=self.area.uuid)
+        self.assertEqual(len([call for call in responses.calls if call.request.url == notification_url]), 1)
+
+    @responses.activate
+    def test_plan_sync_of_files_with_the_same_name(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        file_paths = [os.path.join(tempdir.name, subdir, "same") for subdir in ("one", "two")]
+        for file_path in file_paths:
+            os.makedirs(os.path.dirname(file_path))
+            with open(file_path, "w") as fh:
+                fh.write("local")
+        self.upload_bucket.Object("{}/same".format(self.area.uuid)).put(Body="local")
+
+        plan = self.area.plan_sync(file_paths)
+
+        self.assertEqual(sorted(plan.to_upload), sorted(file_paths))
+        self.assertEqual(plan.collisions, {"same": file_paths})
+        self.assertIn("2 files would be uploaded as same", plan.report())
+
+    @responses.activate
+    def test_sync_planner_plans_in_windows_and_lists_large_areas_only_when_worth_it(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        file_paths = []
+        for name in ("a", "b", "c"):
+            file_paths.append(os.path.join(tempdir.name, name))
+            with open(file_paths[-1], "w") as fh:
+                fh.write("local")
+        for name in ("x", "y", "z"):
+            self.upload_bucket.Object("{}/{}".format(self.area.uuid, name)).put(Body="remote")
+        arrived = []
+
+        def arriving():
+            for file_path in file_paths:
+                arrived.append(file_path)
+                yield file_path, None
+
+        planner = SyncPlanner(self.area, self.area._get_s3_agent(), window=1)
+        with patch('hca.upload.lib.sync_planner.LISTING_PAGE_SIZE', 1):
+            plans = planner.iter_plans(arriving())
+            # Three pages of the area aren't listed for the first file, which is compared on its own instead
+            self.assertEqual(next(plans).to_check, file_paths[:1])
+            self.assertEqual(arrived, file_paths[:1])
+            self.assertEqual(next(plans).to_check, file_paths[1:2])
+            # By the third file, listing the area costs no more than comparing the files one by one
+            self.assertEqual(next(plans).to_upload, file_paths[2:])
+
+    def test_upload_batch_estimated_time_remaining(self):
+        batch = UploadBatch(file_size_sum=3000, file_count=2)
+        self.assertIsNone(batch.estimated_time_remaining())
+
+        batch.batch_started_at -= 10
+        batch.cumulative_bytes_transferred = 1000
+        self.assertAlmostEqual(batch.estimated_time_remaining(), 20, delta=1)
+
+    def test_upload_batch_estimated_time_remaining_covers_the_largest_file(self):
+        scheduler = UploadScheduler(window=None, small_file_size=1)
+        for file_path, file_size in (("big", 2000), ("a", 500), ("b", 500)):
+            scheduler.add(file_path, file_size)
+        scheduler.flush()
+        batch = UploadBatch(file_size_sum=4000, file_count=4, scheduler=scheduler, workers=4)
+        batch.batch_started_at -= 10
+        batch.cumulative_bytes_transferred = 1000
+        # The big file runs on one of the four workers, each transferring 25 bytes a second
+        self.assertAlmostEqual(batch.estimated_time_remaining(), 80, delta=1)
+
+        batch.file_completed("big")
+        self.assertAlmostEqual(batch.estimated_time_remaining(), 30, delta=1)
+
+    @responses.activate
+    def test_file_upload_of_small_files_in_batches(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        file_paths = [os.path.join(TEST_DIR, "res", "bundle", name) for name in ("assay.json", "sample.json")]
+        for file_path in file_paths:
+            self.add_upload_mock(self.area.uuid, os.path.basename(file_path))
+
+        with patch('hca.upload.upload_area.UploadArea._upload_files_in_turn',
+                   autospec=True, side_effect=UploadArea._upload_files_in_turn) as upload_files_in_turn:
+            self.area.upload_files(file_paths=file_paths)
+        upload_files_in_turn.assert_called_once()
+
+        for file_path in file_paths:
+            obj = self.upload_bucket.Object("{}/{}".format(self.area.uuid, os.path.basename(file_path)))
+            with open(file_path, 'rb') as fh:
+                self.assertEqual(obj.get()['Body'].read(), fh.read())
+
+    @responses.activate
+    def test_file_upload_from_walk_uses_its_sizes(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        walk_root = tempdir.name
+        file_names = ["a", "b"]
+        for file_name in file_names:
+            with open(os.path.join(walk_root, file_name), "w") as fh:
+                fh.write("contents of " + file_name)
+            self.add_upload_mock(self.area.uuid, file_name)
+
+        walk = FileWalk([walk_root])
+        with patch('os.path.getsize', wraps=os.path.getsize) as getsize:
+            batch = self.area.upload_files(file_paths=walk, sync=False)
+        self.assertFalse([call for call in getsize.call_args_list if call[0][0].startswith(walk_root)])
+
+        self.assertTrue(walk.sized.wait(5))
+        self.assertEqual(batch.file_upload_completed_count, len(file_names))
+        self.assertEqual(batch.file_size_sum, sum(os.path.getsize(os.path.join(walk_root, file_name))
+                                                  for file_name in file_names))
+
+    @responses.activate
+    def test_file_upload_reports_jobs_that_raise(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        file_path = os.path.join(TEST_DIR, "res", "bundle", "assay.json")
+
+        with patch('hca.upload.upload_area.UploadArea._upload_files_in_turn', side_effect=RuntimeError("lost")):
+            with self.assertRaises(UploadException) as context:
+                self.area.upload_files(file_paths=[file_path], sync=False)
+        self.assertIn("{}: [Exception] lost".format(file_path), str(context.exception))
+
+    @responses.activate
+    def test_file_upload_notifies_files_uploaded_before_finding_files_fails(self):
+        self.simulate_credentials_api(area_uuid=self.area.uuid)
+        file_path = os.path.join(TEST_DIR, "res", "bundle", "assay.json")
+        self.add_upload_mock(self.area.uuid, 'assay.json')
+        uploading = threading.Event()
+        original_upload_file = UploadArea._upload_file
+
+        def file_paths():
+            yield file_path
+            uploading.wait(5)
+            raise OSError("lost the file system")
+
+        def upload_file(*args, **kwargs):
+            uploading.set()
+            time.sleep(0.5)
+            return original_upload_file(*args, **kwargs)
+
+        # The file is started on its own, before the walk fails
+        scheduler = functools.partial(UploadScheduler, first_window=1)
+        with patch('hca.upload.lib.upload_scheduler.UploadScheduler', scheduler), \
+                patch('hca.upload.upload_area.UploadArea._upload_file', autospec=True, side_effect=upload_file):
+            with self.assertRaises(OSError):
+                self.area.upload_files(file_paths=file_paths(), sync=False)
+        notified = [call.request.url for call in responses.calls if call.request.url.endswith('/assay.json')]
+        self.assertEqual(len(notified), 1)
+
     @responses.activate
     def test_determine_s3_file_content_type(self):
         content_type_one = self.area._determine_s3_file_content_type("s3://bucket/file.json")
@@ -46,3 +46,4 @@ class TestUploadService(UploadTestCase):
 
         self.assertIsInstance(area, UploadArea)
         self.assertEqual(area_uuid, area.uuid)
+        self.assertIs(upload.upload_area(UploadAreaURI(self._make_area_uri(area_uuid=area_uuid))), area)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+import hca.cli
+
+
+class TestLazyParser(unittest.TestCase):
+    def test_get_command_path(self):
+        self.assertEqual(hca.cli.get_command_path([]), [])
+        self.assertEqual(hca.cli.get_command_path(["dss", "--help"]), ["dss"])
+        self.assertEqual(hca.cli.get_command_path(["dss", "get-file", "--uuid", "x"]), ["dss", "get-file"])
+        self.assertEqual(hca.cli.get_command_path(["--log-level", "DEBUG", "upload", "list"]), ["upload", "list"])
+        self.assertEqual(hca.cli.get_command_path(["--log", "DEBUG", "upload", "list"]), ["upload", "list"])
+        self.assertEqual(hca.cli.get_command_path(["--log-level=DEBUG", "dss", "get-file"]), ["dss", "get-file"])
+        self.assertEqual(hca.cli.get_command_path(["--log-level", "NOPE", "dss", "get-file"]), [])
+
+    def test_only_invoked_group_is_built(self):
+        with mock.patch("hca.dss.cli.add_commands") as dss_add_commands, \
+                mock.patch("hca.auth.cli.add_commands") as auth_add_commands:
+            parser = hca.cli.get_parser(command_path=["upload", "list"])
+            dss_add_commands.assert_not_called()
+            auth_add_commands.assert_not_called()
+            args = parser.parse_args(["upload", "list"])
+            self.assertEqual(args.entry_point.__name__, "ListAreaCommand")
+
+    def test_placeholder_groups_are_listed(self):
+        with mock.patch("hca.dss.cli.add_commands"):
+            help_text = hca.cli.get_parser(command_path=["auth"]).format_help()
+        for group_name in hca.cli.command_group_help:
+            self.assertIn(group_name, help_text)
+
+
+class TestStartupImports(unittest.TestCase):
+    def test_heavy_dependencies_not_imported_at_startup(self):
+        code = "import sys, hca.cli; print(' '.join(sorted(sys.modules)))"
+        modules = subprocess.check_output([sys.executable, "-c", code], cwd=pkg_root).decode().split()
+        for module in "hca.dss", "hca.upload", "hca.auth", "boto3", "botocore", "docutils", "requests", "jwt":
+            self.assertNotIn(module, modules)
+
+    def test_upload_cli_not_imported_for_other_commands(self):
+        parser = mock.Mock()
+        parser.parse_args.return_value = mock.Mock(log_level="ERROR", entry_point=lambda args: {"a": 1})
+        with mock.patch("hca.cli.get_parser", return_value=parser), \
+                mock.patch("hca.cli.upload_cli", new=mock.NonCallableMock(spec=[])), \
+                mock.patch("hca.cli.print") as print_:
+            hca.cli.main(["dss", "get-file"])
+        print_.assert_called_once_with('{\n  "a": 1\n}')
+
+    def test_lazy_module_attribute_access(self):
+        import hca
+        self.assertEqual(hca.upload.UploadException.__module__, "hca.upload.exceptions")
+        self.assertIs(hca.upload, sys.modules["hca.upload"])
+
+    def test_summarize_import_times(self):
+        lines = ["import time: self [us] | cumulative | imported package",
+                 "import time:       100 |        100 |   botocore.utils",
+                 "import time:       200 |        300 | botocore",
+                 "import time:      1500 |       1500 | docutils"]
+        self.assertEqual(hca.cli._summarize_import_times(lines),
+                         [("docutils", 0.0015, 1), ("botocore", 0.0003, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,8 @@
 import errno
 import hashlib
+import importlib
+import io
+import json
 import logging
 import os
 import random
@@ -9,9 +12,19 @@ import time
 import unittest
 import uuid
 
-from mock import patch
+import requests
+from atomicwrites import AtomicWriter
+from mock import Mock, patch
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+from hca.util import tsv
 from hca.util.compat import walk
-from hca.dss import DSSClient, ManifestDownloadContext, TaskRunner
+from hca.dss import DSSClient, DSSFile, DownloadContext, ManifestDownloadContext, TaskRunner
+from hca.dss.adaptive_concurrency import AdaptiveConcurrency
+from hca.dss.bundle_manifest_cache import BundleManifestCache
+from hca.dss.download_journal import DownloadJournal
+from hca.dss.upload_to_cloud import _ByteBudget, upload_to_cloud
+from hca.util.exceptions import SwaggerAPIException
+from hca.util.fs_walk import FileWalk
 from test.unit import TmpDirTestCase
 
 logging.basicConfig()
@@ -183,8 +196,11 @@ class DSSClientTestCase(TmpDirTestCase):
         self.assertEqual(output_manifest, expected_manifest)
 
     def _assert_manifest_not_updated(self):
-        for row in ManifestDownloadContext._parse_manifest(self.manifest_file):
-            self.assertNotIn('file_path', row)
+        with open(self.manifest_file) as f:
+            reader = tsv.DictReader(f)
+            self.assertNotIn('file_path', reader.fieldnames)
+            for row in reader:
+                self.assertNotIn('file_path', row)
 
 
 class TestManifestDownloadFilestore(DSSClientTestCase):
@@ -213,6 +229,26 @@ class TestManifestDownloadFilestore(DSSClientTestCase):
         self._assert_all_files_downloaded()
         self._assert_manifest_updated_with_paths('')
 
+    @patch('logging.Logger.warning')
+    def test_manifest_closed_before_it_is_replaced(self, _):
+        # Windows can't replace a file that is open, and the manifest is rewritten in place here
+        opened = []
+
+        def open_(*args, **kwargs):
+            opened.append(io.open(*args, **kwargs))
+            return opened[-1]
+
+        def commit(atomic_writer, f):
+            self.assertTrue(opened)
+            self.assertTrue(all(fh.closed for fh in opened))
+            self.assertTrue(f.closed)
+            commit_(atomic_writer, f)
+
+        commit_ = AtomicWriter.commit
+        with patch('hca.dss.open', new=open_), patch('hca.dss.AtomicWriter.commit', new=commit):
+            self._mock_download_manifest(self.manifest_file, 'aws', layout='none')
+        self._assert_manifest_updated_with_paths('')
+
     def _test_download_dir(self, download_dir):
         download_func = self._mock_download_manifest(self.manifest_file, 'aws', layout='none', download_dir=download_dir)
         self.assertEqual(download_func.call_count, len(self.manifest) - 1)
@@ -282,6 +318,7 @@ class TestManifestDownloadFilestore(DSSClientTestCase):
         self._mock_download_manifest(self.manifest_file, 'aws', layout='none')
         files_expected = {
             os.path.join('.', 'manifest.tsv'),
+            os.path.join('.', '.hca', 'v2', 'journal.jsonl'),
             os.path.join('.', self.version_dir, 'fa', 'keha', 'fakehash')
         }
         self.assertEqual(self._files_present(), files_expected)
@@ -364,6 +401,19 @@ class TestManifestDownloadBundle(DSSClientTestCase):
         _touch_file(os.path.join(manifest_directory, self.manifest[1][3]))
         self.assertRaises(RuntimeError, self._mock_download_manifest, self.manifest_file, 'aws', layout='bundle')
 
+    def test_manifest_download_bundle_split(self):
+        """
+        A bundle whose rows aren't adjacent in the manifest gets its metadata and bundle.json downloaded only once.
+        """
+        self._write_manifest(self.manifest + [self.manifest[1][:3] + ('d_file_name',) + self.manifest[1][4:]])
+        with patch('hca.dss.DownloadContext.download_bundle') as download_bundle:
+            self.dss.download_manifest(self.manifest_file, 'aws', layout='bundle')
+        calls = [(c[1]['data_filter'], c[1]['metadata_filter'], c[1]['bundle_manifest'])
+                 for c in download_bundle.call_args_list if c[0][0] == 'a_uuid']
+        self.assertEqual(sorted(calls), [(('a_file_name',), ('*',), True), (('d_file_name',), ('',), False)])
+        with open(self.manifest_file) as f:
+            self.assertEqual(len([row['file_path'] for row in tsv.DictReader(f)]), 4)
+
     @patch('hca.dss.DSSClient.get_bundle')
     def test_manifest_download_bundle_parallel(self, mock_get_bundle):
         """
@@ -559,6 +609,593 @@ class TestDownload(DSSClientTestCase):
                                                  replica='aws', download_dir=t)
             self.assertIn("download failure", e.exception.args[0])
 
+    def test_collection_download_failure_discards_manifest(self):
+        test_cols = self._generate_col_hierarchy(2)
+        test_cols[-1]['contents'][0] = {'type': 'file', 'uuid': 'foo', 'version': 'bar'}
+        manifest_paths = []
+        named_temporary_file = tempfile.NamedTemporaryFile
+
+        def create_manifest(*args, **kwargs):
+            manifest = named_temporary_file(*args, **kwargs)
+            manifest_paths.append(manifest.name)
+            return manifest
+
+        with patch('hca.dss.DSSClient.get_collection', new=self._fake_get_collection(test_cols)), \
+                patch('tempfile.NamedTemporaryFile', side_effect=create_manifest), \
+                patch('hca.dss.DSSClient.download_manifest') as download_manifest:
+            with self.assertRaisesRegex(RuntimeError, "download failure"):
+                self.dss.download_collection(uuid=test_cols[0]['uuid'], replica='aws', download_dir=self.tmp_dir)
+        download_manifest.assert_not_called()
+        self.assertEqual(len(manifest_paths), 1)
+        self.assertFalse(os.path.exists(manifest_paths[0]))
+
+    @patch('hca.dss.DSSClient.get_bundle')
+    def test_collection_serialized_breadth_first(self, mock_get_bundle):
+        """
+        Collections in a wide, nested collection are each expanded once, and bundles are listed once for each
+        collection they are in.
+        """
+        mock_get_bundle.paginate = Mock(side_effect=_make_fake_paginate())
+        version = '2018-09-17T161441.564206Z'
+        bundles = [{'type': 'bundle', 'uuid': str(uuid.uuid4()), 'version': version} for _ in range(50)]
+        children = [{'uuid': str(uuid.uuid4()), 'version': version, 'contents': bundles[i::5]} for i in range(5)]
+        root = {'uuid': str(uuid.uuid4()), 'version': version,
+                'contents': [dict(type='collection', uuid=c['uuid'], version=version) for c in children] +
+                            [dict(type='collection', uuid=children[0]['uuid'], version=version)] + bundles[:10]}
+        with patch('hca.dss.DSSClient.get_collection', new=self._fake_get_collection([root] + children)):
+            rows = self.dss._serialize_col_to_manifest(root['uuid'], 'aws', version, self.tmp_dir,
+                                                       manifest_cache=False)
+            self.assertFalse(isinstance(rows, list))
+            rows = list(rows)
+        # The first ten bundles are in the root collection as well as in one of its children
+        self.assertEqual(mock_get_bundle.paginate.call_count, len(bundles) + 10)
+        self.assertEqual(len(rows), 4 * (len(bundles) + 10))
+        self.assertEqual({row['bundle_uuid'] for row in rows}, {b['uuid'] for b in bundles})
+
+
+class TestUpload(TmpDirTestCase):
+
+    file_names = ['a_file_name', 'b_file_name', 'c_file_name']
+
+    def setUp(self):
+        super().setUp()
+        self.dss = DSSClient()
+        os.mkdir('src')
+        for name in self.file_names:
+            _touch_file(os.path.join('src', name))
+
+    @staticmethod
+    def _response(status_code):
+        return Mock(status_code=status_code, headers={})
+
+    @staticmethod
+    def _not_found():
+        return SwaggerAPIException(response=Mock(status_code=404, reason='Not Found', content=b''))
+
+    def _upload(self, put_file_responses, head_file_side_effect):
+        file_paths = [os.path.join(self.tmp_dir, 'src', name) for name in self.file_names]
+        file_uuids = [name[0] + '_uuid' for name in self.file_names]
+        keys = [file_uuid + '/' + name for file_uuid, name in zip(file_uuids, self.file_names)]
+        with patch('hca.dss.upload_to_cloud', return_value=(file_uuids, keys, file_paths)), \
+                patch('hca.dss.DSSClient.put_file') as mock_put_file, \
+                patch('hca.dss.DSSClient.head_file', side_effect=head_file_side_effect) as mock_head_file, \
+                patch('hca.dss.DSSClient.put_bundle', return_value={'version': 'a_version'}) as mock_put_bundle, \
+                patch('time.sleep'):
+            mock_put_file._request.side_effect = lambda req_args: put_file_responses[req_args['uuid']]
+            try:
+                result = self.dss.upload(os.path.join(self.tmp_dir, 'src'), 'aws', 'a_bucket', bundle_uuid='b')
+            except RuntimeError as e:
+                result = e
+        return result, mock_head_file, mock_put_bundle
+
+    def test_upload_async_copies(self):
+        """Files copied asynchronously are polled together and the bundle is created once all are present"""
+        attempts = {'a_uuid': 0, 'c_uuid': 0}
+
+        def head_file(uuid, replica, version):
+            attempts[uuid] += 1
+            if attempts[uuid] < 3:
+                raise self._not_found()
+
+        responses = {'a_uuid': self._response(202), 'b_uuid': self._response(201), 'c_uuid': self._response(202)}
+        result, mock_head_file, mock_put_bundle = self._upload(responses, head_file)
+        self.assertEqual(attempts, {'a_uuid': 3, 'c_uuid': 3})
+        self.assertEqual(mock_head_file.call_count, 6)
+        mock_put_bundle.assert_called_once()
+        self.assertEqual([f['name'] for f in mock_put_bundle.call_args[1]['files']], self.file_names)
+        self.assertEqual([f['uuid'] for f in result['files']], ['a_uuid', 'b_uuid', 'c_uuid'])
+
+    def test_upload_failures_reported_per_file(self):
+        def head_file(uuid, replica, version):
+            raise SwaggerAPIException(response=Mock(status_code=500, reason='Internal Server Error', content=b''))
+
+        responses = {'a_uuid': self._response(202), 'b_uuid': self._response(201), 'c_uuid': self._response(202)}
+        with patch('logging.Logger.error') as error_log:
+            result, _, mock_put_bundle = self._upload(responses, head_file)
+        self.assertIsInstance(result, RuntimeError)
+        self.assertIn('2 of 3 file(s) failed to register: a_file_name, c_file_name', result.args[0])
+        self.assertEqual(error_log.call_count, 2)
+        mock_put_bundle.assert_not_called()
+
+
+class TestUploadToCloud(TmpDirTestCase):
+
+    def test_byte_budget_blocks_until_released(self):
+        budget = _ByteBudget(100)
+        self.assertEqual(budget.acquire(60), 60)
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: acquired.set() if budget.acquire(60) else None)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        budget.release(60)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_oversize_file_admitted_alone(self):
+        budget = _ByteBudget(100)
+        # A file larger than the budget only reserves the whole budget, and only once nothing else is in flight
+        self.assertEqual(budget.acquire(500), 100)
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: acquired.set() if budget.acquire(1) else None)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        budget.release(100)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_staging_stops_after_first_failure(self):
+        file_paths = []
+        for i in range(5):
+            file_paths.append(os.path.join(self.tmp_dir, str(i)))
+            with open(file_paths[-1], 'wb') as fh:
+                fh.write(b'x' * 10)
+        staged = []
+
+        def stage_file(s3_client, staging_bucket, file_path, callback):
+            staged.append(file_path)
+            raise RuntimeError('Staging failed')
+
+        # hca.dss.upload_to_cloud is shadowed by the function of the same name
+        module = importlib.import_module('hca.dss.upload_to_cloud')
+        with patch.object(module, 'boto3'), patch.object(module, '_stage_file', new=stage_file):
+            # Each file takes up the whole budget, so each is only submitted once the one before it has finished
+            with self.assertRaisesRegex(RuntimeError, 'Staging failed'):
+                upload_to_cloud(file_paths, 'a_bucket', 'aws', threads=2, max_inflight_bytes=1)
+        self.assertEqual(staged, file_paths[:1])
+
+    def test_files_from_a_walk_are_not_stat_again(self):
+        for i in range(3):
+            with open(os.path.join(self.tmp_dir, str(i)), 'wb') as fh:
+                fh.write(b'x' * (i + 1))
+        reserved = []
+
+        class ByteBudget(_ByteBudget):
+            def acquire(self, size):
+                reserved.append(size)
+                return super(ByteBudget, self).acquire(size)
+
+        def stage_file(s3_client, staging_bucket, file_path, callback):
+            return 'a_uuid', os.path.basename(file_path), file_path
+
+        module = importlib.import_module('hca.dss.upload_to_cloud')
+        with patch.object(module, 'boto3'), patch.object(module, '_stage_file', new=stage_file), \
+                patch.object(module, '_ByteBudget', new=ByteBudget), \
+                patch('os.path.getsize') as getsize:
+            _, key_names, _ = upload_to_cloud(FileWalk([self.tmp_dir]), 'a_bucket', 'aws')
+        getsize.assert_not_called()
+        self.assertEqual(sorted(zip(key_names, reserved)), [('0', 1), ('1', 2), ('2', 3)])
+
+    def test_keys_from_cloud_are_used_as_listed(self):
+        listed = []
+
+        def list_objects(s3_client, bucket, prefix):
+            self.assertEqual((bucket, prefix), ('a_bucket', 'a/dir/'))
+            for key in ['a/dir/', 'a/dir/c', 'a/dir/a', 'a/dir/b']:
+                listed.append(key)
+                yield {'Key': key}
+
+        module = importlib.import_module('hca.dss.upload_to_cloud')
+        with patch.object(module, 'list_objects', new=list_objects):
+            copied = module._copy_from_s3('s3://a_bucket/a/dir/', Mock())
+            # Keys are handed over as soon as they are listed
+            self.assertEqual(next(copied)[1], 'a/dir/c')
+            self.assertEqual(listed, ['a/dir/', 'a/dir/c'])
+            with patch.object(module, 'boto3'):
+                file_uuids, key_names, _ = upload_to_cloud(['s3://a_bucket/a/dir/'], 'a_bucket', 'aws',
+                                                           from_cloud=True)
+        self.assertEqual(key_names, ['a/dir/a', 'a/dir/b', 'a/dir/c'])
+        self.assertEqual(len(set(file_uuids)), 3)
+
+
+class TestSegmentedDownload(TmpDirTestCase):
+
+    content = os.urandom(1000)
+
+    def setUp(self):
+        super().setUp()
+        self.dss_file = DSSFile(name='a_file_name', uuid='a_uuid', version='1_version',
+                                sha256=hashlib.sha256(self.content).hexdigest(), size=str(len(self.content)),
+                                indexed=False, replica='aws')
+        self.requests = []
+        self.failures = {}
+
+    @staticmethod
+    def _response(status_code, content, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        response.raw = io.BytesIO(content)
+        return response
+
+    def _get_file(self, req_args, stream, headers):
+        start, end = (int(x) for x in headers['Range'][len('bytes='):].split('-'))
+        self.requests.append((start, end))
+        if self.failures.get(start):
+            self.failures[start] -= 1
+            raise ConnectionError()
+        return self._response(206, self.content[start:end + 1],
+                              {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(self.content))})
+
+    def _download(self, get_file, num_retries=2, connections_per_file=4):
+        context = DownloadContext(download_dir='', dss_client=Mock(), replica='aws', num_retries=num_retries,
+                                  min_delay_seconds=0, segmented_download_threshold=100,
+                                  connections_per_file=connections_per_file)
+        context.dss_client.get_file._request.side_effect = get_file
+        with patch.object(DownloadContext, 'SEGMENT_SIZE', 100):
+            context._download_file(self.dss_file, 'a_file')
+        with open('a_file', 'rb') as fh:
+            return fh.read()
+
+    def test_segmented_download(self):
+        self.assertEqual(self._download(self._get_file), self.content)
+        self.assertEqual(sorted(self.requests), [(start, start + 99) for start in range(0, 1000, 100)])
+
+    def test_segmented_download_without_positional_io(self):
+        # Windows has neither os.pread nor os.pwrite
+        pread, pwrite = os.pread, os.pwrite
+        del os.pread, os.pwrite
+        try:
+            self.assertEqual(self._download(self._get_file), self.content)
+        finally:
+            os.pread, os.pwrite = pread, pwrite
+        self.assertEqual(sorted(self.requests), [(start, start + 99) for start in range(0, 1000, 100)])
+
+    def test_segment_size_bounded_by_connections(self):
+        self.content = self.content[:200]
+        self.dss_file = self.dss_file._replace(sha256=hashlib.sha256(self.content).hexdigest(), size=200)
+        self.assertEqual(self._download(self._get_file), self.content)
+        self.assertEqual(sorted(self.requests), [(0, 49), (50, 99), (100, 149), (150, 199)])
+
+    def test_segmented_download_retries(self):
+        self.failures = {100: 1, 500: 1}
+        self.assertEqual(self._download(self._get_file), self.content)
+        self.assertEqual(len(self.requests), 12)
+
+    def test_segmented_download_retry_quota_exhausted(self):
+        self.failures = {500: 1}
+        with self.assertRaises(ConnectionError):
+            self._download(self._get_file, num_retries=0)
+        self.assertFalse(os.path.exists('a_file'))
+
+    def _throttling_get_file(self, req_args, stream, headers):
+        start = int(headers['Range'][len('bytes='):].split('-')[0])
+        if self.failures.get(start):
+            self.failures[start] -= 1
+            raise SwaggerAPIException(response=self._response(429, b''))
+        return self._get_file(req_args, stream, headers)
+
+    def test_throttled_requests_retried_with_adaptive_concurrency(self):
+        self.failures = {300: 1}
+        context = DownloadContext(download_dir='', dss_client=Mock(), replica='aws', num_retries=2,
+                                  min_delay_seconds=0, segmented_download_threshold=100, adaptive_concurrency=True)
+        context.dss_client.get_file._request.side_effect = self._throttling_get_file
+        with patch.object(DownloadContext, 'SEGMENT_SIZE', 100):
+            context._download_file(self.dss_file, 'a_file')
+        with open('a_file', 'rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertEqual(context.concurrency.limit, AdaptiveConcurrency.DEFAULT_INITIAL // 2)
+        self.assertEqual(context.concurrency.total_bytes, len(self.content))
+
+    def test_throttled_requests_not_retried_by_default(self):
+        self.failures = {300: 1}
+        with self.assertRaises(SwaggerAPIException):
+            self._download(self._throttling_get_file)
+
+    def test_range_not_supported(self):
+        def get_file(req_args, stream, headers):
+            self.requests.append(headers['Range'])
+            return self._response(200, self.content)
+
+        self.assertEqual(self._download(get_file), self.content)
+        self.assertEqual(self.requests[-1], 'bytes=0-')
+
+    def test_checksum_mismatch(self):
+        self.dss_file = self.dss_file._replace(sha256='0' * 64)
+        with self.assertRaises(ValueError):
+            self._download(self._get_file)
+        self.assertFalse(os.path.exists('a_file'))
+
+
+class _InterruptedStream(io.BytesIO):
+    """A response body that fails after the given number of bytes"""
+    def __init__(self, content, fail_after):
+        super().__init__(content)
+        self.fail_after = fail_after
+
+    def read(self, size=-1):
+        if self.tell() >= self.fail_after:
+            raise ChunkedEncodingError()
+        return super().read(min(size, self.fail_after - self.tell()))
+
+
+class TestDownloadJournal(TmpDirTestCase):
+
+    content = os.urandom(1000)
+
+    def setUp(self):
+        super().setUp()
+        self.dss_file = DSSFile(name='a_file_name', uuid='a_uuid', version='1_version',
+                                sha256=hashlib.sha256(self.content).hexdigest(), size=len(self.content),
+                                indexed=False, replica='aws')
+        self.ranges = []
+        self.fail_after = None
+
+    def _get_file(self, req_args, stream, headers):
+        start, _, end = headers['Range'][len('bytes='):].partition('-')
+        start, end = int(start), int(end or len(self.content) - 1)
+        self.ranges.append((start, end))
+        response = requests.Response()
+        response.status_code = 206
+        response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(self.content))
+        if self.fail_after is not None and start <= self.fail_after <= end:
+            response.raw = _InterruptedStream(self.content[start:end + 1], self.fail_after - start)
+        else:
+            response.raw = io.BytesIO(self.content[start:end + 1])
+        return response
+
+    def _download(self, **kwargs):
+        context = DownloadContext(download_dir='', dss_client=Mock(), replica='aws', num_retries=0,
+                                  min_delay_seconds=0, segmented_download_threshold=100, **kwargs)
+        context.dss_client.get_file._request.side_effect = self._get_file
+        with patch.object(DownloadContext, 'SEGMENT_SIZE', 100):
+            return context._download_to_filestore(self.dss_file)
+
+    def _test_resume(self, connections_per_file):
+        self.fail_after = 500
+        with self.assertRaises(ChunkedEncodingError):
+            self._download(connections_per_file=connections_per_file)
+        journal = DownloadJournal(os.path.join('.hca', 'v2'))
+        key = os.path.join('files_2_4', self.dss_file.sha256[:2], self.dss_file.sha256[2:6], self.dss_file.sha256)
+        partial_path, offset = journal.claim_partial(key)
+        self.assertEqual(offset, 500)
+        self.assertEqual(os.path.getsize(partial_path) >= 500, True)
+
+        self.fail_after = None
+        self.ranges = []
+        dest_path = self._download(connections_per_file=connections_per_file)
+        self.assertEqual(min(start for start, _ in self.ranges), 500)
+        with open(dest_path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertFalse(os.path.exists(partial_path))
+        self.assertTrue(DownloadJournal(os.path.join('.hca', 'v2')).is_complete(key))
+
+    def test_resume_download(self):
+        self._test_resume(connections_per_file=1)
+
+    def test_resume_segmented_download(self):
+        self._test_resume(connections_per_file=4)
+
+    def test_download_without_hard_links(self):
+        # NFS may refuse hard links (#519)
+        with patch('os.link', side_effect=PermissionError(errno.EPERM, 'Operation not permitted')):
+            dest_path = self._download()
+        with open(dest_path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertEqual(os.listdir(os.path.dirname(dest_path)), [os.path.basename(dest_path)])
+
+    def test_completed_files_skipped(self):
+        dest_path = self._download()
+        os.unlink(dest_path)
+        with patch('os.path.exists') as exists:
+            self.assertEqual(self._download(), dest_path)
+        exists.assert_not_called()
+        self.assertEqual(len(self.ranges), 10)
+
+    def test_completed_files_missing_from_filestore_downloaded_again_when_linked(self):
+        dest_path = self._download()
+        os.unlink(dest_path)
+        context = DownloadContext(download_dir='', dss_client=Mock(), replica='aws', num_retries=0,
+                                  min_delay_seconds=0, segmented_download_threshold=100)
+        context.dss_client.get_file._request.side_effect = self._get_file
+        file_path = os.path.join('a_bundle', self.dss_file.name)
+        with patch.object(DownloadContext, 'SEGMENT_SIZE', 100):
+            context._download_and_link_to_filestore(self.dss_file, file_path)
+        self.assertEqual(len(self.ranges), 20)
+        with open(file_path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_journal_compaction(self):
+        journal = DownloadJournal('.')
+        journal.checkpoint('a', 'a.partial', 10)
+        journal.checkpoint('a', 'a.partial', 20)
+        journal.complete('a')
+        journal.checkpoint('b', 'b.partial', 10)
+        journal.checkpoint('c', 'c.partial', 10)
+        journal.discard('c')
+        with open('journal.jsonl', 'a') as fh:
+            fh.write('{"key": "d", "compl')
+        journal = DownloadJournal('.')
+        self.assertTrue(journal.is_complete('a'))
+        self.assertEqual(journal.claim_partial('b'), ('b.partial', 10))
+        self.assertIsNone(journal.claim_partial('b'))
+        self.assertIsNone(journal.claim_partial('c'))
+        with open('journal.jsonl') as fh:
+            self.assertEqual(len(fh.readlines()), 2)
+
+
+class TestTaskRunner(unittest.TestCase):
+
+    def test_submission_blocks_when_queue_full(self):
+        running = []
+        max_seen = []
+        lock = threading.Lock()
+
+        def task():
+            with lock:
+                running.append(1)
+                max_seen.append(len(running))
+            time.sleep(0.001)
+            with lock:
+                running.pop()
+
+        with TaskRunner(threads=2, max_pending=3) as runner:
+            for i in range(50):
+                runner.submit(i, task)
+                self.assertLessEqual(runner._pending, 3)
+        self.assertEqual(len(max_seen), 50)
+        self.assertEqual(runner._pending, 0)
+
+    def test_nested_submission(self):
+        done = []
+
+        def parent(i):
+            for j in range(5):
+                runner.submit((i, j), done.append, (i, j))
+
+        with TaskRunner(threads=1, max_pending=1) as runner:
+            for i in range(3):
+                runner.submit(i, parent, i)
+        self.assertEqual(sorted(done), [(i, j) for i in range(3) for j in range(5)])
+
+    def test_errors_counted(self):
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(RuntimeError) as e:
+            with TaskRunner(threads=2) as runner:
+                for i in range(3):
+                    runner.submit(i, fail)
+                runner.submit(3, lambda: None)
+        self.assertEqual(e.exception.args[0], '3 download task(s) failed.')
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.concurrency = AdaptiveConcurrency(initial=4, maximum=20, clock=lambda: self.now)
+
+    def _saturated_interval(self, latency=0.1):
+        slots = [self.concurrency.slot() for _ in range(self.concurrency.limit)]
+        for slot in slots:
+            slot.__enter__()
+        self.concurrency.record_latency(latency)
+        self.now += AdaptiveConcurrency.INTERVAL
+        self.concurrency.record_bytes(1000)
+        for slot in slots:
+            slot.__exit__(None, None, None)
+
+    def test_slow_start_then_additive_increase(self):
+        self._saturated_interval()
+        self.assertEqual(self.concurrency.limit, 8)
+        self._saturated_interval()
+        self.assertEqual(self.concurrency.limit, 16)
+        self.concurrency.record_failure()
+        self.assertEqual(self.concurrency.limit, 8)
+        self.now += AdaptiveConcurrency.INTERVAL
+        self.concurrency.record_bytes(0)
+        self._saturated_interval()
+        self.assertEqual(self.concurrency.limit, 9)
+        self.assertEqual(self.concurrency.metrics(),
+                         dict(concurrency=9, in_flight=0, bytes_per_second=1000 / AdaptiveConcurrency.INTERVAL))
+
+    def test_no_increase_unless_saturated(self):
+        self.now += AdaptiveConcurrency.INTERVAL
+        self.concurrency.record_bytes(1000)
+        self.assertEqual(self.concurrency.limit, 4)
+
+    def test_decrease_at_most_once_per_interval(self):
+        self.concurrency.record_failure()
+        self.concurrency.record_failure()
+        self.assertEqual(self.concurrency.limit, 2)
+        self.now += AdaptiveConcurrency.INTERVAL
+        self.concurrency.record_failure()
+        self.assertEqual(self.concurrency.limit, 1)
+        self.now += AdaptiveConcurrency.INTERVAL
+        self.concurrency.record_failure()
+        self.assertEqual(self.concurrency.limit, 1)
+
+    def test_decrease_on_latency_increase(self):
+        self._saturated_interval(latency=0.1)
+        self.assertEqual(self.concurrency.limit, 8)
+        self._saturated_interval(latency=1.0)
+        self.assertEqual(self.concurrency.limit, 4)
+
+    def test_slots_limited(self):
+        self.concurrency.limit = 1
+        entered = threading.Event()
+
+        def use_slot():
+            with self.concurrency.slot():
+                entered.set()
+
+        with self.concurrency.slot():
+            thread = threading.Thread(target=use_slot)
+            thread.start()
+            self.assertFalse(entered.wait(0.05))
+        thread.join()
+        self.assertTrue(entered.is_set())
+
+
+class TestBundleManifestCache(TmpDirTestCase):
+
+    def _get_manifest(self, version, **kwargs):
+        context = DownloadContext(download_dir='', dss_client=Mock(), replica='aws', num_retries=0,
+                                  min_delay_seconds=0, **kwargs)
+        context.dss_client.get_bundle.paginate.side_effect = _make_fake_paginate()
+        manifest = context._get_full_bundle_manifest('a_uuid', version)
+        return manifest, context.dss_client.get_bundle.paginate.call_count
+
+    def test_cached_manifest_reused(self):
+        manifest, calls = self._get_manifest('1_version')
+        self.assertEqual(calls, 1)
+        self.assertEqual(self._get_manifest('1_version'), (manifest, 0))
+        self.assertTrue(os.path.isfile(os.path.join('.hca', 'v2', 'bundles', 'a_uuid.1_version.json')))
+
+    def test_latest_version_not_served_from_cache(self):
+        self._get_manifest('')
+        self.assertEqual(self._get_manifest('')[1], 1)
+        # ... but the manifest is cached under the version it resolved to
+        self.assertEqual(self._get_manifest('1_version')[1], 0)
+
+    def test_opt_out(self):
+        self._get_manifest('1_version', manifest_cache=False)
+        self.assertFalse(os.path.exists(os.path.join('.hca', 'v2', 'bundles')))
+        self._get_manifest('1_version')
+        self.assertEqual(self._get_manifest('1_version', manifest_cache=False)[1], 1)
+
+    def test_eviction(self):
+        manifest = {'bundle': {'version': 'v', 'files': [{'name': 'x' * 100}]}}
+        max_size = 3 * len(json.dumps(manifest, sort_keys=True))
+        cache = BundleManifestCache('.', max_size=max_size)
+        for i, bundle_uuid in enumerate(['a', 'b', 'c']):
+            cache.put(bundle_uuid, 'v', manifest)
+            os.utime(os.path.join('bundles', bundle_uuid + '.v.json'), (i, i))
+        self.assertEqual(cache.get('a', 'v'), manifest)  # now the most recently used
+        cache.put('d', 'v', manifest)
+        # Manifests are evicted down to the low water mark, which leaves room for two
+        cache = BundleManifestCache('.', max_size=max_size)
+        for bundle_uuid in 'b', 'c':
+            self.assertIsNone(cache.get(bundle_uuid, 'v'))
+        for bundle_uuid in 'a', 'd':
+            self.assertEqual(cache.get(bundle_uuid, 'v'), manifest)
+        # ... so the next manifest fits without evicting anything
+        with patch('os.stat', side_effect=os.stat) as mock_stat:
+            cache.put('e', 'v', manifest)
+        self.assertEqual([c for c in mock_stat.call_args_list if c[0][0].endswith('.json')], [])
+        for bundle_uuid in 'a', 'd', 'e':
+            self.assertEqual(cache.get(bundle_uuid, 'v'), manifest)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import requests
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.dss import DSSClient
+from hca.util.exceptions import SwaggerAPIException
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+class _Config(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+@unittest.skipIf(web is None, "aiohttp is not installed")
+class TestAsyncSwaggerClient(unittest.TestCase):
+    files = [{'name': 'file{}'.format(i), 'uuid': str(i)} for i in range(5)]
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.requests = []
+        self.head_failures = 1
+        app = web.Application()
+        app.router.add_get('/v1/bundles/{uuid}', self._get_bundle)
+        app.router.add_route('HEAD', '/v1/files/{uuid}', self._head_file)
+        app.router.add_get('/v1/files/{uuid}', self._get_file, allow_head=False)
+        app.router.add_get('/blob', self._get_blob)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.base_url = 'http://127.0.0.1:{}'.format(self.runner.addresses[0][1])
+        self.client = DSSClient()
+        self.client.host = self.base_url + '/v1'
+        self.client._aio = None
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.aio.close())
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    async def _get_bundle(self, request):
+        self.requests.append(request.path_qs)
+        if request.match_info['uuid'] == 'missing':
+            return web.json_response({'code': 'not_found', 'title': 'No such bundle'}, status=404)
+        start = int(request.query.get('start_at', 0))
+        per_page = 2
+        body = {'bundle': {'uuid': request.match_info['uuid'], 'files': self.files[start:start + per_page]}}
+        headers = {'X-OpenAPI-Paginated-Content-Key': 'bundle.files'}
+        if start + per_page < len(self.files):
+            next_url = '{}/v1/bundles/{}?replica=aws&start_at={}'.format(self.base_url, request.match_info['uuid'],
+                                                                         start + per_page)
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+            return web.json_response(body, status=206, headers=headers)
+        return web.json_response(body, headers=headers)
+
+    async def _head_file(self, request):
+        self.requests.append(request.path_qs)
+        if self.head_failures:
+            self.head_failures -= 1
+            return web.Response(status=503)
+        return web.Response(headers={'X-DSS-SIZE': '42'})
+
+    async def _get_file(self, request):
+        return web.Response(status=301, headers={'Location': '/blob', 'Retry-After': '0'})
+
+    async def _get_blob(self, request):
+        return web.Response(body=b'content', content_type='application/octet-stream')
+
+    def test_call(self):
+        bundle = self._run(self.client.aio.get_bundle(uuid='b', replica='aws', per_page=2))
+        self.assertEqual(bundle['bundle']['files'], self.files[:2])
+        self.assertEqual(self.requests, ['/v1/bundles/b?replica=aws&per_page=2'])
+
+    def test_paginate(self):
+        async def pages():
+            pages = []
+            async for page in self.client.aio.get_bundle.paginate(uuid='b', replica='aws'):
+                pages.append(page)
+            return pages
+
+        pages = self._run(pages())
+        self.assertEqual([page['bundle']['files'] for page in pages],
+                         [self.files[0:2], self.files[2:4], self.files[4:]])
+
+    def test_iterate(self):
+        async def files():
+            files = []
+            async for file_ in self.client.aio.get_bundle.iterate(uuid='b', replica='aws'):
+                files.append(file_)
+            return files
+
+        self.assertEqual(self._run(files()), self.files)
+
+    def test_concurrent_calls(self):
+        async def gather():
+            return await asyncio.gather(*(self.client.aio.get_bundle(uuid=str(i), replica='aws') for i in range(50)))
+
+        bundles = self._run(gather())
+        self.assertEqual([bundle['bundle']['uuid'] for bundle in bundles], [str(i) for i in range(50)])
+
+    def test_status_retried(self):
+        response = self._run(self.client.aio.head_file(uuid='f', replica='aws'))
+        self.assertEqual(response.headers['X-DSS-SIZE'], '42')
+        self.assertEqual(len(self.requests), 2)
+
+    def test_redirect_followed(self):
+        self.assertEqual(self._run(self.client.aio.get_file(uuid='f', replica='aws')), b'content')
+
+    def test_stream(self):
+        async def read():
+            async with self.client.aio.get_file.stream(uuid='f', replica='aws') as response:
+                self.assertEqual(response.status, 200)
+                chunks = []
+                async for chunk in response.content.iter_chunked(3):
+                    chunks.append(chunk)
+                return b''.join(chunks)
+
+        self.assertEqual(self._run(read()), b'content')
+
+    def test_bool_query_parameters_sent_as_by_sync_client(self):
+        self._run(self.client.aio.get_bundle(uuid='b', replica='aws', per_page=True))
+        expected = requests.Request('GET', self.base_url + '/v1/bundles/b',
+                                    params={'replica': 'aws', 'per_page': True}).prepare().path_url
+        self.assertEqual(self.requests, [expected])
+
+    def test_token_obtained_off_the_event_loop(self):
+        threads = []
+
+        def get_authenticated_session():
+            threads.append(threading.current_thread())
+            return Mock(token={'access_token': 'a_token'}, auto_refresh_url=None)
+
+        with patch.object(self.client, 'get_authenticated_session', new=get_authenticated_session):
+            headers = self._run(self.client.aio.get_auth_headers())
+        self.assertEqual(headers, {'Authorization': 'Bearer a_token'})
+        self.assertNotEqual(threads, [threading.main_thread()])
+
+    def test_expired_login_token_refreshed(self):
+        token_uri = 'https://auth.example.com/oauth/token'
+        config = _Config(application_secrets={'installed': {'client_id': 'an_id', 'client_secret': 'a_secret',
+                                                            'token_uri': token_uri}},
+                         oauth2_token={'access_token': 'expired', 'refresh_token': 'a_refresh_token',
+                                       'token_type': 'Bearer', 'expires_at': time.time() - 60})
+        refreshes = []
+
+        def refresh_token(session, token_url, **kwargs):
+            refreshes.append((token_url, kwargs))
+            session.token = {'access_token': 'fresh', 'refresh_token': 'a_refresh_token', 'token_type': 'Bearer',
+                             'expires_at': time.time() + 3600}
+            return session.token
+
+        with patch.object(self.client, 'config', new=config), \
+                patch.object(self.client, '_authenticated_session', new=None), \
+                patch('requests_oauthlib.OAuth2Session.refresh_token', autospec=True, side_effect=refresh_token):
+            self.assertEqual(self._run(self.client.aio.get_auth_headers()), {'Authorization': 'Bearer fresh'})
+            # The refreshed token is saved, and used until it expires
+            self.assertEqual(config.oauth2_token['access_token'], 'fresh')
+            self.assertEqual(self._run(self.client.aio.get_auth_headers()), {'Authorization': 'Bearer fresh'})
+        self.assertEqual(refreshes, [(token_uri, {'client_id': 'an_id', 'client_secret': 'a_secret'})])
+
+    def test_error(self):
+        with self.assertRaises(SwaggerAPIException) as e:
+            self._run(self.client.aio.get_bundle(uuid='missing', replica='aws'))
+        self.assertEqual(e.exception.code, 404)
+        self.assertEqual(e.exception.title, 'No such bundle')
+
+    def test_unknown_method(self):
+        with self.assertRaises(AttributeError):
+            self.client.aio.no_such_method
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.util.checksum_cache import PATH_ENVIRONMENT_VARIABLE, ChecksumCache
+
+
+class TestChecksumCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = ChecksumCache(os.path.join(self.tempdir.name, "config", "checksums.sqlite"))
+        self.file_path = os.path.join(self.tempdir.name, "file")
+        with open(self.file_path, "w") as fh:
+            fh.write("content")
+
+    def tearDown(self):
+        self.cache.close()
+        self.tempdir.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(self.file_path, ['crc32c']))
+        self.cache.put(self.file_path, {'crc32c': 'abc'})
+        self.assertEqual(self.cache.get(self.file_path, ['crc32c']), {'crc32c': 'abc'})
+        # Not all the requested checksums are known
+        self.assertIsNone(self.cache.get(self.file_path))
+
+    def test_path_from_environment(self):
+        path = os.path.join(self.tempdir.name, "elsewhere.sqlite")
+        with patch.dict(os.environ, {PATH_ENVIRONMENT_VARIABLE: path}):
+            cache = ChecksumCache()
+        self.addCleanup(cache.close)
+        cache.put(self.file_path, {'crc32c': 'abc'})
+        self.assertTrue(os.path.isfile(path))
+
+    def test_checksums_accumulate(self):
+        self.cache.put(self.file_path, {'crc32c': 'abc'})
+        self.cache.put(self.file_path, {'sha1': 'def', 'sha256': 'ghi', 's3_etag': 'jkl'})
+        self.assertEqual(self.cache.get(self.file_path),
+                         {'crc32c': 'abc', 'sha1': 'def', 'sha256': 'ghi', 's3_etag': 'jkl'})
+
+    def test_modified_file_misses(self):
+        self.cache.put(self.file_path, {'crc32c': 'abc'})
+        stat = os.stat(self.file_path)
+        os.utime(self.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertIsNone(self.cache.get(self.file_path, ['crc32c']))
+        # A changed file replaces the old entry rather than adding to it
+        self.cache.put(self.file_path, {'sha1': 'def'})
+        self.assertIsNone(self.cache.get(self.file_path, ['crc32c']))
+
+    def test_persistent(self):
+        self.cache.put(self.file_path, {'crc32c': 'abc'})
+        self.cache.close()
+        reopened = ChecksumCache(self.cache.path)
+        self.assertEqual(reopened.get(self.file_path, ['crc32c']), {'crc32c': 'abc'})
+        reopened.close()
+
+    def test_unusable_database(self):
+        with open(os.path.join(self.tempdir.name, "broken.sqlite"), "w") as fh:
+            fh.write("not a database" * 100)
+        cache = ChecksumCache(fh.name)
+        with self.assertLogs('hca', 'WARNING'):
+            cache.put(self.file_path, {'crc32c': 'abc'})
+        with self.assertLogs('hca', 'WARNING'):
+            self.assertIsNone(cache.get(self.file_path, ['crc32c']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.util.fs_walk import FileWalk
+
+
+class TestFileWalk(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = self.tempdir.name
+        self.files = {
+            os.path.join(self.root, "a.txt"): 1,
+            os.path.join(self.root, "b.fastq"): 2,
+            os.path.join(self.root, "sub", "c.fastq"): 3,
+            os.path.join(self.root, "sub", "deeper", "d.txt"): 4,
+        }
+        for path, size in self.files.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fh:
+                fh.write("x" * size)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_walk(self):
+        walk = FileWalk([self.root])
+        self.assertEqual(sorted(walk), sorted(self.files))
+        self.assertTrue(walk.sized.wait(5))
+        self.assertEqual(walk.file_count, 4)
+        self.assertEqual(walk.total_size, 10)
+
+    def test_with_sizes(self):
+        walk = FileWalk([os.path.join(self.root, "sub"), os.path.join(self.root, "a.txt")])
+        del self.files[os.path.join(self.root, "b.fastq")]
+        self.assertEqual(sorted(walk.with_sizes()), sorted(self.files.items()))
+        self.assertTrue(walk.sized.wait(5))
+        self.assertEqual((walk.file_count, walk.total_size), (3, 8))
+
+    def test_filter_and_files(self):
+        extra_file = os.path.join(self.root, "a.txt")
+        walk = FileWalk([os.path.join(self.root, "sub"), extra_file, os.path.join(self.root, "missing")],
+                        file_filter=lambda name: name.endswith(".fastq"))
+        self.assertEqual(sorted(walk), sorted([os.path.join(self.root, "sub", "c.fastq"), extra_file]))
+        self.assertTrue(walk.sized.wait(5))
+        self.assertEqual((walk.file_count, walk.total_size), (2, 4))
+
+    def test_on_sized(self):
+        sized = []
+        walk = FileWalk([self.root])
+        walk.on_sized = lambda file_count, size: sized.append((file_count, size))
+        list(walk)
+        self.assertTrue(walk.sized.wait(5))
+        self.assertEqual((sum(c for c, _ in sized), sum(s for _, s in sized)), (4, 10))
+
+    def test_unreadable_directories_are_skipped(self):
+        unreadable = os.path.join(self.root, "sub")
+
+        def scandir(path):
+            if path == unreadable:
+                raise PermissionError(13, "Permission denied", path)
+            return os.scandir(path)
+
+        walk = FileWalk([self.root])
+        with patch("hca.util.fs_walk.scandir", side_effect=scandir):
+            self.assertEqual(sorted(walk), [os.path.join(self.root, "a.txt"), os.path.join(self.root, "b.fastq")])
+            self.assertTrue(walk.sized.wait(5))
+        self.assertEqual((walk.file_count, walk.total_size), (2, 3))
+
+    def test_each_directory_is_read_once(self):
+        scanned = []
+
+        def scandir(path):
+            scanned.append(path)
+            return os.scandir(path)
+
+        walk = FileWalk([self.root])
+        with patch("hca.util.fs_walk.scandir", side_effect=scandir):
+            self.assertEqual(sorted(walk.with_sizes()), sorted(self.files.items()))
+            self.assertTrue(walk.sized.wait(5))
+        self.assertEqual(sorted(scanned), sorted({os.path.dirname(path) for path in self.files}))
+        self.assertEqual((walk.file_count, walk.total_size), (4, 10))
+
+    @unittest.skipIf(os.name == "nt", "Symbolic links require privileges on Windows")
+    def test_symlinked_directories_are_not_followed(self):
+        os.symlink(os.path.join(self.root, "sub"), os.path.join(self.root, "link"))
+        self.assertEqual(sorted(FileWalk([self.root])), sorted(self.files))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import sys
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_s3
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.util.s3_lister import ShardedS3Lister, list_objects
+
+
+@mock.patch.dict(os.environ, AWS_DEFAULT_REGION='us-east-1', AWS_ACCESS_KEY_ID='x', AWS_SECRET_ACCESS_KEY='x')
+class TestShardedS3Lister(unittest.TestCase):
+    keys = ['top.txt', 'a/1', 'a/2', 'a/b/3', 'a/b/c/4', 'a/d/5', 'ab/6', 'e/7', 'e//8']
+
+    def setUp(self):
+        self.s3_mock = mock_s3()
+        self.s3_mock.start()
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='bucket')
+        for key in self.keys:
+            self.client.put_object(Bucket='bucket', Key=key, Body=key.encode())
+
+    def tearDown(self):
+        self.s3_mock.stop()
+
+    def _list(self, prefix, **kwargs):
+        return sorted(obj['Key'] for obj in ShardedS3Lister(self.client, **kwargs).list_objects('bucket', prefix))
+
+    def test_list_everything(self):
+        self.assertEqual(self._list(''), sorted(self.keys))
+
+    def test_list_prefix(self):
+        for prefix in ('a', 'a/', 'a/b', 'e/', 'top', 'missing'):
+            with self.subTest(prefix=prefix):
+                self.assertEqual(self._list(prefix), sorted(k for k in self.keys if k.startswith(prefix)))
+
+    def test_sub_prefixes_listed_separately(self):
+        prefixes = []
+        real_get_paginator = self.client.get_paginator
+
+        def get_paginator(name):
+            paginator = real_get_paginator(name)
+            real_paginate = paginator.paginate
+
+            def paginate(**kwargs):
+                prefixes.append(kwargs['Prefix'])
+                return real_paginate(**kwargs)
+            paginator.paginate = paginate
+            return paginator
+
+        with mock.patch.object(self.client, 'get_paginator', side_effect=get_paginator):
+            self.assertEqual(self._list('a', threads=2), ['a/1', 'a/2', 'a/b/3', 'a/b/c/4', 'a/d/5', 'ab/6'])
+        self.assertEqual(sorted(prefixes), ['a', 'a/', 'a/b/', 'a/b/c/', 'a/d/', 'ab/'])
+
+    def test_sizes(self):
+        self.assertEqual({obj['Key']: obj['Size'] for obj in list_objects(self.client, 'bucket', 'e')},
+                         {'e/7': 3, 'e//8': 4})
+
+    def test_error(self):
+        with self.assertRaises(ClientError):
+            list(list_objects(self.client, 'no-such-bucket'))
+
+    def test_stop_early(self):
+        objects = ShardedS3Lister(self.client, max_pages=1).list_objects('bucket')
+        next(objects)
+        objects.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
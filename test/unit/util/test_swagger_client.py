@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import argparse
+import base64
+import glob
+import io
 import os
 import sys
 import json
+import tempfile
 import unittest
 import requests
 
@@ -178,5 +183,143 @@ class TestSwaggerClient(unittest.TestCase):
         assert token_one == token_two  # we used one long-lived token for both requests
 
 
+class TestCompiledSpecCache(unittest.TestCase):
+    swagger_url = "https://host.com/base/swagger.json"
+
+    class CachedClient(hca.util.SwaggerClient):
+        pass
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = HCAConfig(save_on_exit=False)
+        self.config._user_config_home = self.tmp_dir.name
+        os.makedirs(self.config.user_config_dir)
+        with open(os.path.join(TEST_DIR, "res", "test_swagger.json"), 'rb') as fh:
+            self.swagger_content = fh.read()
+        self.swagger_filename = os.path.join(self.config.user_config_dir,
+                                             base64.urlsafe_b64encode(self.swagger_url.encode()).decode() + ".json")
+        with open(self.swagger_filename, 'wb') as fh:
+            fh.write(self.swagger_content)
+        self.client = self.CachedClient(self.config, swagger_url=self.swagger_url)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _compiled_spec_filenames(self):
+        return glob.glob(self.client._get_compiled_spec_filename())
+
+    def test_compiled_spec_reused(self):
+        client = self.CachedClient(self.config, swagger_url=self.swagger_url)
+        self.assertEqual(len(self._compiled_spec_filenames()), 1)
+        with mock.patch('hca.util.SwaggerClient.load_swagger_json') as mock_load_swagger_json, \
+                mock.patch('hca.util._md2rst') as mock_md2rst:
+            cached_client = self.CachedClient(self.config, swagger_url=self.swagger_url)
+            self.assertFalse(mock_load_swagger_json.called)
+            self.assertFalse(mock_md2rst.called)
+        self.assertEqual(cached_client.host, client.host)
+        self.assertEqual(cached_client.http_paths, client.http_paths)
+        self.assertEqual(cached_client.swagger_spec, client.swagger_spec)
+        self.assertEqual(cached_client.methods.keys(), client.methods.keys())
+        for method_name, method_data in client.methods.items():
+            self.assertEqual(cached_client.methods[method_name]["signature"], method_data["signature"])
+            self.assertEqual(getattr(cached_client, method_name).__doc__, getattr(client, method_name).__doc__)
+
+    def test_compiled_spec_invalidated_by_spec_change(self):
+        self.CachedClient(self.config, swagger_url=self.swagger_url)
+        old_filenames = self._compiled_spec_filenames()
+        swagger_json = json.loads(self.swagger_content.decode())
+        swagger_json["host"] = "otherhost.com"
+        with open(self.swagger_filename, 'w') as fh:
+            json.dump(swagger_json, fh)
+        client = self.CachedClient(self.config, swagger_url=self.swagger_url)
+        self.assertEqual(client.host, "https://otherhost.com/base")
+        new_filenames = self._compiled_spec_filenames()
+        self.assertEqual(len(new_filenames), 1)
+        self.assertNotEqual(old_filenames, new_filenames)
+
+    def test_corrupt_compiled_spec_ignored(self):
+        self.CachedClient(self.config, swagger_url=self.swagger_url)
+        compiled_spec_filename, = self._compiled_spec_filenames()
+        with open(compiled_spec_filename, 'wb') as fh:
+            fh.write(b"not a pickle")
+        client = self.CachedClient(self.config, swagger_url=self.swagger_url)
+        self.assertEqual(client.host, "https://host.com/base")
+
+
+class TestPaging(unittest.TestCase):
+    def _page(self, number, last=3):
+        page = requests.models.Response()
+        page.status_code = 206 if number < last else 200
+        page.headers["Content-Type"] = "application/json"
+        page.headers["X-OpenAPI-Paginated-Content-Key"] = "results"
+        if number < last:
+            page.headers["Link"] = '<https://host/page{}>; rel="next"'.format(number + 1)
+        page._content = json.dumps({"results": [number * 10, number * 10 + 1]}).encode()
+        return page
+
+    def _fake_request(self, req_args, url=None):
+        self.requested.append(url)
+        return self._page(int(url[len("https://host/page"):]) if url else 0)
+
+    def setUp(self):
+        self.requested = []
+
+    def test_iterate(self):
+        with mock.patch("hca.util._PaginatingClientMethodFactory._request", side_effect=self._fake_request):
+            results = list(DSSClient().get_bundle.iterate(uuid="x", replica="aws", read_ahead=2))
+        self.assertEqual(results, [0, 1, 10, 11, 20, 21, 30, 31])
+        self.assertEqual(self.requested, [None] + ["https://host/page{}".format(i) for i in range(1, 4)])
+
+    def test_pages_fetched_ahead(self):
+        def pages():
+            for i in range(100):
+                fetched.append(i)
+                yield i
+
+        fetched = []
+        items = hca.util._read_ahead(pages(), 3)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.1)
+        # One page being consumed, three waiting in the queue and one waiting to be put into it
+        self.assertEqual(len(fetched), 5)
+        items.close()
+        time.sleep(0.1)
+        self.assertLessEqual(len(fetched), 6)
+
+    def test_error_raised_in_order(self):
+        def pages():
+            yield 1
+            yield 2
+            raise ValueError()
+
+        items = hca.util._read_ahead(pages(), 5)
+        self.assertEqual([next(items), next(items)], [1, 2])
+        self.assertRaises(ValueError, next, items)
+
+    def test_cli_read_ahead(self):
+        parser = argparse.ArgumentParser()
+        DSSClient().build_argparse_subparsers(parser.add_subparsers(), subcommand="get-bundle")
+        args = parser.parse_args(["get-bundle", "--uuid", "x", "--replica", "aws", "--read-ahead", "2"])
+        with mock.patch("hca.util._PaginatingClientMethodFactory._request", side_effect=self._fake_request):
+            result = args.entry_point(args)
+        self.assertEqual(result["results"], [0, 1, 10, 11, 20, 21, 30, 31])
+
+    def test_cli_json_lines(self):
+        parser = argparse.ArgumentParser()
+        DSSClient().build_argparse_subparsers(parser.add_subparsers(), subcommand="get-bundle")
+        args = parser.parse_args(["get-bundle", "--uuid", "x", "--replica", "aws", "--json-lines"])
+        with mock.patch("hca.util._PaginatingClientMethodFactory._request", side_effect=self._fake_request), \
+                mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            self.assertIsNone(args.entry_point(args))
+        self.assertEqual(stdout.getvalue(), "0\n1\n10\n11\n20\n21\n30\n31\n")
+        self.assertEqual(len(self.requested), 4)
+
+        args = parser.parse_args(["get-bundle", "--uuid", "x", "--replica", "aws", "--json-lines", "--no-paginate"])
+        with mock.patch("hca.util._PaginatingClientMethodFactory._request", side_effect=self._fake_request), \
+                mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            args.entry_point(args)
+        self.assertEqual(stdout.getvalue(), "0\n1\n")
+
+
 if __name__ == "__main__":
     unittest.main()
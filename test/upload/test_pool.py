@@ -1,25 +1,61 @@
 import os
 import sys
+import threading
 import unittest
 
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
-from hca.util.pool import ThreadPool
+from hca.util.pool import BoundedExecutor, cancel_futures, shared_executor
 
 
-class TestThreadPool(unittest.TestCase):
+class TestBoundedExecutor(unittest.TestCase):
 
     def setUp(self):
-        self.pool = ThreadPool()
-        self.count = 0
-
-    def test_add_task(self):
-        self.pool.add_task(self._add_to_count, 5)
-        self.pool.add_task(self._add_to_count, 10)
-        self.pool.add_task(self._add_to_count, 15)
-        self.pool.wait_for_completion()
-        self.assertEqual(self.count, 30)
-
-    def _add_to_count(self, amount):
-        self.count += amount
+        self.executor = BoundedExecutor(max_workers=1, max_pending=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit(self):
+        count = []
+        futures = [self.executor.submit(count.append, amount) for amount in (5, 10, 15)]
+        for future in futures:
+            future.result()
+        self.assertEqual(sum(count), 30)
+
+    def test_results_and_errors(self):
+        ok = self.executor.submit(lambda x: x * 2, 21)
+        failed = self.executor.submit(lambda: 1 / 0)
+        self.assertEqual(ok.result(), 42)
+        self.assertIsInstance(failed.exception(), ZeroDivisionError)
+
+    def test_submit_blocks_while_full(self):
+        release = threading.Event()
+        futures = [self.executor.submit(release.wait) for _ in range(2)]
+        submitted = threading.Event()
+        producer = threading.Thread(target=lambda: futures.append(self.executor.submit(len, "")) or submitted.set())
+        producer.start()
+        self.assertFalse(submitted.wait(0.1))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        producer.join()
+        self.assertEqual(futures[-1].result(), 0)
+
+    def test_cancel(self):
+        started, release = threading.Event(), threading.Event()
+        running = self.executor.submit(lambda: started.set() or release.wait())
+        queued = self.executor.submit(release.wait)
+        self.assertTrue(started.wait(5))
+        self.assertEqual(cancel_futures([running, queued]), 1)
+        self.assertTrue(queued.cancelled())
+        release.set()
+        self.assertTrue(running.result())
+        # The cancelled task's slot is free again
+        self.assertEqual(self.executor.submit(len, "ab").result(), 2)
+
+    def test_shared_executor(self):
+        self.assertIs(shared_executor("test-pool", max_workers=2), shared_executor("test-pool"))
+        self.assertIsNot(shared_executor("test-pool"), shared_executor("other-test-pool"))
+        with self.assertRaises(ValueError):
+            shared_executor("test-pool", max_workers=3)
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import Mock
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.upload.lib.api_client import UploadApiException
+from hca.upload.lib.upload_notifier import UploadNotifier
+
+
+class TestUploadNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.api_client = Mock()
+        self.batches = []
+        self.single = []
+        self.api_client.files_upload_notification.side_effect = self._bulk
+        self.api_client.file_upload_notification.side_effect = lambda area_uuid, filename: self.single.append(filename)
+        self.bulk_supported = True
+
+    def _bulk(self, area_uuid, file_list):
+        self.assertEqual(area_uuid, "area")
+        self.batches.append(list(file_list))
+        return self.bulk_supported
+
+    def test_single_notifications_by_default(self):
+        with UploadNotifier(self.api_client, "area") as notifier:
+            notifier.notify("file0")
+            self.assertEqual(self.single, ["file0"])
+            notifier.notify("file1")
+        self.assertEqual(self.single, ["file0", "file1"])
+        self.assertEqual(self.batches, [])
+
+    def test_batches(self):
+        with UploadNotifier(self.api_client, "area", bulk=True, batch_size=3, interval=60) as notifier:
+            for i in range(7):
+                notifier.notify("file{}".format(i))
+        self.assertEqual(sum(self.batches, []), ["file{}".format(i) for i in range(7)])
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+        self.assertEqual(self.single, [])
+        self.assertEqual(notifier.failures, {})
+
+    def test_interval(self):
+        sent = threading.Event()
+        self.api_client.files_upload_notification.side_effect = lambda *args: sent.set() or True
+        notifier = UploadNotifier(self.api_client, "area", bulk=True, batch_size=100, interval=0.01)
+        notifier.notify("file")
+        self.assertTrue(sent.wait(5))
+        notifier.close()
+
+    def test_fallback_to_single_notifications(self):
+        self.bulk_supported = False
+        notifier = UploadNotifier(self.api_client, "area", bulk=True, batch_size=2, interval=60)
+        notifier.notify("file0")
+        notifier.notify("file1")
+        while notifier.bulk_supported is None:
+            notifier._flusher.join(0.01)
+        notifier.notify("file2")
+        notifier.close()
+        self.assertEqual(self.batches, [["file0", "file1"]])
+        self.assertEqual(sorted(self.single), ["file0", "file1", "file2"])
+
+    def test_fallback_when_bulk_notification_fails(self):
+        self.api_client.files_upload_notification.side_effect = UploadApiException("nope")
+        with UploadNotifier(self.api_client, "area", bulk=True) as notifier:
+            notifier.notify("file0")
+            notifier.notify("file1")
+        self.assertEqual(sorted(self.single), ["file0", "file1"])
+        self.assertEqual(notifier.failures, {})
+
+    def test_failures_of_single_notifications(self):
+        self.api_client.files_upload_notification.side_effect = UploadApiException("nope")
+
+        def notify_one(area_uuid, filename):
+            if filename == "file1":
+                raise UploadApiException("nope")
+            self.single.append(filename)
+
+        self.api_client.file_upload_notification.side_effect = notify_one
+        with UploadNotifier(self.api_client, "area", bulk=True) as notifier:
+            notifier.notify("file0")
+            notifier.notify("file1")
+        self.assertEqual(self.single, ["file0"])
+        self.assertEqual(list(notifier.failures), ["file1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
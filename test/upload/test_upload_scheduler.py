@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from hca.upload.lib.upload_scheduler import UploadScheduler, estimate_makespan
+
+
+class TestUploadScheduler(unittest.TestCase):
+
+    def test_largest_first_and_small_files_batched(self):
+        scheduler = UploadScheduler(window=None, small_file_size=100, max_batch_files=3, max_batch_size=1000)
+        sizes = {"tiny{}".format(i): 10 for i in range(7)}
+        sizes.update(big=5000, medium=200, huge=10000)
+        for file_path, file_size in sorted(sizes.items()):
+            self.assertEqual(scheduler.add(file_path, file_size), [])
+        jobs = scheduler.flush()
+
+        self.assertEqual([job.file_paths for job in jobs[:3]], [["huge"], ["big"], ["medium"]])
+        self.assertEqual([len(job.file_paths) for job in jobs[3:]], [3, 3, 1])
+        self.assertEqual(sorted(sum((job.file_paths for job in jobs), [])), sorted(sizes))
+        self.assertEqual([job.size for job in jobs], sorted((job.size for job in jobs), reverse=True))
+        self.assertEqual(scheduler.flush(), [])
+
+    def test_batch_size_limit(self):
+        scheduler = UploadScheduler(window=None, small_file_size=100, max_batch_size=150)
+        for i in range(4):
+            scheduler.add(str(i), 60)
+        self.assertEqual([len(job.file_paths) for job in scheduler.flush()], [2, 2])
+
+    def test_window(self):
+        scheduler = UploadScheduler(window=2, small_file_size=1)
+        self.assertEqual(scheduler.add("a", 1), [])
+        self.assertEqual([job.file_paths for job in scheduler.add("b", 2)], [["b"], ["a"]])
+        self.assertEqual(scheduler.add("c", 3), [])
+        self.assertEqual([job.file_paths for job in scheduler.flush()], [["c"]])
+
+    def test_first_window(self):
+        scheduler = UploadScheduler(window=3, first_window=1, small_file_size=1, max_window_wait=None)
+        self.assertEqual([job.file_paths for job in scheduler.add("a", 1)], [["a"]])
+        self.assertEqual(scheduler.add("b", 1), [])
+        self.assertEqual(scheduler.add("c", 1), [])
+        self.assertEqual(len(scheduler.add("d", 1)), 3)
+
+    def test_window_released_after_waiting(self):
+        scheduler = UploadScheduler(window=10, small_file_size=1, max_window_wait=60)
+        with patch('hca.upload.lib.upload_scheduler.time.time', side_effect=[0, 1, 60, 61, 62]):
+            self.assertEqual(scheduler.add("a", 1), [])
+            self.assertEqual([job.file_paths for job in scheduler.add("b", 2)], [["b"], ["a"]])
+            self.assertEqual(scheduler.add("c", 3), [])
+
+    def test_remaining_work(self):
+        scheduler = UploadScheduler(window=None, small_file_size=100)
+        scheduler.add("big", 1000)
+        scheduler.add("tiny1", 10)
+        scheduler.add("tiny2", 20)
+        self.assertEqual(scheduler.remaining_work(), ([1000, 10, 20], 1000))
+        scheduler.flush()
+        self.assertEqual(sorted(scheduler.remaining_work()[0]), [30, 1000])
+        scheduler.file_finished("big")
+        scheduler.file_finished("tiny1")
+        self.assertEqual(scheduler.remaining_work(), ([20], 20))
+        scheduler.file_finished("tiny2")
+        self.assertEqual(scheduler.remaining_work(), ([], 0))
+
+    def test_estimate_makespan(self):
+        self.assertEqual(estimate_makespan([10, 10, 10, 10], workers=2), 20)
+        self.assertEqual(estimate_makespan([100, 10, 10], workers=4), 100)
+        self.assertEqual(estimate_makespan([30], workers=4, largest_file=40), 40)
+        self.assertEqual(estimate_makespan([], workers=4), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()